@@ -0,0 +1,570 @@
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from itertools import chain
+
+from src.lex import Lexer, TokenStore, Symbols
+from src.parse import Parser, AstNode
+from src.cache import IncludeCache
+from src.emit import Emitter
+from src.opt import ConstantFolder, DeadCodeEliminator, Inliner, LoopOptimizer, CommonSubexpressionEliminator
+from src.peephole import Peephole
+from src.x86 import writeExecutable
+from pasic import dumpAst
+
+SOURCES = ['std/std.pasic', 'main.pasic'] + \
+    sorted(os.path.join(d, f) for d in ['tests', 'examples'] for f in os.listdir(d) if f.endswith('.pasic'))
+
+def synthetic_source(lines):
+    '''
+    Write a program of at least `lines` lines, built by repeating every source in the repo,
+    to a temporary file and return its path. Only meant for the lexer, it does not compile.
+    '''
+    chunks = [open(path).read() for path in SOURCES]
+    body = '\n'.join(chunks)
+    repeat = lines // body.count('\n') + 1
+    file = tempfile.NamedTemporaryFile('w', suffix='.pasic', delete=False)
+    with file:
+        file.write('\n'.join([body] * repeat))
+    return file.name
+
+def plain_source(lines):
+    ''' Like synthetic_source(), but a program without `include` or `macro` that parses '''
+    block = '''let x = 1
+let s = "a string
+over two lines"
+while x < 10 do
+    x = x + (3 * x) % 7 // comment
+    if x >= 5 then
+        print(x)
+    end
+end
+'''
+    file = tempfile.NamedTemporaryFile('w', suffix='.pasic', delete=False)
+    with file:
+        file.write(block * (lines // block.count('\n') + 1))
+    return file.name
+
+def lexer_with(engine, path):
+    lexer = Lexer(path)
+    lexer.engine = engine
+    return lexer
+
+def lex_with(engine, path):
+    return lexer_with(engine, path).lexfile()
+
+def rows(store: TokenStore):
+    return [(store.text(i), store.kind(i), store.pos(i)) for i in range(len(store))]
+
+def peak_memory(fn):
+    ''' Peak traced allocation in bytes while fn runs, and its result '''
+    tracemalloc.start()
+    try:
+        result = fn()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+def timeit(fn, repeat=5):
+    ''' Best wall-clock time of `repeat` calls to fn, and its last result '''
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def bench_lex():
+    big = synthetic_source(30000)
+    try:
+        # The engines must agree token by token before their speed means anything
+        plain = plain_source(100)
+        for path in SOURCES + [big, plain]:
+            classic, regex = rows(lex_with('classic', path)), rows(lex_with('regex', path))
+            streamed = [(t.text, t.kind, t.pos) for t in Lexer(path, lazy=True).stream()]
+            assert len(classic) == len(regex) == len(streamed), f'{path}: {len(classic)}, {len(regex)}, {len(streamed)} tokens'
+            for a, b, c in zip(classic, regex, streamed):
+                assert a == b == c, f'{path}: {a}, {b}, {c}'
+        os.remove(plain)
+
+        print(f'{"file":<24} {"tokens":>8} {"classic tok/s":>14} {"regex tok/s":>14} {"speedup":>8}')
+        for path, name in [('std/std.pasic', 'std/std.pasic'), (big, 'synthetic')]:
+            t_classic, tokens = timeit(lambda: lex_with('classic', path))
+            t_regex, _ = timeit(lambda: lex_with('regex', path))
+            n = len(tokens)
+            print(f'{name:<24} {n:>8} {n / t_classic:>14,.0f} {n / t_regex:>14,.0f} {t_classic / t_regex:>7.1f}x')
+    finally:
+        os.remove(big)
+
+def bench_tokens():
+    ''' Memory held by one Token object per token versus the array-backed TokenStore '''
+    big = synthetic_source(30000)
+    try:
+        for engine in Lexer.ENGINES:
+            objects, _ = peak_memory(lambda: list(lexer_with(engine, big).tokens()))
+            store, rows = peak_memory(lambda: lex_with(engine, big))
+            n = len(rows)
+            print(f'{engine:<8} {n} tokens: list[Token] peak {objects / 2**20:.1f} MiB ({objects / n:.0f} B/token), '
+                  f'TokenStore peak {store / 2**20:.1f} MiB ({store / n:.0f} B/token), {objects / store:.1f}x less')
+    finally:
+        os.remove(big)
+
+def parse_statements(parser):
+    ''' Parse statement by statement without keeping them, so only the token side uses memory '''
+    parser.prepare()
+    count = 0
+    while not parser.checkToken(Symbols.EOF):
+        parser.statement()
+        count += 1
+    return count
+
+def bench_stream():
+    ''' Peak memory of parsing a growing program from a TokenStore and from Lexer.stream() '''
+    print(f'{"lines":>8} {"statements":>10} {"buffered":>12} {"streamed":>12}')
+    for lines in [10000, 20000, 40000, 80000]:
+        path = plain_source(lines)
+        try:
+            buffered, count = peak_memory(lambda: parse_statements(Parser(Lexer(path).lexfile())))
+            streamed, _ = peak_memory(lambda: parse_statements(Parser(Lexer(path, lazy=True).stream())))
+            print(f'{lines:>8} {count:>10} {buffered / 2**20:>10.2f}MiB {streamed / 2**20:>10.2f}MiB')
+        finally:
+            os.remove(path)
+
+def bench_cache():
+    ''' Preprocessing a program that includes std, without the include cache, on a miss and on a hit '''
+    path = 'tests/A-includes.pasic'
+    with tempfile.TemporaryDirectory() as directory:
+        def prepare(cache):
+            Parser(Lexer(path).lexfile(), cache).prepare()
+            return cache
+        def miss():
+            for entry in os.listdir(directory):
+                os.remove(os.path.join(directory, entry))
+            return prepare(IncludeCache(directory))
+        t_none, _ = timeit(lambda: prepare(None))
+        t_miss, _ = timeit(miss)
+        prepare(IncludeCache(directory))
+        t_hit, cache = timeit(lambda: prepare(IncludeCache(directory)))
+        assert cache.hits == 1, cache.stats()
+    print(f'{path}: no cache {t_none * 1000:.2f} ms, miss {t_miss * 1000:.2f} ms, hit {t_hit * 1000:.2f} ms ({t_none / t_hit:.1f}x faster)')
+
+def include_tree(directory, depth, fanout=2):
+    '''
+    Write a tree of files `depth` levels deep where every file includes `fanout` children
+    and a common file, returns the root. Every file defines a function and a macro.
+    '''
+    common = os.path.join(directory, 'common.pasic')
+    with open(common, 'w') as file:
+        file.write('macro COMMON 1 end\n' + 'let common = COMMON + 2 * 3\n' * 50)
+    count = 0
+    def write(level):
+        nonlocal count
+        count += 1
+        path = os.path.join(directory, f'f{count}.pasic')
+        children = [write(level + 1) for _ in range(fanout)] if level < depth else []
+        with open(path, 'w') as file:
+            file.write(f'include "{common}"\n')
+            for child in children:
+                file.write(f'include "{child}"\n')
+            file.write(f'macro M{count} {count} end\nfunc g{count}(a)\n    return a + M{count}\nend\n')
+            file.write('let x = (1 + 2) * 3\n' * 20)
+        return path
+    return write(1)
+
+def bench_includes():
+    ''' Include expansion over include trees of growing size, every file also includes a common one '''
+    print(f'{"files":>6} {"tokens":>8} {"lexed":>6} {"time":>10} {"tok/s":>10}')
+    for depth in [4, 6, 8, 10]:
+        with tempfile.TemporaryDirectory() as directory:
+            root = include_tree(directory, depth)
+            def expand():
+                parser = Parser(Lexer(root).lexfile())
+                parser.expandIncludes()
+                return parser
+            elapsed, parser = timeit(expand, repeat=3)
+            files, tokens = 2 ** depth, len(parser.tokens)
+            print(f'{files:>6} {tokens:>8} {len(parser.store.names):>6} {elapsed * 1000:>8.1f}ms {tokens / elapsed:>10,.0f}')
+    with tempfile.TemporaryDirectory() as directory:
+        root = include_tree(directory, 500, fanout=1)
+        elapsed, _ = timeit(lambda: Parser(Lexer(root).lexfile()).expandIncludes(), repeat=1)
+        print(f'chain of 500 nested includes: {elapsed * 1000:.1f}ms')
+
+def bench_macros():
+    ''' Macro expansion over programs using more and more nested macros '''
+    print(f'{"uses":>8} {"tokens out":>10} {"time":>10} {"tok/s":>10}')
+    for uses in [2000, 4000, 8000, 16000]:
+        file = tempfile.NamedTemporaryFile('w', suffix='.pasic', delete=False)
+        with file:
+            file.write('macro ONE 1 end\nmacro TWICE(a) (a) + (a) end\nmacro ADD(a, b) TWICE(a) - (b) end\n')
+            file.write('let x = ADD(ONE, TWICE(ONE)) * ADD(2, (3))\n' * uses)
+        try:
+            def expand():
+                parser = Parser(Lexer(file.name).lexfile())
+                parser.expandMacros()
+                return parser
+            elapsed, parser = timeit(expand, repeat=3)
+            tokens = len(parser.tokens)
+            print(f'{uses:>8} {tokens:>10} {elapsed * 1000:>8.1f}ms {tokens / elapsed:>10,.0f}')
+        finally:
+            os.remove(file.name)
+
+def bench_registry():
+    ''' Compile time and peak memory of hello world with std, and how much of std it reads '''
+    file = tempfile.NamedTemporaryFile('w', suffix='.pasic', delete=False)
+    with file:
+        file.write('include "std/std.pasic"\nprint("Hello, World!")\nwrite(STDOUT, "bye\\n", 4)\n')
+    try:
+        def compile():
+            parser = Parser(Lexer(file.name).lexfile())
+            parser.program()
+            return parser
+        elapsed, parser = timeit(compile)
+        memory, _ = peak_memory(compile)
+        read = sum(macro.body is not None for macro in parser.macros.values())
+        print(f'hello world with std: {elapsed * 1000:.2f} ms, peak {memory / 2**20:.2f} MiB, '
+              f'{len(parser.constants)} constants, {len(parser.macros)} other macros of which {read} read')
+    finally:
+        os.remove(file.name)
+
+def bench_expressions():
+    ''' Parsing the neighbour conditions and index arithmetic of examples/gol.pasic '''
+    block = '''let neighbor_index = curr*elements + COL * neighbor_i + neighbor_j
+if (di == 0) & (dj == 0) then
+else if (neighbor_i >= 0) & (neighbor_i < ROW) & (neighbor_j >= 0) & (neighbor_j < COL) & (board[neighbor_index] == 1) then
+    neighbors = neighbors + 1
+end
+if (neighbors < 2) | (neighbors > 3) then
+    board[other*elements + COL * i + j] = ((*winsize >> 16) & 65535) - 2 ^ iter % 2
+end
+'''
+    file = tempfile.NamedTemporaryFile('w', suffix='.pasic', delete=False)
+    with file:
+        names = ['curr', 'elements', 'COL', 'ROW', 'neighbor_i', 'neighbor_j', 'di', 'dj', 'neighbors', 'other', 'i', 'j', 'winsize', 'iter']
+        file.write(''.join(f'let {name} = 1\n' for name in names) + 'let board[8] = [0]\n')
+        file.write(block * 2000)
+    try:
+        store = Lexer(file.name).lexfile()
+        def parse():
+            parser = Parser(store)
+            return parser, parse_statements(parser)
+        elapsed, (parser, count) = timeit(parse)
+        tokens = len(parser.tokens)
+        print(f'{count} statements, {tokens} tokens: {elapsed * 1000:.1f} ms, {tokens / elapsed:,.0f} tok/s')
+    finally:
+        os.remove(file.name)
+
+def count_nodes(node):
+    if isinstance(node, list):
+        return sum(count_nodes(item) for item in node)
+    if isinstance(node, AstNode):
+        return 1 + sum(count_nodes(value) for value in node.asdict().values())
+    return 0
+
+def bench_ast():
+    ''' Memory held by the AST per node and parse time of a program of 50k statements '''
+    path = plain_source(150000)
+    try:
+        store = Lexer(path).lexfile()
+        def parse():
+            parser = Parser(store)
+            parser.prepare()
+            parser.nl()
+            tracemalloc.start()
+            try:
+                statements = parser.statements()['statements']
+                return tracemalloc.get_traced_memory()[0], statements
+            finally:
+                tracemalloc.stop()
+        memory, statements = parse()
+        nodes = count_nodes(statements)
+        elapsed, _ = timeit(lambda: parse_statements(Parser(store)), repeat=3)
+        print(f'{len(statements)} statements, {nodes} nodes: {memory / 2**20:.1f} MiB ({memory / nodes:.0f} B/node), '
+              f'parsed in {elapsed * 1000:.0f} ms')
+    finally:
+        os.remove(path)
+
+def bench_dump():
+    ''' Writing the AST of a program of 1k statements with --dump-ast, next to generating its code '''
+    path = plain_source(3000)
+    try:
+        program = Parser(Lexer(path).lexfile()).program()
+        with tempfile.TemporaryDirectory() as directory:
+            def emit():
+                emitter = Emitter(os.path.join(directory, 'out.asm'))
+                emitter.fromdict(program)
+                emitter.writeFile()
+            t_emit, _ = timeit(emit)
+            for compact in [False, True]:
+                output = os.path.join(directory, 'parse.json')
+                elapsed, _ = timeit(lambda: dumpAst(program, output, compact))
+                print(f'{"compact" if compact else "indented":<9} dump {elapsed * 1000:>6.0f} ms, '
+                      f'{os.path.getsize(output) / 2**20:>5.1f} MiB (code generation {t_emit * 1000:.0f} ms)')
+    finally:
+        os.remove(path)
+
+def bench_emit():
+    ''' Emitted assembly lines per second for growing programs '''
+    print(f'{"statements":>10} {"lines":>8} {"time":>10} {"lines/s":>10}')
+    for lines in [15000, 30000, 60000]:
+        path = plain_source(lines)
+        try:
+            program = Parser(Lexer(path).lexfile()).program()
+            with tempfile.TemporaryDirectory() as directory:
+                def emit():
+                    emitter = Emitter(os.path.join(directory, 'out.asm'))
+                    emitter.fromdict(program)
+                    emitter.writeFile()
+                    return emitter
+                elapsed, emitter = timeit(emit, repeat=3)
+            count = sum(line.count('\n') for line in emitter.lines())
+            print(f'{len(program["program"]["statements"]):>10} {count:>8} {elapsed * 1000:>8.0f}ms {count / elapsed:>10,.0f}')
+        finally:
+            os.remove(path)
+
+def bench_backend():
+    ''' Time from emitted assembly to an executable for every test program, with nasm + ld and natively '''
+    has_nasm = shutil.which('nasm') and shutil.which('ld')
+    if not has_nasm:
+        print('nasm or ld not found, only timing the native backend')
+    print(f'{"program":<34} {"nasm + ld":>10} {"native":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'out')
+        for path in sorted(os.path.join('tests', f) for f in os.listdir('tests') if f.endswith('.pasic')):
+            emitter = Emitter(f'{output}.asm')
+            emitter.fromdict(Parser(Lexer(path).lexfile()).program())
+            def nasm():
+                emitter.writeFile()
+                subprocess.run(['nasm', '-felf64', '-g', f'{output}.asm'], check=True)
+                subprocess.run(['ld', '-o', output, f'{output}.o'], check=True)
+            t_nasm = f'{timeit(nasm, repeat=3)[0] * 1000:.1f}ms' if has_nasm else '-'
+            t_native, _ = timeit(lambda: writeExecutable(output, emitter.lines()), repeat=3)
+            print(f'{path:<34} {t_nasm:>10} {t_native * 1000:>8.1f}ms')
+
+HEADLESS_GOL = '''// examples/gol.pasic without a terminal: a fixed board, a fixed number of generations, no sleep
+macro ROW 60 end
+macro COL 100 end
+macro GENERATIONS 40 end
+
+let board[ROW * COL * 2] = [0]
+let elements = ROW * COL
+let seed = 12345
+let i = 0
+while i < elements do
+    seed = (seed * 1103515245 + 12345) % 2147483648
+    board[i] = (seed >> 16) & 1
+    i = i + 1
+end
+
+let iter = 0
+while iter < GENERATIONS do
+    let curr = iter % 2
+    i = 0
+    while i < ROW do
+        let j = 0
+        while j < COL do
+            let index = curr*elements + COL * i + j
+            let neighbors = 0
+            let di = -1
+            while di <= 1 do
+                let dj = -1
+                while dj <= 1 do
+                    let neighbor_i = i + di
+                    let neighbor_j = j + dj
+                    let neighbor_index = curr*elements + COL * neighbor_i + neighbor_j
+                    if (di == 0) & (dj == 0) then
+                    else if (neighbor_i >= 0) & (neighbor_i < ROW) & (neighbor_j >= 0) & (neighbor_j < COL) & (board[neighbor_index] == 1) then
+                        neighbors = neighbors + 1
+                    end
+                    dj = dj + 1
+                end
+                di = di + 1
+            end
+
+            let other = 1
+            if curr == 1 then other = 0 end
+            if (neighbors < 2) | (neighbors > 3) then
+                board[other*elements + COL * i + j] = 0
+            else if (board[index] == 0) & (neighbors == 3) then
+                board[other*elements + COL * i + j] = 1
+            else
+                board[other*elements + COL * i + j] = board[index]
+            end
+            j = j + 1
+        end
+        i = i + 1
+    end
+    iter = iter + 1
+end
+
+let alive = 0
+i = 0
+while i < elements do
+    alive = alive + board[i]
+    i = i + 1
+end
+print(alive)
+'''
+
+def instruction_count(emitter):
+    ''' Instructions in the emitted program, without the DUMP routine '''
+    code = chain(emitter.codeheader, emitter.code, emitter.funcCode)
+    return sum(line.startswith('\t') and not line.startswith('\t;') and not line.startswith('\tglobal') for line in code)
+
+def loop_instruction_count(emitter):
+    ''' Instructions of the innermost loops, the ones every iteration runs '''
+    code = chain(emitter.codeheader, emitter.code, emitter.funcCode)
+    open_loops, counts, outer = [], {}, set()
+    for line in code:
+        if line.startswith('.WHILE_') and not line.startswith('.WHILE_COND_'):
+            if open_loops:
+                outer.add(open_loops[-1])
+            open_loops.append(line)
+            counts[line] = 0
+        elif line.startswith('.END_WHILE_'):
+            open_loops.pop()
+        elif open_loops and line.startswith('\t') and not line.startswith('\t;'):
+            counts[open_loops[-1]] += 1
+    return sum(count for loop, count in counts.items() if loop not in outer)
+
+def build(path, output, peephole=True, loops=True, subexpressions=True):
+    ''' Compile path the way pasic.py does, returns the emitter '''
+    program = Parser(Lexer(path).lexfile()).program()
+    Inliner().program(program)
+    ConstantFolder().program(program)
+    if loops:
+        LoopOptimizer().program(program)
+    if subexpressions:
+        CommonSubexpressionEliminator().program(program)
+    DeadCodeEliminator().program(program)
+    emitter = Emitter(f'{output}.asm')
+    emitter.fromdict(program)
+    if peephole:
+        emitter.optimize(Peephole())
+    writeExecutable(output, emitter.lines())
+    return emitter
+
+def runtime_programs(directory):
+    gol = os.path.join(directory, 'gol.pasic')
+    with open(gol, 'w') as file:
+        file.write(HEADLESS_GOL)
+    return [('tests/5-rule110.pasic', 'tests/5-rule110.pasic'), ('examples/sort.pasic', 'examples/sort.pasic'), (gol, 'headless gol')]
+
+def bench_runtime():
+    ''' Run time of compiled programs, built with the native backend '''
+    print(f'{"program":<24} {"instructions":>12} {"run time":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        for path, name in runtime_programs(directory):
+            output = os.path.join(directory, 'out')
+            emitter = build(path, output)
+            elapsed, _ = timeit(lambda: subprocess.run([output], check=True, stdout=subprocess.DEVNULL), repeat=10)
+            print(f'{name:<24} {instruction_count(emitter):>12} {elapsed * 1000:>8.1f}ms')
+
+def bench_peephole():
+    ''' Instructions and run time without and with the peephole pass '''
+    print(f'{"program":<24} {"instructions":>16} {"run time":>20}')
+    with tempfile.TemporaryDirectory() as directory:
+        for path, name in runtime_programs(directory):
+            counts, times = [], []
+            for peephole in (False, True):
+                output = os.path.join(directory, 'out')
+                counts.append(instruction_count(build(path, output, peephole)))
+                times.append(timeit(lambda: subprocess.run([output], check=True, stdout=subprocess.DEVNULL), repeat=10)[0])
+            print(f'{name:<24} {counts[0]:>7} -> {counts[1]:<6} {times[0] * 1000:>8.1f}ms -> {times[1] * 1000:.1f}ms')
+        before = after = 0
+        for path in sorted(glob.glob('tests/*.pasic') + glob.glob('examples/*.pasic')):
+            output = os.path.join(directory, 'out')
+            before += instruction_count(build(path, output, False))
+            after += instruction_count(build(path, output))
+        print(f'{"all tests and examples":<24} {before:>7} -> {after:<6} ({(before - after) / before:.0%} fewer)')
+
+def compare_builds(option):
+    ''' Instructions, instructions of the innermost loops and run time without and with the pass build() turns off by option '''
+    print(f'{"program":<24} {"instructions":>16} {"innermost loops":>16} {"run time":>20}')
+    with tempfile.TemporaryDirectory() as directory:
+        for path, name in runtime_programs(directory) + [('examples/gol.pasic', 'examples/gol.pasic')]:
+            counts, inner, times = [], [], []
+            for enabled in (False, True):
+                output = os.path.join(directory, 'out')
+                emitter = build(path, output, **{option: enabled})
+                counts.append(instruction_count(emitter))
+                inner.append(loop_instruction_count(emitter))
+                if path != 'examples/gol.pasic': # runs until interrupted
+                    times.append(timeit(lambda: subprocess.run([output], check=True, stdout=subprocess.DEVNULL), repeat=10)[0])
+            elapsed = f'{times[0] * 1000:>8.1f}ms -> {times[1] * 1000:.1f}ms' if times else f'{"-":>20}'
+            print(f'{name:<24} {counts[0]:>7} -> {counts[1]:<6} {inner[0]:>7} -> {inner[1]:<6} {elapsed}')
+
+def bench_loops():
+    ''' Without and with the loop optimizations '''
+    compare_builds('loops')
+
+def bench_subexpressions():
+    ''' Without and with common subexpression elimination '''
+    compare_builds('subexpressions')
+
+HELLO_WORLD = '''include "std/std.pasic"
+
+print("hello, world!\\n")
+'''
+
+def bench_deadcode():
+    ''' Assembly, executable size and assembling time of a hello world using std, without and with dead code elimination '''
+    has_nasm = shutil.which('nasm') and shutil.which('ld')
+    print(f'{"":<22} {"asm lines":>10} {"native":>10} {"nasm + ld":>10} {"assembling":>11}')
+    with tempfile.TemporaryDirectory() as directory:
+        source, output = os.path.join(directory, 'hello.pasic'), os.path.join(directory, 'hello')
+        with open(source, 'w') as file:
+            file.write(HELLO_WORLD)
+        for eliminate in (False, True):
+            Emitter.treeShaking = eliminate
+            program = Parser(Lexer(source).lexfile()).program()
+            if eliminate:
+                DeadCodeEliminator().program(program)
+            emitter = Emitter(f'{output}.asm')
+            emitter.fromdict(program)
+            writeExecutable(output, emitter.lines())
+            native = os.path.getsize(output)
+            def nasm():
+                emitter.writeFile()
+                subprocess.run(['nasm', '-felf64', f'{output}.asm'], check=True)
+                subprocess.run(['ld', '-o', output, f'{output}.o'], check=True)
+            if has_nasm:
+                elapsed, _ = timeit(nasm, repeat=5)
+                linked, elapsed = f'{os.path.getsize(output)}B', f'{elapsed * 1000:.1f}ms'
+            else:
+                linked = elapsed = '-'
+            name = 'dead code eliminated' if eliminate else 'everything emitted'
+            print(f'{name:<22} {len(list(emitter.lines())):>10} {native:>9}B {linked:>10} {elapsed:>11}')
+        Emitter.treeShaking = True
+
+BENCHMARKS = {
+    'lex': bench_lex,
+    'tokens': bench_tokens,
+    'stream': bench_stream,
+    'cache': bench_cache,
+    'includes': bench_includes,
+    'macros': bench_macros,
+    'registry': bench_registry,
+    'expressions': bench_expressions,
+    'ast': bench_ast,
+    'dump': bench_dump,
+    'emit': bench_emit,
+    'backend': bench_backend,
+    'runtime': bench_runtime,
+    'peephole': bench_peephole,
+    'deadcode': bench_deadcode,
+    'loops': bench_loops,
+    'subexpressions': bench_subexpressions,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit(f"Unknown benchmark '{name}', expected one of: {', '.join(BENCHMARKS)}")
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
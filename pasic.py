@@ -1,38 +1,105 @@
 from src.lex import *
 from src.parse import *
 from src.emit import *
+from src.cache import IncludeCache
+from src.opt import ConstantFolder, DeadCodeEliminator, Inliner, LoopOptimizer, CommonSubexpressionEliminator
+from src.peephole import Peephole
+from src.x86 import writeExecutable
 from pathlib import Path
-from dataclasses import is_dataclass, asdict
 import sys
 import json
 import subprocess
 
+def getFlag(name, default=None):
+    ''' Value of a `--name=value` command line flag, `default` if it is not given '''
+    for arg in sys.argv[2:]:
+        if arg.startswith(f'--{name}='):
+            return arg.split('=', 1)[1]
+    return default
+
 def main():
     if len(sys.argv) < 2:
         sys.exit("Error: no input file.")
     fileName = sys.argv[1]
     outputName = Path(f"{Path(fileName).stem}.asm")
 
-    lexer = Lexer(fileName)
-    parser = Parser(lexer.lexfile())
+    Lexer.engine = getFlag('lexer', Lexer.engine)
+    if Lexer.engine not in Lexer.ENGINES:
+        sys.exit(f"Error: unknown lexer engine {Lexer.engine!r}, expected one of {', '.join(Lexer.ENGINES)}.")
+
+    backend = getFlag('backend', 'nasm')
+    if backend not in ('nasm', 'native'):
+        sys.exit(f"Error: unknown backend {backend!r}, expected nasm or native.")
+
+    rules = getFlag('peephole')
+    rules = Peephole.RULES if rules is None else [rule for rule in rules.split(',') if rule]
+    for rule in rules:
+        if rule not in Peephole.RULES:
+            sys.exit(f"Error: unknown peephole rule {rule!r}, expected some of {', '.join(Peephole.RULES)}.")
+
+    cache = IncludeCache() if '--no-cache' not in sys.argv else None
+    if '--stream' in sys.argv:
+        parser = Parser(Lexer(fileName, lazy=True).stream())
+    else:
+        parser = Parser(Lexer(fileName).lexfile(), cache)
     emitter = Emitter(outputName.name)
 
     program = parser.program()
-    with open('parse.json', 'w') as file:
-        json.dump(program, file, indent=2, cls=EnhancedJSONEncoder)
+    if '--dump-ast' in sys.argv or getFlag('dump-ast'):
+        dumpAst(program, getFlag('dump-ast', 'parse.json'), compact='--dump-ast-compact' in sys.argv)
+    optimize = '-O0' not in sys.argv
+    Emitter.strengthReduction = Emitter.treeShaking = optimize
+    # the passes over the AST, in the order they run
+    passes = []
+    if optimize:
+        passes = [Pass() for Pass in (Inliner, ConstantFolder, LoopOptimizer, CommonSubexpressionEliminator, DeadCodeEliminator)]
+        for optimizer in passes:
+            optimizer.program(program)
     emitter.fromdict(program)
-    emitter.writeFile()
-
-    subprocess.run(["nasm", "-felf64", "-g", outputName.name])
-    subprocess.run(["ld", "-o", outputName.stem, f'{outputName.stem}.o'])
+    peephole = Peephole(rules) if optimize else None
+    if peephole is not None:
+        emitter.optimize(peephole)
+    if '-S' in sys.argv:
+        emitter.writeFile(sys.stdout)
+    elif backend == 'native':
+        writeExecutable(outputName.stem, emitter.lines())
+    else:
+        emitter.writeFile()
+        subprocess.run(["nasm", "-felf64", "-g", outputName.name])
+        subprocess.run(["ld", "-o", outputName.stem, f'{outputName.stem}.o'])
+    if '--stats' in sys.argv:
+        for stats in (cache, *passes, peephole):
+            if stats is not None:
+                eprint(stats.stats())
+    if '-S' in sys.argv:
+        return
     if '-r' in sys.argv or '--run' in sys.argv:
         execute = subprocess.run([f"./{outputName.stem}"])
         print(f'return code: {execute.returncode}')
 
+def dumpAst(program: dict, path: str, compact=False):
+    '''
+    Write the AST as JSON to path, chunk by chunk as it is encoded instead of building the
+    whole document first. The compact form has no whitespace and encodes one top level
+    statement at a time, which lets json use its C encoder.
+    '''
+    with open(path, 'w') as file:
+        if not compact:
+            for chunk in EnhancedJSONEncoder(indent=2).iterencode(program):
+                file.write(chunk)
+            return
+        encoder = EnhancedJSONEncoder(separators=(',', ':'))
+        file.write('{"program":{"statements":[')
+        for i, statement in enumerate(program['program']['statements']):
+            if i:
+                file.write(',')
+            file.write(encoder.encode(statement))
+        file.write(']}}')
+
 class EnhancedJSONEncoder(json.JSONEncoder):
         def default(self, o):
-            if is_dataclass(StatementNode) or is_dataclass(ExpressionNode) or is_dataclass(BinaryNode):
-                return asdict(o)
+            if isinstance(o, AstNode):
+                return o.asdict()
             return super().default(o)
 
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+# On-disk cache of preprocessed include files, so `include "std/std.pasic"` does not
+# lex the file and register its macros again on every compile.
+from array import array
+from pathlib import Path
+import hashlib
+import marshal
+import os
+import re
+import sys
+
+# Bump when the layout of an entry changes
+CACHE_FORMAT = 2
+# Entries beyond this many are evicted, least recently used first
+CACHE_MAX_ENTRIES = 256
+COLUMNS = ('kinds', 'starts', 'ends', 'lines', 'cols')
+# `<compiler version>-<content hash>`, eviction leaves every other file of the directory alone
+ENTRY_NAME = re.compile(r'[0-9a-f]{16}-[0-9a-f]{64}')
+
+
+def compilerVersion() -> str:
+    '''
+    Entries are only valid for the lexer and parser that wrote them, so the version is a
+    hash of their sources (and of the Python version, which decides the marshal format)
+    '''
+    digest = hashlib.sha256(f'{CACHE_FORMAT} {sys.version}'.encode())
+    for module in ['lex.py', 'parse.py', 'cache.py']:
+        digest.update((Path(__file__).parent / module).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def defaultDirectory() -> Path:
+    if 'PASIC_CACHE_DIR' in os.environ:
+        return Path(os.environ['PASIC_CACHE_DIR'])
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'pasic'
+
+
+class IncludeCache:
+    '''
+    An entry holds the token rows of one file, which of them are left once its macro
+    definitions are taken out, and the index of those macros. Rows are numbered from the start of the
+    file. Entries are named `<compiler version>-<content hash>`, a different compiler
+    version never reads them and evicts them on its next write.
+    '''
+    def __init__(self, directory=None):
+        self.directory = Path(directory) if directory else defaultDirectory()
+        self.version = compilerVersion()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source: str) -> str:
+        return f'{self.version}-{hashlib.sha256(source.encode()).hexdigest()}'
+
+    def load(self, key: str):
+        ''' The entry saved under key, or None on a miss '''
+        path = self.directory / key
+        try:
+            with open(path, 'rb') as file:
+                entry = marshal.load(file)
+            os.utime(path)  # for least recently used eviction
+        except (OSError, EOFError, ValueError, TypeError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            'rows': {column: array('i' if column != 'kinds' else 'B', entry[column]) for column in COLUMNS},
+            'keep': array('i', entry['keep']),
+            'macros': entry['macros'],
+            'constants': entry['constants'],
+        }
+
+    def save(self, key: str, rows: dict, keep: array, macros: list, constants: list):
+        '''
+        rows maps each of COLUMNS to an array, keep is an array of row numbers, macros a list
+        of (name, args, first body row, end of the body) and constants a list of (name, row).
+        A cache that cannot be written is skipped silently.
+        '''
+        entry = {column: rows[column].tobytes() for column in COLUMNS}
+        entry['keep'] = keep.tobytes()
+        entry['macros'] = macros
+        entry['constants'] = constants
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            temp = self.directory / f'.{key}.{os.getpid()}'
+            with open(temp, 'wb') as file:
+                marshal.dump(entry, file)
+            os.replace(temp, self.directory / key)
+            self.evict()
+        except OSError:
+            pass
+
+    def evict(self):
+        ''' Remove entries of other compiler versions, then the oldest ones past CACHE_MAX_ENTRIES '''
+        entries = []
+        for path in self.directory.iterdir():
+            if not ENTRY_NAME.fullmatch(path.name):
+                continue
+            if not path.name.startswith(f'{self.version}-'):
+                path.unlink(missing_ok=True)
+            else:
+                entries.append(path)
+        if len(entries) > CACHE_MAX_ENTRIES:
+            entries.sort(key=lambda path: path.stat().st_mtime)
+            for path in entries[:len(entries) - CACHE_MAX_ENTRIES]:
+                path.unlink(missing_ok=True)
+
+    def stats(self) -> str:
+        return f'include cache: {self.hits} hits, {self.misses} misses'
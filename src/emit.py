@@ -1,32 +1,72 @@
 # Emitter object keeps track of the generated code and outputs it.
-from src.parse import BinaryNode, ExpressionNode, StatementNode
+from src.parse import BinaryNode, ExpressionNode, StatementNode, ListExpressionNode, PointerNode, UnaryOperatorNode, OperatorNode, NumberNode
 from src.lex import Symbols, Keywords
-from typing import Union
-from math import log2, ceil
+from src.regalloc import allocateRegisters, sharedVariables, CALLEE_SAVED
+from src.frame import allocateSlots, frameSize, SLOT
+from src.opt import evaluate, unwrap, ConstantFolder, DeadCodeEliminator
+from src.strength import multiply, divide
+from typing import Optional, Union
+from itertools import chain
+from dataclasses import dataclass
 
 Node = BinaryNode | ExpressionNode | StatementNode
 
 # TODO: list re-assignment will reallocate new list, old list is memory leaked (this is actually fine?)
 # TODO: list init with [] will cause weird behaviors
-# TODO: current system pushes expression result on top of the stack, which is not efficient. Change it to move to register?
 
 CONVENTION_SYSCALL = ['rax', 'rdi', 'rsi', 'rdx', 'r10', 'r8', 'r9']
 CONVENTION_FUNC = ['rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9']
 
+# registers holding intermediate values of an expression, handed out in this order. rdx (idiv,
+# BASE) and r11 (SPILL, a spilled operand once it is reloaded) stay out of it as scratch registers
+TEMPORARIES = ['rax', 'rcx', 'rsi', 'rdi', 'r8', 'r9', 'r10']
+SPILL = 'r11'
+BASE = 'rdx'  # address of the elements of a list a variable in static storage points to
+BYTE_REGISTERS = {'rax': 'al', 'rcx': 'cl', 'rsi': 'sil', 'rdi': 'dil', 'r8': 'r8b', 'r9': 'r9b', 'r10': 'r10b', 'r11': 'r11b'}
+ARITHMETIC = {'+': 'add', '-': 'sub', '*': 'imul', '&': 'and', '|': 'or', '^': 'xor'}
+SHIFTS = {'<<': 'shl', '>>': 'shr'}
+DIVISIONS = {'/': 'rax', '%': 'rdx'}  # register holding the result of idiv
+COMPARISONS = {'<': 'l', '>': 'g', '<=': 'le', '>=': 'ge', '==': 'e', '!=': 'ne'}  # setcc conditions
+SWAPPED = {'l': 'g', 'g': 'l', 'le': 'ge', 'ge': 'le', 'e': 'e', 'ne': 'ne'}  # condition with the operands swapped
+NEGATED = {'l': 'ge', 'g': 'le', 'le': 'g', 'ge': 'l', 'e': 'ne', 'ne': 'e'}  # condition that holds when it does not
+COMMUTATIVE = {'+', '*', '&', '|', '^', '==', '!='}
+
+@dataclass(slots=True)
+class Operation:
+    ''' Node of an expression tree, rebuilt from the postfix of Emitter.getExprValue '''
+    node: Node
+    children: list
+    need: int = 1       # registers needed to evaluate it without spilling (Sethi-Ullman number)
+    pure: bool = True   # no calls or assignments inside, may be evaluated out of order
+    target: Optional[Node] = None  # what an assignment_expression assigns to
+
 class Emitter:
+    strengthReduction = True  # multiply and divide by constants without imul and idiv
+    treeShaking = True        # leave out the runtime (dump, mem) the code does not use
+
     def __init__(self, fullPath):
         self.fullPath = fullPath
-        self.header = ""
-        self.ender = ""
-        self.codeheader = ""
-        self.code = ""
-        self.funcCode = ""
+        # sections of the output as lists of lines, in file order: header (.data),
+        # codeheader (start of .text), code (main program), funcCode, ender (dump, .bss)
+        self.header: list[str] = []
+        self.codeheader: list[str] = []
+        self.code: list[str] = []
+        self.funcCode: list[str] = []
+        self.ender: list[str] = []
         self.inFunc = False
+        self.runtime: set[str] = set()  # what the code uses of the end of the output: dump, mem
         self.staticVarCount = 0
+        self.statics: dict[str, str] = dict()  # label of the lists of the top-level code in .data or .bss
+        self.tables: set[str] = set()  # the ones of them in .data, with their elements already there
+        self.globals: dict[str, str] = dict()  # label of the other top-level variables functions use, in .bss
+        self.bss: list[str] = []
         self.stackTable = [dict()]  # position of var in stack of current scope
+        self.registerTable = [dict()]  # register of var of current scope, if it has one
         self.stack = 8  # reserve 8 bytes for rbp himself
+        self.pushed = 0  # values pushed below the frame, rsp is aligned for a call when it is even
         self.labelTable = {'if': {'count': 0, 'stack': []}, 'if_end': {'count': 0, 'stack': []}, 'while': {
-            'count': 0, 'stack': []}, 'while_end': {'count': 0, 'stack': []}}
+            'count': 0, 'stack': []}, 'while_end': {'count': 0, 'stack': []},
+            'cond': {'count': 0, 'stack': []}, 'return': {'count': 0, 'stack': []}}
 
     def fromdict(self, input: dict = dict()):
         assert 'program' in input
@@ -39,10 +79,17 @@ class Emitter:
         self.codeHeader('_start:')
         self.codeHeader('\tmov rbp, rsp')  # sync stack pointer
         statements = input['program']['statements']
+        self.staticLists(statements)
+        for name in sorted(sharedVariables(statements) - self.statics.keys()):
+            self.globals[name] = f'static_{self.staticVarCount}'
+            self.staticVarCount += 1
+            self.bss.append(f'{self.globals[name]}: resq 1')
+        self.registerTable[-1] = allocateRegisters(statements, exclude=self.statics.keys() | self.globals.keys())
+        self.layoutFrame(statements, [], self.statics.keys() | self.globals.keys())
         for statement in statements:
             self.emitStatement(statement)
-        stack_padding = 2**ceil(log2(self.stack))
-        self.codeHeader(f'\tsub rsp, {stack_padding}')  # reserve space for stack pointer
+        if frameSize(self.stack):
+            self.codeHeader(f'\tsub rsp, {frameSize(self.stack)}')
 
         # SYS_EXIT
         self.emitLine(f'')
@@ -50,31 +97,87 @@ class Emitter:
         self.emitLine(f'\tmov rdi, 0')
         self.emitLine(f'\tsyscall')
 
-        self.enderLine(DUMP)
-        self.enderLine('section .bss')
-        self.enderLine('mem: resb 64000')
+        if 'dump' in self.runtime or not Emitter.treeShaking:
+            self.enderLine(DUMP)
+        if 'mem' in self.runtime or not Emitter.treeShaking:
+            self.bss.append('mem: resb 64000')
+        if self.bss:
+            self.enderLine('section .bss')
+            for line in self.bss:
+                self.enderLine(line)
+
+    def staticLists(self, statements: list):
+        '''
+        Give the lists the top-level code defines with a constant size and constant elements
+        storage in .data, or in .bss when it is all zeros, instead of the stack. Their `let` has
+        to run once, at the top level with no label to jump back to, and be the only one of the
+        name, which is never assigned: the name always means the address of that storage.
+        '''
+        everything = list(DeadCodeEliminator.blocks(statements))
+        if any(statement.typ == 'label_statement' for statement in everything):
+            return
+        assigned = ConstantFolder()
+        assigned.collect(statements)
+        lets: dict[str, int] = {}
+        for statement in everything:
+            if statement.typ == 'let_statement':
+                lets[statement.left.text] = lets.get(statement.left.text, 0) + 1
+            elif statement.typ == 'func_declaration':
+                for arg in statement.args:
+                    lets[arg.text] = lets.get(arg.text, 0) + 1
+        for statement in statements:
+            if statement.typ != 'let_statement' or lets[statement.left.text] != 1 or statement.left.text in assigned.assigned:
+                continue
+            right = unwrap(statement.right)
+            if right is None or right.typ != 'list_expression':
+                continue
+            items = [evaluate(item) for item in right.items]
+            size = evaluate(statement.args[0]) if statement.args else len(items)
+            if None in items or size is None or size < max(len(items), 1):
+                continue
+            label = f'static_{self.staticVarCount}'
+            self.staticVarCount += 1
+            self.statics[statement.left.text] = label
+            if size == len(items) and any(items):
+                self.tables.add(statement.left.text)
+                self.headerLine('align 8')
+                self.headerLine(f'{label}: dq {", ".join(str(item) for item in items)}')
+            else: # the elements the list does not give are zero, it sets the others when it runs
+                self.bss.append(f'{label}: resq {size}')
 
     def emit(self, code):
-        self.code += code
+        self.code.append(code)
 
     def emitLine(self, code):
-        self.code += code + '\n'
+        self.code.append(code + '\n')
 
     def codeHeader(self, code):
-        self.codeheader += code + '\n'
+        self.codeheader.append(code + '\n')
 
     def headerLine(self, code):
-        self.header += code + '\n'
+        self.header.append(code + '\n')
 
     def enderLine(self, code):
-        self.ender += code + '\n'
+        self.ender.append(code + '\n')
+
+    def lines(self):
+        return chain(self.header, self.codeheader, self.code, self.funcCode, self.ender)
+
+    def optimize(self, peephole):
+        ''' Run the peephole optimizer over the main program and the functions '''
+        self.code = peephole.optimize(self.code)
+        self.funcCode = peephole.optimize(self.funcCode, returns=True)
 
-    def writeFile(self):
+    def writeFile(self, file=None):
+        ''' Write the assembly to self.fullPath, or to `file` if given (stdout, a pipe) '''
+        if file is not None:
+            file.writelines(self.lines())
+            return
         with open(self.fullPath, 'w') as outputFile:
-            outputFile.write(self.header + self.codeheader + self.code + self.funcCode + self.ender)
+            outputFile.writelines(self.lines())
 
     def emitStatement(self, statement: Union[StatementNode, ExpressionNode, BinaryNode]):
-        assert len(Symbols) + len(Keywords) == 46, "Exhaustive handling of operation, notice that not all symbols need to be handled here, only those is a statement"
+        assert len(Symbols) + len(Keywords) == 48, "Exhaustive handling of operation, notice that not all symbols need to be handled here, only those is a statement"
         emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
         if isinstance(statement, StatementNode):
             if statement.typ == 'print_statement':
@@ -95,25 +198,27 @@ class Emitter:
                     emitLine(f'\tsyscall')
                     self.staticVarCount += 1
                 else: # is a number, we call builtin function dump
-                    self.emitExpr(expr_postfix)
-                    # result will be at top of stack
-                    emitLine(f'\tpop rdi')
-                    emitLine(f'\tcall dump')
+                    self.emitExpr(expr_postfix, 'rdi')
+                    self.call('dump')
+                    self.runtime.add('dump')
             elif statement.typ == 'let_statement':
                 emitLine(f'\t; -- let_statement --')
                 left, right_expr = statement.left, statement.right
+                if not self.inFunc and left.text in self.statics:
+                    self.emitStaticList(left.text, unwrap(right_expr))
+                    return
                 right_expr = self.getExprValue(right_expr)
                 if statement.args: # is list init statement
                     arg = statement.args[0]
-                    arg = Emitter.evalExpr(arg) # length of list to allocate
+                    arg = evaluate(arg) # length of list to allocate
+                    if arg is None:
+                        raise NotImplementedError('List length must be a constant expression')
                     self.stack += (arg - len(right_expr[0].items)) * 8 # allocates elements on stack if list did not explicitly define
-                    self.emitExpr(right_expr) # pointer to the list will be on top of stack
-                    emitLine(f'\tpop rax')
+                    self.emitExpr(right_expr) # pointer to the list will be in rax
                     varName, size = left.text, 8
                     self.allocVariable(varName, size)
                 else:
                     self.emitExpr(right_expr)
-                    emitLine(f'\tpop rax')
                     varName, size = left.text, 8
                     self.allocVariable(varName, size)
             elif statement.typ == 'label_statement':
@@ -127,12 +232,8 @@ class Emitter:
             elif statement.typ == 'if_statement':
                 emitLine(f'\t; -- if_statement')
                 condition, body = statement.condition, statement.body
-                condition = self.getExprValue(condition)
-                self.emitExpr(condition)
-                # result on top of stack
-                emitLine(f'\tpop rax')
-                emitLine(f'\ttest rax, rax')
-                emitLine(f'\tje .IF_{self.labelTable['if']['count']}')
+                condition = Emitter.exprTree(self.getExprValue(condition))
+                self.emitBranch(condition, f'.IF_{self.labelTable['if']['count']}', False)
                 self.addrStackPush('if')
                 for stmt in body:
                     self.emitStatement(stmt)
@@ -156,12 +257,8 @@ class Emitter:
                 addr = self.addrStackPop('if')
                 emitLine(f'.IF_{addr}:')
                 condition, body = statement.condition, statement.body
-                condition = self.getExprValue(condition)
-                self.emitExpr(condition)
-                # result on top of stack
-                emitLine(f'\tpop rax')
-                emitLine(f'\ttest rax, rax')
-                emitLine(f'\tje .IF_{self.labelTable['if']['count']}')
+                condition = Emitter.exprTree(self.getExprValue(condition))
+                self.emitBranch(condition, f'.IF_{self.labelTable['if']['count']}', False)
                 self.addrStackPush('if')
                 for stmt in body:
                     self.emitStatement(stmt)
@@ -178,20 +275,21 @@ class Emitter:
                 emitLine(f'.END_{addr}:')
             elif statement.typ == 'while_statement':
                 emitLine(f'\t; -- while_statement --')
-                emitLine(f'.WHILE_{self.labelTable['while']['count']}:')
-                self.addrStackPush('while')
                 condition, body = statement.condition, statement.body
-                condition = self.getExprValue(condition)
-                self.emitExpr(condition)
-                # result on top of stack
-                emitLine(f'\tpop rax')
-                emitLine(f'\ttest rax, rax')
-                emitLine(f'\tje .END_WHILE_{self.labelTable['while_end']['count']}')
+                condition = Emitter.exprTree(self.getExprValue(condition))
+                self.addrStackPush('while')
                 self.addrStackPush('while_end')
+                addr = self.addrStackPeek('while')
+                # the condition is tested at the bottom, so an iteration takes one jump back to
+                # the top. Entering the loop jumps to the test first, unless it is always true
+                if not (condition.node.typ == 'number' and condition.node.text != '0'):
+                    emitLine(f'\tjmp .WHILE_COND_{addr}')
+                emitLine(f'.WHILE_{addr}:')
                 for stmt in body:
                     self.emitStatement(stmt)
-                addr = self.addrStackPop('while')
-                emitLine(f'\tjmp .WHILE_{addr}')
+                emitLine(f'.WHILE_COND_{addr}:')
+                self.emitBranch(condition, f'.WHILE_{addr}', True)
+                self.addrStackPop('while')
                 addr = self.addrStackPop('while_end')
                 emitLine(f'.END_WHILE_{addr}:')
             elif statement.typ == 'break_statement':
@@ -204,28 +302,44 @@ class Emitter:
                 emitLine(f'{func_name}:')
                 emitLine(f'\tpush rbp')
                 emitLine(f'\tmov rbp, rsp')
-                emitLine(f'\tsub rsp, 1024') # TODO: function local variable stack padding
+                frame = len(self.funcCode) # its size is known once the body is emitted
+                emitLine(f'\tsub rsp, 0')
                 original = self.stack
-                self.stack = 8
                 self.inFunc = True
-                self.stackTable.append(self.stackTable[-1].copy())
+                self.stackTable.append(dict()) # top-level variables it uses are in static storage
+                registers = allocateRegisters(body, [arg.text for arg in args])
+                self.registerTable.append(registers)
+                self.layoutFrame(body, [arg.text for arg in args], ())
+                # the caller keeps its variables in these too
+                saved = [reg for reg in CALLEE_SAVED if reg in registers.values()]
+                for reg in saved:
+                    self.push(reg)
                 for i, arg in enumerate(args):
                     self.allocVariable(arg.text, 8, reg=CONVENTION_FUNC[i])
+                self.addrStackPush('return')
                 for stmt in body:
                     self.emitStatement(stmt)
+                if frameSize(self.stack):
+                    self.funcCode[frame] = f'\tsub rsp, {frameSize(self.stack)}\n'
+                else:
+                    del self.funcCode[frame]
                 # move return value to rax before returning
+                emitLine(f'.RETURN_{self.addrStackPop('return')}:')
+                for reg in reversed(saved):
+                    self.pop(reg)
                 self.stack = original
                 self.inFunc = False
                 self.stackTable.pop()
+                self.registerTable.pop()
                 emitLine(f'\tleave')
                 emitLine(f'\tret')
                 # raise NotImplementedError('func_declaration')
             elif statement.typ == 'return_statement':
                 emitLine('\t; -- return --')
                 exprs = self.getExprValue(statement.value)
-                self.emitExpr(exprs)
-                # result will be at top of stack
-                emitLine('\tpop rax')
+                self.emitExpr(exprs) # return value in rax
+                if self.inFunc:
+                    emitLine(f'\tjmp .RETURN_{self.addrStackPeek('return')}')
             elif statement.typ == 'include_statement':
                 pass
             else:
@@ -234,206 +348,458 @@ class Emitter:
             expr = self.getExprValue(statement)
             self.emitExpr(expr)
 
-    def emitExpr(self, exprs: list):
+    def emitExpr(self, exprs: list, target='rax'):
+        '''
+        Expression result will be in `target`, one of TEMPORARIES
+        '''
+        self.emitTree(Emitter.exprTree(exprs), [target] + [reg for reg in TEMPORARIES if reg != target])
+
+    def emitTree(self, tree: Operation, regs: list):
         '''
-        Expression result will be at top of stack
+        Evaluate tree into regs[0]. The other registers in regs are free to use, temporaries
+        not in regs hold values of the enclosing expression and are left alone.
         '''
         emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
-        for expr in exprs:
-            if expr.typ == 'number':
-                emitLine(f'\tpush {expr.text}')
-            elif expr.typ == 'ident':
-                if expr.text == '__mem__':
-                    emitLine(f'\tpush mem')
-                    # raise NotImplementedError('mem keyword')
+        expr, target = tree.node, regs[0]
+        if expr.typ == 'number':
+            emitLine(f'\tmov {target}, {expr.text}')
+        elif expr.typ == 'ident':
+            if expr.text == '__mem__':
+                emitLine(f'\tmov {target}, mem')
+                self.runtime.add('mem')
+            elif self.static(expr.text):
+                emitLine(f'\tlea {target}, [rel {self.static(expr.text)}]')
+            else:
+                emitLine(f'\tmov {target}, {self.variable(expr.text)}')
+        elif expr.typ == 'string':
+            text = bytes(expr.text.encode('utf-8')).decode('unicode_escape')
+            text += '\0'
+            output = ', '.join([hex(ord(char)) for char in text])
+            self.headerLine(
+                f'static_{self.staticVarCount}: db {output}')
+            self.headerLine(
+                f'static_{self.staticVarCount}_len: equ $-static_{self.staticVarCount}')
+            emitLine(f'\tmov {target}, static_{self.staticVarCount}')
+            self.staticVarCount += 1
+        elif expr.typ == 'unary_operator':
+            self.emitTree(tree.children[0], regs)
+            emitLine(f'\tneg {target}')
+        elif expr.typ == 'pointer':
+            self.emitTree(tree.children[0], regs)
+            emitLine(f'\tmov {target}, [{target}]')
+        elif expr.typ == 'subscript_expression':
+            index = tree.children[0]
+            if index.node.typ != 'number' or not (self.static(expr.child.text) or self.shared(expr.child.text)):
+                self.emitTree(index, regs) # subscript value
+                index = target
+            emitLine(f'\tmov {target}, {self.element(expr.child.text, index)}')
+        elif expr.typ == 'operator':
+            self.emitOperator(tree, regs)
+        elif expr.typ == 'call_expression':
+            self.emitCall(tree, regs)
+        elif expr.typ == 'list_expression':
+            items = tree.children
+            # the following allocates len(items) vars, the first element at the lowest address,
+            # and then leaves the pointer to the first element in target
+            start = self.stack
+            if tree.pure:
+                for i, item in enumerate(items):
+                    self.emitTree(item, regs)
+                    emitLine(f'\tmov QWORD [rbp - {start + 8 * (len(items) - 1 - i)}], {target}')
+                self.stack += 8 * len(items)
+            else: # items may allocate lists themselves, do that before taking our slots
+                for item in items:
+                    self.emitTree(item, regs)
+                    self.push(target)
+                start = self.stack
+                for _ in items:
+                    self.pop(target)
+                    self.allocStack(self.stack, 8, target)
+            pfirst = start + 8 * (len(items) - 1) if items else start
+            emitLine(f'\tlea {target}, [rbp - {pfirst}]')
+        elif expr.typ == 'assignment_expression':
+            emitLine(f'\t; -- assignment_expression --')
+            left = tree.target
+            if left.typ == 'ident':
+                self.emitTree(tree.children[0], regs)
+                emitLine(f'\tmov {self.variable(left.text)}, {target}')
+            elif left.typ == 'subscript_expression':
+                index = tree.children[1]
+                if index.node.typ == 'number' and (self.static(left.child.text) or self.shared(left.child.text)):
+                    self.emitTree(tree.children[0], regs)
                 else:
-                    emitLine(
-                        f'\tmov rax, [rbp - {self.stackTable[-1][expr.text]}]')
+                    index = self.emitOperands(tree.children[0], index, regs)
+                emitLine(f'\tmov QWORD {self.element(left.child.text, index)}, {target}')
+            else: # pointer
+                address = self.emitOperands(tree.children[0], tree.children[1], regs)
+                emitLine(f'\tmov QWORD [{address}], {target}')
+        else:
+            raise NotImplementedError(f'Operation {expr} is not implemented')
+
+    def emitBranch(self, tree: Operation, label: str, when: bool):
+        '''
+        Jump to label if the condition tree is true (when) or false (not when), fall through
+        otherwise. Comparisons set the flags for a conditional jump instead of making a 0 or 1.
+        '''
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        expr = tree.node
+        if expr.typ == 'number':
+            if (expr.text != '0') == when:
+                emitLine(f'\tjmp {label}')
+        elif expr.typ == 'operator' and expr.text in COMPARISONS:
+            condition = self.emitCompare(tree, TEMPORARIES)
+            emitLine(f'\tj{condition if when else NEGATED[condition]} {label}')
+        elif expr.typ == 'operator' and expr.text in ('&', '|') and Emitter.boolean(tree) \
+                and tree.children[1].pure and not Emitter.traps(tree.children[1]):
+            # both sides are 0 or 1, so & and | are `and` and `or`. The right side is only
+            # evaluated when the left one does not decide, which it can not tell apart
+            left, right = tree.children
+            if (expr.text == '&') != when: # either side decides on its own
+                self.emitBranch(left, label, when)
+                self.emitBranch(right, label, when)
+            else:
+                self.addrStackPush('cond')
+                skip = f'.COND_{self.addrStackPop('cond')}'
+                self.emitBranch(left, skip, not when)
+                self.emitBranch(right, label, when)
+                emitLine(f'{skip}:')
+        else:
+            self.emitTree(tree, TEMPORARIES)
+            emitLine(f'\ttest rax, rax')
+            emitLine(f'\t{"jne" if when else "je"} {label}')
+
+    @staticmethod
+    def boolean(tree: Operation) -> bool:
+        ''' Whether the value of tree is always 0 or 1 '''
+        expr = tree.node
+        if expr.typ == 'number':
+            return expr.text in ('0', '1')
+        if expr.typ == 'operator' and expr.text in COMPARISONS:
+            return True
+        if expr.typ == 'operator' and expr.text in ('&', '|'):
+            return all(Emitter.boolean(child) for child in tree.children)
+        return False
+
+    @staticmethod
+    def traps(tree: Operation) -> bool:
+        ''' Whether evaluating tree may stop the program, by dividing by zero '''
+        if tree.node.typ == 'operator' and tree.node.text in DIVISIONS:
+            return True
+        return any(Emitter.traps(child) for child in tree.children)
+
+    def emitOperands(self, left: Operation, right: Operation, regs: list) -> str:
+        '''
+        Evaluate left into regs[0] and right into the returned register. The operand that needs
+        more registers goes first (Sethi-Ullman) unless that would reorder side effects, and
+        the left value is spilled to the stack only when no register is left for the right one.
+        '''
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        if len(regs) == 1:
+            self.emitTree(left, regs)
+            self.push(regs[0])
+            self.emitTree(right, regs)
+            emitLine(f'\tmov {SPILL}, {regs[0]}')
+            self.pop(regs[0])
+            return SPILL
+        if right.need > left.need and left.pure and right.pure:
+            self.emitTree(right, regs[1:])
+            self.emitTree(left, [regs[0]] + regs[2:])
+        else:
+            self.emitTree(left, regs)
+            self.emitTree(right, regs[1:])
+        return regs[1]
+
+    def operand(self, tree: Operation, operator: str) -> Optional[str]:
+        ''' The right operand of operator as an immediate or memory operand if the instruction takes one '''
+        expr = tree.node
+        if expr.typ == 'number' and operator not in DIVISIONS:
+            value = int(expr.text)
+            if operator in SHIFTS:
+                return str(value) if 0 <= value < 256 else None
+            return str(value) if -2**31 <= value < 2**31 else None
+        if expr.typ == 'ident' and expr.text != '__mem__' and not self.static(expr.text):
+            variable = self.variable(expr.text)
+            return variable if operator not in SHIFTS or variable in CALLEE_SAVED else None
+        return None
+
+    def static(self, varName: str) -> Optional[str]:
+        ''' Label of the storage of a list in .data or .bss, unless a variable of the function hides it '''
+        if varName in self.registerTable[-1] or varName in self.stackTable[-1]:
+            return None
+        return self.statics.get(varName)
+
+    def shared(self, varName: str) -> Optional[str]:
+        ''' Label of the .bss slot of a top-level variable functions use, unless a variable of the function hides it '''
+        if varName in self.registerTable[-1] or varName in self.stackTable[-1]:
+            return None
+        return self.globals.get(varName)
+
+    def element(self, varName: str, index: Union[Operation, str]) -> str:
+        '''
+        Memory operand of an element of a list, at a constant index (an Operation of a number,
+        lists in static storage only) or the one in the register `index`. There is no RIP-relative
+        addressing with an index register: the address of a static list is an absolute 32 bit
+        displacement then, which it is in the executables we link.
+        '''
+        label = self.static(varName)
+        if label and isinstance(index, Operation):
+            offset = int(index.node.text) * 8
+            return f'[rel {label}{offset:+}]' if offset else f'[rel {label}]'
+        if label:
+            return f'[{label}+{index}*8]'
+        if self.shared(varName): # the elements are wherever the variable points
+            emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+            emitLine(f'\tmov {BASE}, {self.variable(varName)}')
+            if isinstance(index, Operation):
+                offset = int(index.node.text) * 8
+                return f'[{BASE}{offset:+}]' if offset else f'[{BASE}]'
+            return f'[{BASE}+{index}*8]'
+        return f'[rbp-{self.stackTable[-1][varName] - 8}+{index}*8]'
+
+    def emitStaticList(self, varName: str, right: ListExpressionNode):
+        ''' Set the elements of a list in .bss that are not zero, the ones its `let` gives '''
+        if varName in self.tables:
+            return # .data has them already
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        for i, item in enumerate(right.items):
+            value = evaluate(item)
+            if value == 0:
+                continue
+            element = self.element(varName, Operation(NumberNode(text=str(i)), []))
+            if -2**31 <= value < 2**31:
+                emitLine(f'\tmov QWORD {element}, {value}')
+            else:
+                emitLine(f'\tmov rax, {value}')
+                emitLine(f'\tmov QWORD {element}, rax')
+
+    def variable(self, varName: str) -> str:
+        ''' Operand of a variable: its register, its slot on the stack or in .bss '''
+        if varName in self.registerTable[-1]:
+            return self.registerTable[-1][varName]
+        if self.shared(varName):
+            return f'QWORD [rel {self.shared(varName)}]'
+        return f'QWORD [rbp - {self.stackTable[-1][varName]}]'
+
+    def emitSource(self, tree: Operation, regs: list) -> tuple[str, bool]:
+        '''
+        Evaluate the left operand of an operator into regs[0]. Returns the right operand, as a
+        register, immediate or memory operand, and whether the two were swapped.
+        '''
+        operator = tree.node.text
+        left, right = tree.children
+        swapped = False
+        # with a constant or variable on the left only, evaluate the other side first and
+        # use the left one as the instruction operand instead
+        if (operator in COMMUTATIVE or operator in COMPARISONS) and self.operand(right, operator) is None \
+                and self.operand(left, operator) is not None and (left.node.typ == 'number' or right.pure):
+            left, right, swapped = right, left, True
+        source = self.operand(right, operator)
+        if source is None:
+            source = self.emitOperands(left, right, regs)
+        else:
+            self.emitTree(left, regs)
+        return source, swapped
+
+    def emitCompare(self, tree: Operation, regs: list) -> str:
+        ''' Compare the operands of a comparison, returns the condition code that holds when it is true '''
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        source, swapped = self.emitSource(tree, regs)
+        emitLine(f'\tcmp {regs[0]}, {source}')
+        condition = COMPARISONS[tree.node.text]
+        return SWAPPED[condition] if swapped else condition
+
+    def emitOperator(self, tree: Operation, regs: list):
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        operator = tree.node.text
+        if operator in COMPARISONS:
+            condition = self.emitCompare(tree, regs)
+            emitLine(f'\tset{condition} {BYTE_REGISTERS[regs[0]]}')
+            emitLine(f'\tmovzx {regs[0]}, {BYTE_REGISTERS[regs[0]]}')
+            return
+        if Emitter.strengthReduction and (operator == '*' or operator in DIVISIONS) and self.emitReduced(tree, regs):
+            return
+        source, _ = self.emitSource(tree, regs)
+        target = regs[0]
+        if operator in ARITHMETIC:
+            if operator == '*' and source.lstrip('-').isdigit():
+                emitLine(f'\timul {target}, {target}, {source}')
+            else:
+                emitLine(f'\t{ARITHMETIC[operator]} {target}, {source}')
+        elif operator in SHIFTS:
+            shift = SHIFTS[operator]
+            if source == 'rcx' or source.isdigit():
+                emitLine(f'\t{shift} {target}, {"cl" if source == "rcx" else source}')
+            elif target == 'rcx':
+                emitLine(f'\tmov rdx, rcx')
+                emitLine(f'\tmov rcx, {source}')
+                emitLine(f'\t{shift} rdx, cl')
+                emitLine(f'\tmov rcx, rdx')
+            elif 'rcx' in regs: # rcx is free
+                emitLine(f'\tmov rcx, {source}')
+                emitLine(f'\t{shift} {target}, cl')
+            else:
+                emitLine(f'\txchg rcx, {source}')
+                emitLine(f'\t{shift} {target}, cl')
+                emitLine(f'\txchg rcx, {source}')
+        elif operator in DIVISIONS:
+            # idiv divides rdx:rax, the quotient ends up in rax and the remainder in rdx
+            saved = False
+            if target == 'rax':
+                pass
+            elif source == 'rax':
+                emitLine(f'\txchg rax, {target}')
+                source = target
+            else:
+                saved = 'rax' not in regs
+                if saved:
                     emitLine(f'\tpush rax')
-            elif expr.typ == 'unary_operator':
+                emitLine(f'\tmov rax, {target}')
+            emitLine(f'\tcqo')
+            emitLine(f'\tidiv {source}')
+            if DIVISIONS[operator] != target:
+                emitLine(f'\tmov {target}, {DIVISIONS[operator]}')
+            if saved:
                 emitLine(f'\tpop rax')
-                emitLine(f'\tneg rax')
-                emitLine(f'\tpush rax')
+        else:
+            raise NotImplementedError(f'Operation {operator} is not implemented')
+
+    def emitReduced(self, tree: Operation, regs: list) -> bool:
+        ''' Multiply or divide by a constant with the cheaper instructions of src.strength, if there are any '''
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        operator = tree.node.text
+        left, right = tree.children
+        if operator == '*' and left.node.typ == 'number':
+            left, right = right, left
+        if right.node.typ != 'number':
+            return False
+        value, target = int(right.node.text), regs[0]
+        code = multiply(target, value) if operator == '*' else divide(operator, target, value, 'rax' in regs)
+        if code is None:
+            return False
+        self.emitTree(left, regs)
+        for line in code:
+            emitLine(f'\t{line}')
+        return True
+
+    def emitCall(self, tree: Operation, regs: list):
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        expr, target = tree.node, regs[0]
+        if expr.text == 'syscall':
+            emitLine('\t; -- syscall builtin --')
+            convention = CONVENTION_SYSCALL
+        else:
+            emitLine(f'\t ; -- call {expr.text} --')
+            convention = CONVENTION_FUNC
+        # temporaries outside regs hold values of the enclosing expression, the call clobbers them
+        saved = [reg for reg in TEMPORARIES if reg not in regs]
+        for reg in saved:
+            self.push(reg)
+        # arguments are evaluated left to right and passed through the stack, except constants
+        # and variables which are loaded last, straight into their register, if nothing else
+        # has side effects
+        args = tree.children
+        direct = [arg.node.typ in ('number', 'ident', 'string') and all(other.pure for other in args) for arg in args]
+        for arg, simple in zip(args, direct):
+            if not simple:
+                self.emitTree(arg, TEMPORARIES)
+                self.push(TEMPORARIES[0])
+        for i in reversed(range(len(args))):
+            if not direct[i]:
+                self.pop(convention[i])
+        for i, arg in enumerate(args):
+            if direct[i]:
+                self.emitTree(arg, [convention[i]])
+        if expr.text == 'syscall':
+            emitLine('\tsyscall')
+        else:
+            self.call(expr.text)
+        if target != 'rax':
+            emitLine(f'\tmov {target}, rax') # return value
+        for reg in reversed(saved):
+            self.pop(reg)
+
+    @staticmethod
+    def exprTree(exprs: list) -> Operation:
+        ''' Rebuild the tree of the postfix getExprValue returns, with operands as children '''
+        stack = []
+        for expr in exprs:
+            if expr.typ in ('pointer', 'unary_operator'):
+                arity = 1
             elif expr.typ == 'operator':
-                operator = expr.text
-                if operator == '+':  # pop top of stack to rax, and add back to top of stack
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tadd [rsp], rax')
-                elif operator == '-':
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tsub [rsp], rax')
-                elif operator == '*':
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\timul rax, rbx')
-                    emitLine(f'\tpush rax')
-                elif operator == '/':
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\txor rdx, rdx')  # remainder will be here
-                    emitLine(f'\tidiv rbx')
-                    emitLine(f'\tpush rax')
-                elif operator == '==':
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\tmov rcx, 0')
-                    emitLine(f'\tmov rdx, 1')
-                    emitLine(f'\tcmp rax, rbx')
-                    emitLine(f'\tcmove rcx, rdx')
-                    emitLine(f'\tpush rcx')
-                elif operator == '!=':
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\tmov rcx, 0')
-                    emitLine(f'\tmov rdx, 1')
-                    emitLine(f'\tcmp rax, rbx')
-                    emitLine(f'\tcmovne rcx, rdx')
-                    emitLine(f'\tpush rcx')
-                elif operator == '%':
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\txor rdx, rdx')  # remainder will be here
-                    emitLine(f'\tidiv rbx')
-                    emitLine(f'\tpush rdx')
-                elif operator == '<<':
-                    emitLine(f'\tpop rcx')
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tshl rax, cl')
-                    emitLine(f'\tpush rax')
-                elif operator == '>>':
-                    emitLine(f'\tpop rcx')
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tshr rax, cl')
-                    emitLine(f'\tpush rax')
-                elif operator == '|':
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tor rax, rbx')
-                    emitLine(f'\tpush rax')
-                elif operator == '&':
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\tand rax, rbx')
-                    emitLine(f'\tpush rax')
-                elif operator == '^':
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\txor rax, rbx')
-                    emitLine(f'\tpush rax')
-                elif operator == '<' or operator == '>' or operator == '<=' or operator == '>=':
-                    emitLine(f'\tpop rbx')
-                    emitLine(f'\tpop rax')
-                    emitLine(f'\txor rcx, rcx')
-                    emitLine(f'\tmov rdx, 1')
-                    emitLine(f'\tcmp rax, rbx')
-                    if operator == '<':
-                        emitLine(f'\tcmovl rcx, rdx')
-                    elif operator == '>':
-                        emitLine(f'\tcmovg rcx, rdx')
-                    elif operator == '<=':
-                        emitLine(f'\tcmovle rcx, rdx')
-                    elif operator == '>=':
-                        emitLine(f'\tcmovge rcx, rdx')
-                    emitLine(f'\tpush rcx')
-                else:
-                    raise NotImplementedError(f'Operation {operator} is not implemented')
-            elif expr.typ == 'string':
-                # if len(exprs) == 1:
-                    text = bytes(expr.text.encode('utf-8')).decode('unicode_escape')
-                    text += '\0'
-                    output = ', '.join([hex(ord(char)) for char in text])
-                    self.headerLine(
-                        f'static_{self.staticVarCount}: db {output}')
-                    self.headerLine(
-                        f'static_{self.staticVarCount}_len: equ $-static_{self.staticVarCount}')
-                    emitLine(f'\tpush static_{self.staticVarCount}')
-                    self.staticVarCount += 1
-                # else:
-                #     raise NotImplementedError(
-                #         f'String operation is not implemented, {exprs=}')
+                arity = 2
             elif expr.typ == 'call_expression':
-                name, argc = expr.text, len(expr.args)
-                if name == 'syscall':
-                    emitLine('\t; -- syscall builtin --')
-                    for i in reversed(range(argc)):
-                        emitLine(f'\tpop {CONVENTION_SYSCALL[i]}')
-                    emitLine('\tsyscall')
-                    emitLine('\tpush rax') # push result on to the stack
-                else:
-                    emitLine(f'\t ; -- call {expr.text} --')
-                    args = expr.args
-                    for i, arg in enumerate(args):
-                        arg = self.getExprValue(arg)
-                        self.emitExpr(arg)
-                        emitLine(f'\tmov {CONVENTION_FUNC[i]}, QWORD [rsp]')
-                    emitLine(f'\tcall {expr.text}')
-                    emitLine(f'\tpush rax') # function return value
-            elif expr.typ == 'list_expression':
-                exprs = expr.items
-                # print(exprs)
-                for expr in exprs:
-                    self.emitExpr(expr)
-                # there will be len(exprs) vars on stack after above
-                # the following allocates len(exprs) vars and then push the pointer to the first element on top of the stack
-                pfirst = self.stack
-                for i in range(len(exprs)):
-                    emitLine('\tpop rax')
-                    if i == len(exprs) - 1:
-                        pfirst = self.stack
-                    self.allocStack(self.stack, 8)
-                emitLine(f'\tlea rbx, [rbp - {pfirst}]')
-                emitLine(f'\tpush rbx')
-            elif expr.typ == 'assignment_expression':
-                emitLine(f'\t; -- assignment_expression --')
-                left, right = expr.left, expr.right
-                left, right = self.getExprValue(left), self.getExprValue(right)
-                self.emitExpr(right)
-                # result will be at top of stack
-                if len(left) == 1:
-                    if left[0].typ == 'ident':
-                        emitLine(f'\tpop rax')
-                        varName = left[0].text
-                        if varName not in self.stackTable[-1]:
-                            assert False, 'Variable cross-reference should be handle in parsing stage'
-                        else:
-                            self.allocStack(self.stackTable[-1][varName], 0)
-                    elif left[0].typ == 'subscript_expression':
-                        value, child = self.getExprValue(left[0].value), left[0].child
-                        assert child.typ == 'ident', "Subcript other than identifiers are not implemented"
-                        varName = child.text
-                        assert varName in self.stackTable[-1], "Variable cross-reference should be handle in parsing stage"
-                        self.emitExpr(value)
-                        emitLine(f'\tpop rax') # subscript value
-                        emitLine(f'\tlea rdx, [rbp-{self.stackTable[-1][varName] - 8}+rax*8]') # rdx contains address now
-                        emitLine(f'\tpop rbx') # rhs
-                        emitLine(f'\tmov QWORD [rdx], rbx')
-                        emitLine(f'\tpush rbx')
-                        # print(child)
-                        # raise NotImplementedError('In subscript_expression')
-                elif left[-1].typ == 'pointer':
-                    self.emitExpr(left[:-1]) # omit pointer (deref) operation
-                    # result (address) will be on the top of stack
-                    emitLine('\tpop rdx') # contains the address
-                    emitLine('\tpop rax')
-                    emitLine('\tmov QWORD [rdx], rax')
-                    emitLine('\tpush rax')
-                else:
-                    raise NotImplementedError('assignment_expression in emitExpr')
-            elif expr.typ == 'subscript_expression':
-                value, child = self.getExprValue(expr.value), expr.child
-                assert child.typ == 'ident', "Subcript other than identifiers are not implemented"
-                varName = child.text
-                assert varName in self.stackTable[-1], "Variable cross-reference should be handle in parsing stage"
-                self.emitExpr(value)
-                emitLine(f'\tpop rax') # subscript value
-                emitLine(f'\tlea rdx, [rbp-{self.stackTable[-1][varName] - 8}+rax*8]') # rdx contains address now
-                emitLine(f'\tpush QWORD [rdx]')
-                # raise NotImplementedError('subscript_expression in emitExpr')
-            elif expr.typ == 'pointer':
-                emitLine('\tpop rax')
-                emitLine('\tpush QWORD [rax]')
+                arity = len(expr.args)
             else:
-                raise NotImplementedError(f'Operation {expr} is not implemented')
+                arity = 0
+            children = stack[len(stack) - arity:]
+            del stack[len(stack) - arity:]
+            stack.append(Emitter.operation(expr, children))
+        assert len(stack) == 1, f'Malformed expression {exprs}'
+        return stack[0]
+
+    @staticmethod
+    def operation(expr: Node, children: list) -> Operation:
+        target = None
+        if expr.typ == 'subscript_expression':
+            assert expr.child.typ == 'ident', "Subcript other than identifiers are not implemented"
+            children = [Emitter.exprTree(Emitter.getExprValue(expr.value))]
+        elif expr.typ == 'list_expression':
+            children = [Emitter.exprTree(item) for item in expr.items]
+        elif expr.typ == 'assignment_expression':
+            left, right = Emitter.getExprValue(expr.left), Emitter.getExprValue(expr.right)
+            children = [Emitter.exprTree(right)]
+            if len(left) == 1 and left[0].typ == 'ident':
+                target = left[0]
+            elif len(left) == 1 and left[0].typ == 'subscript_expression':
+                target = left[0]
+                assert target.child.typ == 'ident', "Subcript other than identifiers are not implemented"
+                children.append(Emitter.exprTree(Emitter.getExprValue(target.value)))
+            elif left[-1].typ == 'pointer':
+                target = left[-1]
+                children.append(Emitter.exprTree(left[:-1])) # omit pointer (deref) operation
+            else:
+                raise NotImplementedError('assignment_expression in emitExpr')
+        pure = expr.typ not in ('call_expression', 'assignment_expression') and all(child.pure for child in children)
+        if expr.typ == 'list_expression':
+            pure = all(child.node.typ != 'list_expression' and child.pure for child in children)
+        if not children:
+            need = 1
+        elif expr.typ == 'operator' and children[1].node.typ in ('number', 'ident'):
+            need = children[0].need # the right one is likely an instruction operand
+        elif len(children) == 2 and expr.typ != 'call_expression':
+            first, second = (child.need for child in children)
+            need = max(first, second) if first != second else first + 1
+        else:
+            need = max(child.need for child in children)
+        return Operation(expr, children, need, pure, target)
+
+    def layoutFrame(self, statements: list, params: list[str], exclude):
+        ''' Stack slots of the scalar variables of a scope without a register, the lists come after them '''
+        slots = allocateSlots(statements, params, exclude | self.registerTable[-1].keys())
+        self.stackTable[-1].update(slots)
+        self.stack = max(slots.values(), default=0) + SLOT
+
+    def push(self, operand: str):
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        emitLine(f'\tpush {operand}')
+        self.pushed += 1
+
+    def pop(self, operand: str):
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        emitLine(f'\tpop {operand}')
+        self.pushed -= 1
+
+    def call(self, function: str):
+        '''
+        Call with rsp aligned to 16 bytes: frames are a multiple of that, so only an odd number
+        of values pushed below it (saved registers, spilled operands) needs 8 bytes of padding
+        '''
+        emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
+        if self.pushed % 2:
+            emitLine('\tsub rsp, 8')
+        emitLine(f'\tcall {function}')
+        if self.pushed % 2:
+            emitLine('\tadd rsp, 8')
 
     def addrStackPush(self, key: str):
         self.labelTable[key]['stack'].append(self.labelTable[key]['count'])
@@ -449,7 +815,12 @@ class Emitter:
         ''' Allocate variable in register (default rax) on the stack '''
         emitLine = self.emitLine if not self.inFunc else self.emitFuncLine
         emitLine(f'\t; -- alloc variable {varName} in {reg}')
-        if varName not in self.stackTable[-1]:
+        if varName in self.registerTable[-1]:
+            if self.registerTable[-1][varName] != reg:
+                emitLine(f'\tmov {self.registerTable[-1][varName]}, {reg}')
+        elif not self.inFunc and varName in self.globals:
+            emitLine(f'\tmov {self.variable(varName)}, {reg}')
+        elif varName not in self.stackTable[-1]:
             self.stackTable[-1][varName] = self.stack
             self.allocStack(self.stack, size, reg)
         else:
@@ -461,24 +832,7 @@ class Emitter:
         self.stack += size
 
     def emitFuncLine(self, code):
-        self.funcCode += code + '\n'
-
-    @staticmethod
-    def evalExpr(expr: ExpressionNode | BinaryNode) -> int:
-        if expr.typ in ['number']:
-            return int(expr.text)
-        elif expr.typ == 'unary_operator':  # unary operation
-            arg = Emitter.evalExpr(expr.arg)
-            if expr.text == '-':
-                return -arg
-        elif isinstance(expr, ExpressionNode):
-            return Emitter.evalExpr(expr.child)
-        elif isinstance(expr, BinaryNode):
-            left = Emitter.evalExpr(expr.left)
-            right = Emitter.evalExpr(expr.right)
-            return eval(f'{left} {expr.text} {right}')
-        else:
-            raise NotImplementedError(f'evalExpr only supports evaluating integer arithmetics right now')
+        self.funcCode.append(code + '\n')
 
     @staticmethod
     def getExprValue(expr: ExpressionNode | BinaryNode):
@@ -489,7 +843,7 @@ class Emitter:
                 ret.append(expr)
                 return
             elif expr.typ == 'list_expression':
-                elements, list_ret = expr.items, ExpressionNode('list_expression', items=[])
+                elements, list_ret = expr.items, ListExpressionNode(items=[])
                 for element in elements:
                     # get(element)
                     element = Emitter.getExprValue(element)
@@ -498,16 +852,17 @@ class Emitter:
                 return
             elif expr.typ == 'pointer':
                 get(expr.child)
-                ret.append(ExpressionNode('pointer'))
+                ret.append(PointerNode())
                 # print(ret)
                 return
             elif expr.typ == 'unary_operator':  # unary operation
                 get(expr.child)
                 if expr.text == '-':
                     if ret[-1].typ == 'number':
-                        ret[-1].text = f'-{ret[-1].text}'
+                        text = ret[-1].text
+                        ret[-1].text = text[1:] if text.startswith('-') else f'-{text}'
                     else:
-                        ret.append(ExpressionNode('unary_operator'))
+                        ret.append(UnaryOperatorNode())
                         # ret.append({'unary_operator': expr['text']})
             elif expr.typ == 'call_expression': # call expression
                 args = expr.args
@@ -531,7 +886,7 @@ class Emitter:
             elif isinstance(expr, BinaryNode):
                 get(expr.left)
                 get(expr.right)
-                ret.append(ExpressionNode('operator', text=expr.text))
+                ret.append(OperatorNode(expr.text))
             else:
                 raise NotImplementedError(f'{expr}')
             return
@@ -0,0 +1,39 @@
+# Frame layout: where the variables of a scope (the top-level code or a function body) that do not
+# get a register live on the stack, and how large its frame is. Scalar variables that are never
+# live at the same time share a slot. Lists and the variables holding them keep the slots the
+# emitter hands out after these, as their elements are addressed relative to the variable.
+from src.regalloc import Liveness, Interval
+
+SLOT = 8
+ALIGNMENT = 16  # of rsp at every call, as the System V ABI wants it
+
+def allocateSlots(statements: list, params: list[str] = [], exclude=()) -> dict[str, int]:
+    '''
+    Offsets below rbp for the scalar variables defined by `statements` or passed as `params`,
+    not for the names in `exclude`, which have a register or static storage. A slot is handed
+    out again once the live interval of its variable ended.
+    '''
+    liveness = Liveness()
+    for param in params:
+        liveness.occur(param)
+    liveness.visit(statements)
+    candidates = (liveness.defined | set(params)) - liveness.pinned - liveness.nested - set(exclude)
+    slots: dict[str, int] = {}
+    active: list[Interval] = []
+    free: list[int] = []
+    for interval in sorted(liveness.intervals(sorted(candidates)), key=lambda interval: interval.start):
+        for old in [old for old in active if old.end < interval.start]:
+            active.remove(old)
+            free.append(slots[old.name])
+        if free:
+            free.sort()
+            slots[interval.name] = free.pop(0)
+        else:
+            slots[interval.name] = SLOT * (len(active) + 1)
+        active.append(interval)
+    return slots
+
+def frameSize(stack: int) -> int:
+    ''' Bytes below rbp that hold the slots up to `stack`, the next free offset, rounded to keep rsp aligned '''
+    used = stack - SLOT
+    return (used + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
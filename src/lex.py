@@ -1,4 +1,6 @@
+from array import array
 from enum import Enum, auto
+import re
 import sys
 
 def eprint(*args, **kwargs):
@@ -6,10 +8,18 @@ def eprint(*args, **kwargs):
 
 
 class Lexer:
-    def __init__(self, sourceName):
+    # Tokenizer used by lexfile(): 'classic' walks the source one character at a
+    # time, 'regex' matches whole tokens with TOKEN_RE. Both produce the same stream.
+    engine = 'classic'
+    ENGINES = ('classic', 'regex')
+
+    def __init__(self, sourceName, lazy=False):
+        # A lazy lexer does not read the file up front, it is meant for stream()
         self.sourceName = sourceName
-        with open(self.sourceName, 'r') as file:
-            self.source: str = file.read()
+        self.source: str = ''
+        if not lazy:
+            with open(self.sourceName, 'r') as file:
+                self.source = file.read()
         self.curChar: str = ''   # Current character in the string.
         self.curPos: int = -1    # Current position in the string.
         self.curLine: int = 1
@@ -201,14 +211,126 @@ class Lexer:
         self.nextChar()
         return token
 
-    def lexfile(self):
-        tokens = list()
+    def tokens(self):
+        ''' Yield the tokens of the file one by one, ending with EOF '''
+        if self.engine == 'regex':
+            yield from self.toTokens(self.scan())
+            return
         while True:
             token = self.getToken()
-            tokens.append(token)
+            yield token
             if token.kind == Symbols.EOF:
                 break
-        return tokens
+
+    def stream(self):
+        '''
+        Like tokens(), but the file is read line by line as tokens are asked for, so
+        memory does not grow with the size of the file. Always uses the regex engine.
+        '''
+        with open(self.sourceName, 'r') as file:
+            yield from self.toTokens(self.scan(file))
+
+    def toTokens(self, rows):
+        name = self.sourceName
+        for kind, start, end, line, col in rows:
+            yield Token(self.source[start:end] if kind is not Symbols.EOF else '\0', kind, (name, line, col))
+
+    def lexfile(self, store=None):
+        '''
+        Lex the whole file into `store` (a new TokenStore if not given) and return it.
+        The file's rows are appended at the end of the store, EOF included.
+        '''
+        store = TokenStore() if store is None else store
+        file = store.addSource(self.sourceName, self.source)
+        kinds, starts, ends, lines, cols = store.kinds.append, store.starts.append, store.ends.append, store.lines.append, store.cols.append
+        count = 0
+        if self.engine == 'regex':
+            for kind, start, end, line, col in self.scan():
+                kinds(KIND_IDS[kind])
+                starts(start)
+                ends(end)
+                lines(line)
+                cols(col)
+                count += 1
+        else:
+            for token in self.tokens():
+                # getToken() leaves curPos one past the token, or past the closing quote of a string
+                end = self.curPos - (token.kind is Symbols.STRING)
+                kinds(KIND_IDS[token.kind])
+                starts(end - len(token.text))
+                ends(end)
+                lines(token.pos[1])
+                cols(token.pos[2])
+                count += 1
+        store.srcs.extend(array('H', [file]) * count)
+        store.files.extend(array('H', [file]) * count)
+        store.origins.extend(array('i', [-1]) * count)
+        return store
+
+    def scan(self, lines=None):
+        '''
+        Regex engine: yields (kind, start, end, line, col) for the same tokens repeated
+        getToken() calls would return, but matches each token in one TOKEN_RE call instead
+        of per character. source[start:end] is the token's text, without the quotes of a string.
+        A token's position is the line/column of its last character, where
+        columns on the first line start at 1 and at 0 on every other line.
+
+        Given an iterator of `lines`, they are appended to self.source whenever it runs out
+        or ends inside a string, and the lexed part is dropped. Offsets are then relative to
+        self.source as it is when the token is yielded.
+        '''
+        source = self.source
+        match, operators, getKind = TOKEN_RE.match, OPERATORS_TABLE, Token.getKind
+        pos, line, lineStart = 0, 1, -1  # lineStart is -1 so that line 1 counts from 1
+        while True:
+            m = match(source, pos)
+            if m is None:
+                pos = SKIP_RE.match(source, pos).end()
+                if lines is not None and (pos == len(source) or source[pos] == '"'):
+                    nextLine = next(lines, None)
+                    if nextLine is not None:
+                        source = self.source = source[pos:] + nextLine
+                        lineStart -= pos
+                        pos = 0
+                        continue
+                break
+            kind = m.lastgroup
+            end = m.end()
+            if kind == 'op':
+                text = m.group(kind)
+                yield operators[text], end - len(text), end, line, end - 1 - lineStart
+                if text == '\n':
+                    line += 1
+                    lineStart = end
+            elif kind == 'ident':
+                text = m.group(kind)
+                yield getKind(text), end - len(text), end, line, end - 1 - lineStart
+            elif kind == 'number':
+                text = m.group(kind)
+                if text[-1] == '.':
+                    self.curLine, self.linePos = line, end - 1 - lineStart
+                    self.abort("Illegal character in number: " + source[end:end + 1].ljust(1, '\0'))
+                yield Symbols.NUMBER, end - len(text), end, line, end - 1 - lineStart
+            else:  # string, may span several lines
+                start = m.start(kind)
+                newlines = source.count('\n', start, end)
+                if newlines:
+                    line += newlines
+                    lineStart = source.rindex('\n', start, end) + 1
+                yield Symbols.STRING, start, end - 1, line, end - 1 - lineStart
+            pos = end
+
+        # No token matched: this is either the end of input or a lexing error.
+        self.curLine, self.linePos = line, pos - lineStart
+        char = source[pos] if pos < len(source) else '\0'
+        if char == '\0':
+            yield Symbols.EOF, pos, pos + 1, line, pos - lineStart
+        elif char == '!':
+            self.abort("Expected !=, got !" + source[pos + 1:pos + 2].ljust(1, '\0'))
+        elif char == '"':
+            self.abort("Unterminated string")
+        else:
+            self.abort("Unknown token: " + char)
 
 
 # TokenType is our enum for all the types of tokens.
@@ -262,9 +384,11 @@ class Keywords(Enum):
     INCLUDE = auto()
     MACRO = auto()
     BREAK = auto()
+    INLINE = auto()
+    NOINLINE = auto()
 
 assert len(
-    Keywords) == 17, "Exhaustive handling of keywords table, forgot to add support for a keyword?"
+    Keywords) == 19, "Exhaustive handling of keywords table, forgot to add support for a keyword?"
 KEYWORDS_TABLE = {
     'if': Keywords.IF,
     'label': Keywords.LABEL,
@@ -283,6 +407,47 @@ KEYWORDS_TABLE = {
     'include': Keywords.INCLUDE,
     'macro': Keywords.MACRO,
     'break': Keywords.BREAK,
+    'inline': Keywords.INLINE,
+    'noinline': Keywords.NOINLINE,
+}
+
+
+# Everything the regex engine skips before a token: blanks and at most one comment.
+SKIP_RE = re.compile(r'[ \t\r]*(?://[^\n]*)?')
+# The alternatives start with disjoint characters, so their order only matters for speed.
+TOKEN_RE = re.compile(SKIP_RE.pattern + r'''(?:
+      (?P<op>[=!<>]=|>>|<<|[-+*/=<>():%,&|^\#\[\]\n])
+    | (?P<ident>[^\W\d][\w-]*)
+    | (?P<number>[0-9]+(?:\.[0-9]*)?)
+    | "(?P<string>[^"]*)"
+)''', re.VERBOSE)
+
+OPERATORS_TABLE = {
+    '+': Symbols.PLUS,
+    '-': Symbols.MINUS,
+    '*': Symbols.ASTERISK,
+    '/': Symbols.SLASH,
+    '=': Symbols.EQ,
+    '==': Symbols.EQEQ,
+    '!=': Symbols.NOTEQ,
+    '>': Symbols.GT,
+    '>=': Symbols.GTEQ,
+    '>>': Symbols.GTGT,
+    '<': Symbols.LT,
+    '<=': Symbols.LTEQ,
+    '<<': Symbols.LTLT,
+    '(': Symbols.LPARENT,
+    ')': Symbols.RPARENT,
+    '[': Symbols.LBRACKET,
+    ']': Symbols.RBRACKET,
+    ':': Symbols.COLON,
+    '%': Symbols.MOD,
+    ',': Symbols.COMMA,
+    '&': Symbols.BAND,
+    '|': Symbols.BOR,
+    '^': Symbols.BXOR,
+    '#': Symbols.BANG,
+    '\n': Symbols.NEWLINE,
 }
 
 
@@ -318,3 +483,103 @@ class Token:
 
     def __str__(self) -> str:
         return f'({self.kind}, {repr(self.text)}, {self.pos}, expandFrom={self.expandFrom})'
+
+
+# Every token kind, indexed by the small integer a TokenStore keeps instead of the enum
+KINDS = [*Symbols, *Keywords, *Builtins]
+KIND_IDS = {kind: i for i, kind in enumerate(KINDS)}
+
+
+class TokenStore:
+    '''
+    Tokens of a whole compilation as parallel arrays, one row per token.
+    A row holds the kind id, the [start, end) offsets of its text in the source it was
+    lexed from (srcs) and the file/line/column it is reported at (files). Macro expansion
+    appends rows whose text comes from the macro body and whose position is the use site,
+    with `origins` pointing back at the body row (-1 for plain lexed tokens).
+    Text is only sliced out of the source when asked for.
+    '''
+    def __init__(self):
+        self.kinds = array('B')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.srcs = array('H')
+        self.files = array('H')
+        self.lines = array('i')
+        self.cols = array('i')
+        self.origins = array('i')
+        self.names: list[str] = []     # file names, interned
+        self.sources: list[str] = []   # file contents, each followed by a '\0' for its EOF token
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def addSource(self, name, source):
+        ''' Register a file's text, returns its id '''
+        self.names.append(sys.intern(name))
+        self.sources.append(source + '\0')
+        return len(self.sources) - 1
+
+    def rows(self, first, last):
+        ''' Columns of rows [first, last), which must all be plainly lexed from one file '''
+        return {column: getattr(self, column)[first:last] for column in ('kinds', 'starts', 'ends', 'lines', 'cols')}
+
+    def addRows(self, name, source, rows):
+        ''' Append rows taken with rows() for the file `name`, returns the first new row '''
+        first, file, count = len(self), self.addSource(name, source), len(rows['kinds'])
+        for column, values in rows.items():
+            getattr(self, column).extend(values)
+        self.srcs.extend(array('H', [file]) * count)
+        self.files.extend(array('H', [file]) * count)
+        self.origins.extend(array('i', [-1]) * count)
+        return first
+
+    def kind(self, i):
+        return KINDS[self.kinds[i]]
+
+    def text(self, i):
+        return self.sources[self.srcs[i]][self.starts[i]:self.ends[i]]
+
+    def pos(self, i):
+        return (self.names[self.files[i]], self.lines[i], self.cols[i])
+
+    def token(self, i):
+        return TokenRef(self, i)
+
+    def expand(self, i, site):
+        ''' Append a copy of row i reported at the position of row `site`, returns the new row '''
+        self.kinds.append(self.kinds[i])
+        self.starts.append(self.starts[i])
+        self.ends.append(self.ends[i])
+        self.srcs.append(self.srcs[i])
+        self.files.append(self.files[site])
+        self.lines.append(self.lines[site])
+        self.cols.append(self.cols[site])
+        self.origins.append(i)
+        return len(self.kinds) - 1
+
+
+class TokenRef:
+    ''' A Token-like view of one TokenStore row, built when the parser looks at it '''
+    __slots__ = ('store', 'index', 'kind')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.kind = KINDS[store.kinds[index]]  # checked over and over by the parser, so not lazy
+
+    @property
+    def text(self):
+        return self.store.text(self.index)
+
+    @property
+    def pos(self):
+        return self.store.pos(self.index)
+
+    @property
+    def expandFrom(self):
+        origin = self.store.origins[self.index]
+        return TokenRef(self.store, origin) if origin != -1 else None
+
+    def __str__(self) -> str:
+        return f'({self.kind}, {repr(self.text)}, {self.pos}, expandFrom={self.expandFrom})'
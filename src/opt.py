@@ -0,0 +1,1101 @@
+# Optimizations over the AST, run between Parser.program() and Emitter.fromdict.
+# Values are 64 bit two's complement integers, computed the way the emitted code does:
+# `/` and `%` truncate toward zero like idiv, `>>` is a logical shift and shift counts are
+# masked to 6 bits like the count in cl.
+from src.parse import AstNode, BinaryNode, NumberNode, IdentNode, LetStatementNode, PlainExpressionNode, PointerNode, AssignmentExpressionNode
+from typing import Callable, Optional
+from dataclasses import dataclass
+from copy import deepcopy
+
+MASK = (1 << 64) - 1
+
+def wrap(value: int) -> int:
+    ''' value as a signed 64 bit integer '''
+    value &= MASK
+    return value - (1 << 64) if value >> 63 else value
+
+def divide(left: int, right: int) -> int:
+    quotient = abs(left) // abs(right)
+    return -quotient if (left < 0) != (right < 0) else quotient
+
+OPERATORS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': divide,
+    '%': lambda a, b: a - divide(a, b) * b,
+    '<<': lambda a, b: a << (b & 63),
+    '>>': lambda a, b: (a & MASK) >> (b & 63),
+    '&': lambda a, b: a & b,
+    '|': lambda a, b: a | b,
+    '^': lambda a, b: a ^ b,
+    '<': lambda a, b: int(a < b),
+    '>': lambda a, b: int(a > b),
+    '<=': lambda a, b: int(a <= b),
+    '>=': lambda a, b: int(a >= b),
+    '==': lambda a, b: int(a == b),
+    '!=': lambda a, b: int(a != b),
+}
+
+def binary(operator: str, left: int, right: int) -> Optional[int]:
+    ''' Value of `left operator right`, None if it traps at run time (division by zero or overflow) '''
+    if operator in ('/', '%') and (right == 0 or left == -2**63 and right == -1):
+        return None
+    return wrap(OPERATORS[operator](left, right))
+
+def unary(operator: str, value: int) -> int:
+    return wrap(-value) if operator == '-' else value
+
+def evaluate(expr) -> Optional[int]:
+    ''' Value of a constant expression without changing it, None if it is not constant '''
+    if expr is None:
+        return None
+    if expr.typ == 'number':
+        return wrap(int(expr.text))
+    if expr.typ == 'expression':
+        return evaluate(expr.child)
+    if expr.typ == 'unary_operator':
+        value = evaluate(expr.child)
+        return None if value is None else unary(expr.text, value)
+    if isinstance(expr, BinaryNode):
+        left, right = evaluate(expr.left), evaluate(expr.right)
+        if left is None or right is None:
+            return None
+        return binary(expr.text, left, right)
+    return None
+
+def targetName(expr) -> Optional[str]:
+    ''' The variable an assignment_expression assigns to, None for subscripts and pointers '''
+    while expr.typ == 'expression':
+        expr = expr.child
+    return expr.text if expr.typ == 'ident' else None
+
+class ConstantFolder:
+    '''
+    Replaces constant expressions by their value and reads of variables that are only ever
+    set by one `let` to a constant by that constant. Functions are their own scope: their
+    parameters and lets hide the constants of the code around them.
+    '''
+    def __init__(self):
+        self.folded = 0      # operators replaced by their value
+        self.propagated = 0  # variable reads replaced by a constant
+        self.assigned: set[str] = set()     # targets of assignment_expression anywhere
+        self.subscripted: set[str] = set()  # list variables, read through their address
+
+    def program(self, program: dict):
+        statements = program['program']['statements']
+        self.collect(statements)
+        self.scope(statements, [], {})
+
+    def stats(self) -> str:
+        return f'constant folding: {self.folded} nodes folded, {self.propagated} variable reads propagated'
+
+    def collect(self, node):
+        if isinstance(node, list):
+            for item in node:
+                self.collect(item)
+            return
+        if not isinstance(node, AstNode):
+            return
+        if node.typ == 'assignment_expression':
+            name = targetName(node.left)
+            if name is not None:
+                self.assigned.add(name)
+        elif node.typ == 'subscript_expression':
+            self.subscripted.add(node.child.text)
+        for field in node.FIELDS:
+            self.collect(getattr(node, field, None))
+
+    @staticmethod
+    def lets(statements: list, counts: dict[str, int]) -> dict[str, int]:
+        ''' How often each name is defined by a `let` in this scope, functions not included '''
+        for statement in statements:
+            if not isinstance(statement, AstNode) or statement.typ == 'func_declaration':
+                continue
+            if statement.typ == 'let_statement':
+                name = statement.left.text
+                # a list can not be propagated, count it twice
+                counts[name] = counts.get(name, 0) + (2 if statement.args else 1)
+            for field in ('body', 'alternative'):
+                ConstantFolder.lets(getattr(statement, field, None) or [], counts)
+        return counts
+
+    def scope(self, statements: list, params: list[str], outer: dict[str, int]):
+        counts = self.lets(statements, {name: 2 for name in params})
+        # the constants of the enclosing code, unless a variable here hides them
+        self.constants = {name: value for name, value in outer.items() if name not in counts}
+        self.single = {name for name, count in counts.items()
+                       if count == 1 and name not in self.assigned and name not in self.subscripted}
+        for statement in statements:
+            self.statement(statement)
+
+    def statement(self, statement):
+        if statement.typ == 'func_declaration':
+            constants, single = self.constants, self.single
+            self.scope(statement.body, [arg.text for arg in statement.args], constants)
+            self.constants, self.single = constants, single
+            return
+        if statement.typ == 'let_statement':
+            if statement.args:
+                statement.args = [self.fold(arg) for arg in statement.args]
+            statement.right = self.fold(statement.right)
+            value = evaluate(statement.right)
+            if statement.left.text in self.single and value is not None:
+                self.constants[statement.left.text] = value
+            return
+        if statement.typ in ('label_statement', 'goto_statement', 'break_statement', 'include_statement'):
+            return
+        if isinstance(statement, AstNode) and statement.typ.endswith('_statement'):
+            for field in ('child', 'condition', 'value'):
+                if getattr(statement, field, None) is not None:
+                    setattr(statement, field, self.fold(getattr(statement, field)))
+            for field in ('body', 'alternative'):
+                for stmt in getattr(statement, field, None) or []:
+                    self.statement(stmt)
+            return
+        self.fold(statement) # expression statement
+
+    def fold(self, expr):
+        ''' Fold expr and everything below it, returns what replaces it '''
+        typ = expr.typ
+        if typ in ('number', 'string'):
+            return expr
+        if typ == 'ident':
+            if expr.text in self.constants:
+                self.propagated += 1
+                return NumberNode(text=str(self.constants[expr.text]))
+            return expr
+        if typ == 'expression':
+            expr.child = self.fold(expr.child)
+            return expr
+        if typ == 'unary_operator':
+            expr.child = self.fold(expr.child)
+            value = evaluate(expr.child)
+            if value is not None:
+                self.folded += 1
+                return NumberNode(text=str(unary(expr.text, value)))
+            return expr
+        if isinstance(expr, BinaryNode):
+            expr.left, expr.right = self.fold(expr.left), self.fold(expr.right)
+            left, right = evaluate(expr.left), evaluate(expr.right)
+            if left is not None and right is not None:
+                value = binary(expr.text, left, right)
+                if value is not None:
+                    self.folded += 1
+                    return NumberNode(text=str(value))
+            return expr
+        if typ == 'assignment_expression':
+            if targetName(expr.left) is None:
+                expr.left = self.fold(expr.left)
+            expr.right = self.fold(expr.right)
+        elif typ == 'pointer':
+            expr.child = self.fold(expr.child)
+        elif typ == 'subscript_expression':
+            expr.value = self.fold(expr.value)
+        elif typ == 'call_expression':
+            expr.args = [self.fold(arg) for arg in expr.args]
+        elif typ == 'list_expression':
+            expr.items = [self.fold(item) for item in expr.items]
+        return expr
+
+EXIT_SYSCALLS = (60, 231)  # exit and exit_group
+TERMINATORS = ('return_statement', 'break_statement')
+
+def unwrap(expr):
+    while expr is not None and expr.typ == 'expression':
+        expr = expr.child
+    return expr
+
+def pure(expr) -> bool:
+    ''' Whether evaluating expr has no effect besides its value: no calls and no assignments '''
+    if isinstance(expr, list):
+        return all(pure(item) for item in expr)
+    if not isinstance(expr, AstNode):
+        return True
+    if expr.typ in ('call_expression', 'assignment_expression'):
+        return False
+    return all(pure(getattr(expr, field, None)) for field in expr.FIELDS if field != 'typ')
+
+class DeadCodeEliminator:
+    '''
+    Removes code that can not run or whose result nothing uses: the statements after a `return`,
+    `break` or a call that never returns (up to the next label), the functions no call can reach
+    from the top-level code, and the `let`s of variables that are never read, when the value
+    has no side effects.
+    '''
+    def __init__(self):
+        self.functions = 0   # func declarations removed
+        self.statements = 0  # statements removed, not counting the ones inside removed functions
+        self.exits: set[str] = set()  # functions that end the program
+
+    def program(self, program: dict):
+        statements = program['program']['statements']
+        declarations = self.declarations(statements, {})
+        self.exits = self.exiting(declarations)
+        self.unreachable(statements)
+        reachable = self.reachable(statements, declarations)
+        self.shake(statements, reachable)
+        while self.unused(statements, self.references(statements, {})):
+            pass
+
+    def stats(self) -> str:
+        return f'dead code: {self.functions} functions and {self.statements} statements removed'
+
+    @staticmethod
+    def declarations(statements: list, found: dict[str, list]) -> dict[str, list]:
+        ''' The func_declarations by name, nested ones included '''
+        for statement in DeadCodeEliminator.blocks(statements):
+            if statement.typ == 'func_declaration':
+                found.setdefault(statement.text, []).append(statement)
+        return found
+
+    @staticmethod
+    def blocks(statements: list):
+        ''' Every statement of statements and of the blocks inside them '''
+        for statement in statements:
+            if not isinstance(statement, AstNode):
+                continue
+            yield statement
+            for field in ('body', 'alternative'):
+                yield from DeadCodeEliminator.blocks(getattr(statement, field, None) or [])
+
+    def exiting(self, declarations: dict[str, list]) -> set[str]:
+        '''
+        Functions that end the program: their body calls exit, or a function that does, and has
+        no return statement, in none of its blocks, that could get back to the caller first
+        '''
+        exiting: set[str] = set()
+        changed = True
+        while changed:
+            changed = False
+            for name, functions in declarations.items():
+                if name not in exiting and all(any(self.ends(stmt, exiting) for stmt in func.body)
+                        and not any(stmt.typ == 'return_statement' for stmt in self.blocks(func.body)) for func in functions):
+                    exiting.add(name)
+                    changed = True
+        return exiting
+
+    @staticmethod
+    def ends(statement, exiting: set[str]) -> bool:
+        ''' Whether the program never gets past this statement by the call it makes '''
+        call = unwrap(statement)
+        if not isinstance(call, AstNode) or call.typ != 'call_expression':
+            return False
+        if call.text == 'syscall':
+            return bool(call.args) and evaluate(call.args[0]) in EXIT_SYSCALLS
+        return call.text in exiting
+
+    def unreachable(self, statements: list, inFunc=False):
+        '''
+        Drop the statements after one that does not continue with the next, up to a label. Only
+        in a function `return` is one of them, the top-level code goes on after it.
+        '''
+        kept, dead = [], False
+        for statement in statements:
+            if dead and statement.typ != 'label_statement':
+                self.statements += 1
+                continue
+            kept.append(statement)
+            terminators = TERMINATORS if inFunc else tuple(typ for typ in TERMINATORS if typ != 'return_statement')
+            dead = statement.typ in terminators or self.ends(statement, self.exits)
+            for field in ('body', 'alternative'):
+                self.unreachable(getattr(statement, field, None) or [], inFunc or statement.typ == 'func_declaration')
+        statements[:] = kept
+
+    def reachable(self, statements: list, declarations: dict[str, list]) -> set[str]:
+        ''' Names of the functions called from the top-level code, directly or through other functions '''
+        reachable: set[str] = set()
+        work = [statements]
+        while work:
+            for name in self.calls(work.pop(), set()):
+                if name in declarations and name not in reachable:
+                    reachable.add(name)
+                    work.extend(func.body for func in declarations[name])
+        return reachable
+
+    @staticmethod
+    def calls(node, names: set[str]) -> set[str]:
+        ''' Names called or mentioned in node, without going into the functions declared there '''
+        if isinstance(node, list):
+            for item in node:
+                DeadCodeEliminator.calls(item, names)
+            return names
+        if not isinstance(node, AstNode) or node.typ == 'func_declaration':
+            return names
+        if node.typ in ('call_expression', 'ident'):
+            names.add(node.text)
+        for field in node.FIELDS:
+            if field != 'typ':
+                DeadCodeEliminator.calls(getattr(node, field, None), names)
+        return names
+
+    def shake(self, statements: list, reachable: set[str]):
+        for statement in list(statements):
+            if statement.typ == 'func_declaration' and statement.text not in reachable:
+                statements.remove(statement)
+                self.functions += 1
+                continue
+            for field in ('body', 'alternative'):
+                self.shake(getattr(statement, field, None) or [], reachable)
+
+    @staticmethod
+    def references(node, counts: dict[str, int]) -> dict[str, int]:
+        ''' How often each variable is read or assigned, the names `let` defines not included '''
+        if isinstance(node, list):
+            for item in node:
+                DeadCodeEliminator.references(item, counts)
+            return counts
+        if not isinstance(node, AstNode):
+            return counts
+        if node.typ == 'ident':
+            counts[node.text] = counts.get(node.text, 0) + 1
+        for field in node.FIELDS:
+            if field != 'typ' and not (node.typ == 'let_statement' and field == 'left'):
+                DeadCodeEliminator.references(getattr(node, field, None), counts)
+        return counts
+
+    def unused(self, statements: list, references: dict[str, int]) -> bool:
+        ''' Drop the lets of variables that are never referenced, returns whether it did '''
+        removed = False
+        for statement in list(statements):
+            if statement.typ == 'let_statement' and statement.left.text not in references \
+                    and pure(statement.right) and pure(statement.args):
+                statements.remove(statement)
+                self.statements += 1
+                removed = True
+                continue
+            for field in ('body', 'alternative'):
+                removed |= self.unused(getattr(statement, field, None) or [], references)
+        return removed
+
+INLINE_LIMIT = 24  # nodes in the body of a function that is inlined without being marked `inline`
+
+def size(node) -> int:
+    ''' Number of nodes in node '''
+    if isinstance(node, list):
+        return sum(size(item) for item in node)
+    if not isinstance(node, AstNode):
+        return 0
+    return 1 + sum(size(getattr(node, field, None)) for field in node.FIELDS if field != 'typ')
+
+def names(node, found: set[str]) -> set[str]:
+    ''' The identifiers in node '''
+    if isinstance(node, list):
+        for item in node:
+            names(item, found)
+    elif isinstance(node, AstNode):
+        if node.typ == 'ident':
+            found.add(node.text)
+        for field in node.FIELDS:
+            if field != 'typ':
+                names(getattr(node, field, None), found)
+    return found
+
+class Inliner:
+    '''
+    Replaces calls to small functions that do not call themselves by their body. Only calls
+    that are a whole statement, or the whole value of a let, an assignment to a variable, a print
+    or a return are inlined: the arguments go into new variables in their order, the parameters
+    and lets of the body are renamed to new names and the final `return` gives the value.
+    `inline func` inlines a function of any size, `noinline func` never inlines it.
+    '''
+    def __init__(self):
+        self.inlined: dict[str, int] = {}  # calls inlined by function name
+        self.kept: dict[str, str] = {}     # why a function that is called was not inlined
+        self.count = 0                     # renamed variables so far, for unique names
+
+    def program(self, program: dict):
+        statements = program['program']['statements']
+        self.functions = {}
+        for statement in DeadCodeEliminator.blocks(statements):
+            if statement.typ == 'func_declaration':
+                # two functions of one name can not be told apart by the call
+                self.functions[statement.text] = None if statement.text in self.functions else statement
+        self.recursive = self.cycles()
+        # the variables the functions use from the top level are the ones there, nothing hides them
+        self.block(statements, set())
+        for statement in DeadCodeEliminator.blocks(statements):
+            if statement.typ == 'func_declaration':
+                self.block(statement.body, self.lets(statement.body, {arg.text for arg in statement.args}))
+
+    def stats(self) -> str:
+        inlined = ', '.join(f'{name} at {count} call{"s" if count > 1 else ""}' for name, count in self.inlined.items())
+        kept = ', '.join(f'{name} ({reason})' for name, reason in self.kept.items())
+        return f'inlining: {inlined or "nothing"}; kept: {kept or "nothing"}'
+
+    def cycles(self) -> set[str]:
+        ''' Functions that can call themselves '''
+        callees = {name: DeadCodeEliminator.calls(func.body, set()) & self.functions.keys()
+                   for name, func in self.functions.items() if func is not None}
+        recursive = set()
+        for name in callees:
+            seen, work = set(), list(callees[name])
+            while work:
+                callee = work.pop()
+                if callee == name:
+                    recursive.add(name)
+                    break
+                if callee not in seen:
+                    seen.add(callee)
+                    work.extend(callees.get(callee, ()))
+        return recursive
+
+    @staticmethod
+    def lets(statements: list, found: set[str]) -> set[str]:
+        ''' Names defined by the lets of a scope, the functions in it not included '''
+        for statement in statements:
+            if statement.typ == 'func_declaration':
+                continue
+            if statement.typ == 'let_statement':
+                found.add(statement.left.text)
+            for field in ('body', 'alternative'):
+                Inliner.lets(getattr(statement, field, None) or [], found)
+        return found
+
+    def reason(self, func) -> Optional[str]:
+        ''' Why func can not be inlined, None if it can '''
+        if func is None:
+            return 'declared more than once'
+        if func.inline is False:
+            return 'noinline'
+        if func.text in self.recursive:
+            return 'recursive'
+        if func.inline is None and size(func.body) > INLINE_LIMIT:
+            return f'larger than {INLINE_LIMIT} nodes'
+        if not self.simple(func.body[:-1], 0) or func.body and not self.simple(func.body[-1:], 0, final=True):
+            return 'returns early or jumps'
+        params = {arg.text for arg in func.args}
+        for statement in DeadCodeEliminator.blocks(func.body):
+            for node in self.subscripts(statement, []):
+                if node.child.text in params:
+                    return 'subscripts a parameter'
+        return None
+
+    def simple(self, statements: list, loops: int, final=False) -> bool:
+        ''' Whether the statements only leave at their end: no return but a final one, no break out of them '''
+        for statement in statements:
+            typ = statement.typ
+            if typ in ('func_declaration', 'label_statement', 'goto_statement', 'include_statement'):
+                return False
+            if typ == 'return_statement' and not final or typ == 'break_statement' and not loops:
+                return False
+            inner = loops + (typ == 'while_statement')
+            for field in ('body', 'alternative'):
+                if not self.simple(getattr(statement, field, None) or [], inner):
+                    return False
+        return True
+
+    @staticmethod
+    def subscripts(node, found: list) -> list:
+        if isinstance(node, list):
+            for item in node:
+                Inliner.subscripts(item, found)
+        elif isinstance(node, AstNode) and node.typ != 'func_declaration':
+            if node.typ == 'subscript_expression':
+                found.append(node)
+            for field in node.FIELDS:
+                if field not in ('typ', 'body', 'alternative'):
+                    Inliner.subscripts(getattr(node, field, None), found)
+        return found
+
+    def block(self, statements: list, scope: set[str]):
+        ''' Inline the calls in statements, `scope` has the variables of the function they are in '''
+        i = 0
+        while i < len(statements):
+            statement = statements[i]
+            if statement.typ != 'func_declaration':
+                for field in ('body', 'alternative'):
+                    self.block(getattr(statement, field, None) or [], scope)
+            expanded = self.expand(statement, scope)
+            if expanded is None:
+                i += 1
+            else:
+                statements[i:i + 1] = expanded  # inlined bodies may have calls to inline themselves
+        return statements
+
+    @staticmethod
+    def site(statement) -> Optional[tuple]:
+        ''' (node, field) holding the call a statement may inline, (None, None) for a call statement '''
+        if statement.typ == 'let_statement' and not statement.args:
+            return statement, 'right'
+        if statement.typ == 'print_statement':
+            return statement, 'child'
+        if statement.typ == 'return_statement':
+            return statement, 'value'
+        expr = unwrap(statement)
+        if isinstance(expr, AstNode) and expr.typ == 'assignment_expression' and targetName(expr.left) is not None:
+            return expr, 'right'
+        if isinstance(expr, AstNode) and expr.typ == 'call_expression':
+            return None, None
+        return None
+
+    def expand(self, statement, scope: set[str]) -> Optional[list]:
+        ''' The statements replacing statement with its call inlined, None if it keeps the call '''
+        site = self.site(statement)
+        if site is None:
+            return None
+        holder, field = site
+        call = unwrap(statement if holder is None else getattr(holder, field))
+        if not isinstance(call, AstNode) or call.typ != 'call_expression' or call.text not in self.functions:
+            return None
+        func = self.functions[call.text]
+        reason = self.reason(func)
+        returns = bool(func and func.body) and func.body[-1].typ == 'return_statement'
+        if reason is None and holder is not None and not returns:
+            reason = 'no value to use'
+        if reason is None and len(call.args) != len(func.args):
+            reason = 'called with other arguments'
+        params = {arg.text for arg in func.args} if func else set()
+        if reason is None and (names(func.body, set()) - params - self.lets(func.body, set())) & scope:
+            reason = 'a variable of the caller hides one it uses'
+        if reason is not None:
+            self.kept.setdefault(call.text, reason)
+            return None
+        self.kept.pop(call.text, None)
+        self.inlined[call.text] = self.inlined.get(call.text, 0) + 1
+        body = deepcopy(func.body)
+        collected = ConstantFolder()
+        collected.collect(body)
+        assigned = collected.assigned | self.lets(body, set())  # what the body may change
+        calls = DeadCodeEliminator.calls(body, set()) & self.functions.keys()
+        renames, code = {}, []
+        for i, (arg, value) in enumerate(zip(func.args, call.args)):
+            expr = unwrap(value)
+            later = all(pure(other) for other in call.args[i + 1:])  # the arguments after it change nothing
+            if arg.text not in assigned and (expr.typ == 'number' or expr.typ == 'ident' and expr.text not in assigned and not calls and later):
+                renames[arg.text] = expr  # used as it is, nothing can change it in the meantime
+                continue
+            renames[arg.text] = IdentNode(text=self.fresh(arg.text))
+            code.append(LetStatementNode(left=IdentNode(text=renames[arg.text].text), right=value))
+        for name in sorted(self.lets(body, set())):
+            if name not in renames:
+                renames[name] = IdentNode(text=self.fresh(name))
+        self.rename(body, renames)
+        result = None
+        if returns:
+            result = body.pop().value
+        code += body
+        if holder is None:
+            if result is not None and not pure(result):
+                code.append(PlainExpressionNode(child=result))
+        else:
+            setattr(holder, field, result)
+            code.append(statement)
+        return code
+
+    def fresh(self, name: str) -> str:
+        self.count += 1
+        return f'__inline_{self.count}_{name}__'
+
+    @staticmethod
+    def rename(node, renames: dict):
+        ''' Replace the identifiers in renames, in place '''
+        if isinstance(node, list):
+            for i, item in enumerate(node):
+                if isinstance(item, AstNode) and item.typ == 'ident' and item.text in renames:
+                    node[i] = deepcopy(renames[item.text])
+                else:
+                    Inliner.rename(item, renames)
+            return
+        if not isinstance(node, AstNode):
+            return
+        for field in node.FIELDS:
+            if field == 'typ':
+                continue
+            value = getattr(node, field, None)
+            if isinstance(value, AstNode) and value.typ == 'ident' and value.text in renames:
+                setattr(node, field, deepcopy(renames[value.text]))
+            else:
+                Inliner.rename(value, renames)
+
+HOIST_COST = 2  # an invariant expression is moved out of a loop when it costs at least this much
+
+def safe(expr) -> bool:
+    ''' Whether expr may be evaluated anywhere, any number of times: no effects, no loads, no traps '''
+    expr = unwrap(expr)
+    if expr.typ in ('number', 'ident'):
+        return True
+    if expr.typ == 'unary_operator':
+        return safe(expr.child)
+    if isinstance(expr, BinaryNode):
+        if expr.text in ('/', '%') and evaluate(expr.right) in (None, 0, -1):
+            return False
+        return safe(expr.left) and safe(expr.right)
+    return False
+
+def cost(expr) -> Optional[int]:
+    '''
+    Instructions expr roughly takes, multiplications, divisions and subscripts count double. None
+    for comparisons: they become the flags of a conditional jump, a variable would be tested again.
+    '''
+    expr = unwrap(expr)
+    if expr.typ in ('unary_operator', 'pointer', 'subscript_expression'):
+        inner = cost(expr.value if expr.typ == 'subscript_expression' else expr.child)
+        return None if inner is None else inner + (2 if expr.typ == 'subscript_expression' else 1)
+    if not isinstance(expr, BinaryNode):
+        return 0
+    if expr.typ == 'comparison_op':
+        return None
+    left, right = cost(expr.left), cost(expr.right)
+    if left is None or right is None:
+        return None
+    return left + right + (2 if expr.text in ('*', '/', '%') else 1)
+
+class LoopOptimizer:
+    '''
+    Moves the work that does not change between iterations out of while loops. A loop invariant
+    expression, one that only reads variables the loop does not change, is computed once into a
+    new variable before the loop. A subscript of a list whose index is i * a + b, where i only
+    changes by a constant step at the end of each iteration and b is invariant, becomes a pointer
+    that starts at the element of the first iteration and moves by the step.
+    '''
+    def __init__(self):
+        self.hoisted = 0   # invariant expressions moved before a loop
+        self.reduced = 0   # subscripts turned into pointers
+        self.count = 0     # new variables so far, for unique names
+
+    def program(self, program: dict):
+        statements = program['program']['statements']
+        collected = ConstantFolder()
+        collected.collect(statements)
+        self.assigned = collected.assigned
+        # what the functions assign may change when the loop calls one
+        self.changedByCalls = set()
+        for statement in DeadCodeEliminator.blocks(statements):
+            if statement.typ == 'func_declaration':
+                inner = ConstantFolder()
+                inner.collect(statement.body)
+                self.changedByCalls |= inner.assigned
+        self.functions = {statement.text for statement in DeadCodeEliminator.blocks(statements) if statement.typ == 'func_declaration'}
+        self.scope(statements)
+
+    def stats(self) -> str:
+        return f'loops: {self.hoisted} invariant expressions hoisted, {self.reduced} subscripts turned into pointers'
+
+    def scope(self, statements: list):
+        ''' Optimize the loops of a scope, the top-level code or a function body '''
+        self.lists = self.arrays(statements, set())
+        self.block(statements)
+
+    @staticmethod
+    def arrays(statements: list, found: set[str]) -> set[str]:
+        ''' Names a `let` of this scope defines as a list '''
+        for statement in statements:
+            if statement.typ == 'func_declaration':
+                continue
+            if statement.typ == 'let_statement' and (statement.args or unwrap(statement.right).typ == 'list_expression'):
+                found.add(statement.left.text)
+            for field in ('body', 'alternative'):
+                LoopOptimizer.arrays(getattr(statement, field, None) or [], found)
+        return found
+
+    def block(self, statements: list):
+        i = 0
+        while i < len(statements):
+            statement = statements[i]
+            if statement.typ == 'func_declaration':
+                lists = self.lists
+                self.scope(statement.body)
+                self.lists = lists
+            elif statement.typ == 'while_statement':
+                # inner loops first, what they hoist may be invariant in this loop too
+                self.block(statement.body)
+                before = self.hoist(statement) + self.pointers(statement)
+                statements[i:i] = before
+                i += len(before)
+            else:
+                for field in ('body', 'alternative'):
+                    self.block(getattr(statement, field, None) or [])
+            i += 1
+
+    def variant(self, loop) -> set[str]:
+        ''' Variables whose value may change while the loop runs '''
+        collected = ConstantFolder()
+        collected.collect([loop.condition, loop.body])
+        changed = collected.assigned | Inliner.lets(loop.body, set())
+        if DeadCodeEliminator.calls([loop.condition, loop.body], set()) & self.functions:
+            changed |= self.changedByCalls
+        return changed
+
+    def fresh(self, prefix: str) -> IdentNode:
+        self.count += 1
+        return IdentNode(text=f'__{prefix}_{self.count}__')
+
+    def hoist(self, loop) -> list:
+        ''' Replace the invariant expressions of loop by new variables, returns their lets '''
+        variant, temps, moved = self.variant(loop), {}, []
+        # what an inner loop hoisted into this one may be invariant here too, it moves on as it is
+        while True:
+            outer = [statement for statement in loop.body if statement.typ == 'let_statement' and statement.left.text.startswith('__invariant_')
+                     and not names(statement.right, set()) & (variant - {statement.left.text})]
+            if not outer:
+                break
+            for statement in outer:
+                loop.body.remove(statement)
+                variant.discard(statement.left.text)
+            moved += outer
+        def visit(node):
+            if isinstance(node, list):
+                node[:] = [visit(item) for item in node]
+                return node
+            if not isinstance(node, AstNode) or node.typ == 'func_declaration':
+                return node
+            expr = unwrap(node)
+            if isinstance(expr, AstNode) and (cost(expr) or 0) >= HOIST_COST and safe(expr) and not names(expr, set()) & variant:
+                key = repr(expr)
+                if key not in temps:
+                    temps[key] = (self.fresh('invariant'), expr)
+                    self.hoisted += 1
+                return IdentNode(text=temps[key][0].text)
+            for field in node.FIELDS:
+                if field in ('typ', 'inline') or node.typ == 'let_statement' and field in ('left', 'args') \
+                        or node.typ == 'assignment_expression' and field == 'left' and targetName(node.left) is not None:
+                    continue
+                value = getattr(node, field, None)
+                if isinstance(value, (AstNode, list)):
+                    setattr(node, field, visit(value))
+            return node
+        loop.condition = visit(loop.condition)
+        visit(loop.body)
+        return moved + [LetStatementNode(left=name, right=expr) for name, expr in temps.values()]
+
+    def inductions(self, loop) -> dict[str, tuple[int, int]]:
+        ''' Variables changed exactly once per iteration, by `i = i + step` at the top of the body: name -> (index, step) '''
+        collected = ConstantFolder()
+        collected.collect([loop.condition, loop.body])
+        counts = {}
+        def count(node):
+            if isinstance(node, list):
+                for item in node:
+                    count(item)
+            elif isinstance(node, AstNode):
+                if node.typ == 'assignment_expression':
+                    name = targetName(node.left)
+                    counts[name] = counts.get(name, 0) + 1
+                for field in node.FIELDS:
+                    if field != 'typ':
+                        count(getattr(node, field, None))
+        count([loop.condition, loop.body])
+        lets = Inliner.lets(loop.body, set())
+        if DeadCodeEliminator.calls([loop.condition, loop.body], set()) & self.functions:
+            lets |= self.changedByCalls # a function the loop calls changes them too
+        found = {}
+        for index, statement in enumerate(loop.body):
+            expr = unwrap(statement)
+            if not isinstance(expr, AstNode) or expr.typ != 'assignment_expression':
+                continue
+            name, right = targetName(expr.left), unwrap(expr.right)
+            if name is None or counts.get(name) != 1 or name in lets or not isinstance(right, BinaryNode) or right.text not in ('+', '-'):
+                continue
+            left, other = unwrap(right.left), right.right
+            if right.text == '+' and (left.typ != 'ident' or left.text != name):
+                left, other = unwrap(right.right), right.left
+            step = evaluate(other)
+            if left.typ == 'ident' and left.text == name and step is not None:
+                found[name] = (index, step if right.text == '+' else -step)
+        return found
+
+    @staticmethod
+    def affine(expr, name: str, variant: set[str]) -> Optional[int]:
+        ''' a when expr is name * a + b with b invariant, None if it is not of that form '''
+        expr = unwrap(expr)
+        if expr.typ == 'ident' and expr.text == name:
+            return 1
+        if not names(expr, set()) & variant:
+            return 0 if safe(expr) else None
+        if expr.typ == 'unary_operator':
+            a = LoopOptimizer.affine(expr.child, name, variant)
+            return None if a is None else -a
+        if not isinstance(expr, BinaryNode) or expr.text not in ('+', '-', '*'):
+            return None
+        if expr.text == '*':
+            for factor, other in ((expr.left, expr.right), (expr.right, expr.left)):
+                k = evaluate(factor)
+                a = LoopOptimizer.affine(other, name, variant)
+                if k is not None and a is not None:
+                    return a * k
+            return None
+        a, b = LoopOptimizer.affine(expr.left, name, variant), LoopOptimizer.affine(expr.right, name, variant)
+        if a is None or b is None:
+            return None
+        return a + b if expr.text == '+' else a - b
+
+    def pointers(self, loop) -> list:
+        ''' Turn the affine subscripts of loop into pointers, returns the lets that start them '''
+        inductions = self.inductions(loop)
+        if not inductions:
+            return []
+        variant = self.variant(loop)
+        pointers, increments = {}, {}  # key -> (pointer, start), statement index -> increments
+        def visit(node):
+            if isinstance(node, list):
+                node[:] = [visit(item) for item in node]
+                return node
+            if not isinstance(node, AstNode) or node.typ == 'func_declaration':
+                return node
+            expr = unwrap(node)
+            if isinstance(expr, AstNode) and expr.typ == 'subscript_expression' and expr.child.typ == 'ident':
+                pointer = self.pointer(expr, inductions, variant, pointers, increments)
+                if pointer is not None:
+                    return PointerNode(child=IdentNode(text=pointer))
+            for field in node.FIELDS:
+                if field in ('typ', 'inline') or node.typ == 'let_statement' and field in ('left', 'args'):
+                    continue
+                value = getattr(node, field, None)
+                if isinstance(value, (AstNode, list)):
+                    setattr(node, field, visit(value))
+            return node
+        loop.condition = visit(loop.condition)
+        visit(loop.body)
+        for index in sorted(increments, reverse=True):
+            loop.body[index + 1:index + 1] = increments[index]
+        return [LetStatementNode(left=IdentNode(text=name), right=start) for name, start in pointers.values()]
+
+    def pointer(self, expr, inductions, variant, pointers, increments) -> Optional[str]:
+        ''' Name of the pointer replacing the subscript expr, None if it stays a subscript '''
+        array, index = expr.child.text, unwrap(expr.value)
+        if array not in self.lists or array in self.assigned or array in variant or index.typ == 'ident':
+            return None # a plain variable index is already a single addressing mode
+        for name, (position, step) in inductions.items():
+            a = self.affine(index, name, variant)
+            if not a:
+                continue
+            key = repr((array, index))
+            if key not in pointers:
+                pointer = self.fresh('pointer').text
+                start = BinaryNode('operator', '+', IdentNode(text=array), BinaryNode('operator', '*', deepcopy(expr.value), NumberNode(text='8')))
+                pointers[key] = (pointer, start)
+                target = IdentNode(text=pointer)
+                move = BinaryNode('operator', '+', IdentNode(text=pointer), NumberNode(text=str(wrap(8 * a * step))))
+                increments.setdefault(position, []).append(PlainExpressionNode(child=AssignmentExpressionNode(left=target, right=move)))
+                self.reduced += 1
+            return pointers[key][0]
+        return None
+
+REUSE_COST = 2  # an expression computed again is taken from a variable when it costs at least this much
+
+def key(expr) -> str:
+    ''' The text of expr without parentheses, operands of commutative operators in a fixed order '''
+    expr = unwrap(expr)
+    if expr.typ in ('number', 'ident'):
+        return expr.text
+    if expr.typ == 'unary_operator':
+        return f'({expr.text}{key(expr.child)})'
+    if expr.typ == 'pointer':
+        return f'*({key(expr.child)})'
+    if expr.typ == 'subscript_expression':
+        return f'{key(expr.child)}[{key(expr.value)}]'
+    if isinstance(expr, BinaryNode):
+        left, right = key(expr.left), key(expr.right)
+        if expr.text in ('+', '*', '&', '|', '^', '==', '!=') and right < left:
+            left, right = right, left
+        return f'({left} {expr.text} {right})'
+    return repr(expr)
+
+def loads(expr) -> bool:
+    ''' Whether expr reads memory '''
+    expr = unwrap(expr)
+    if expr.typ in ('pointer', 'subscript_expression'):
+        return True
+    return any(isinstance(getattr(expr, name, None), AstNode) and loads(getattr(expr, name)) for name in ('child', 'left', 'right'))
+
+def contains(node, target) -> bool:
+    ''' Whether target is node or one of the nodes below it '''
+    if node is target:
+        return True
+    if isinstance(node, list):
+        return any(contains(item, target) for item in node)
+    if not isinstance(node, AstNode):
+        return False
+    return any(contains(getattr(node, name, None), target) for name in node.FIELDS if name != 'typ')
+
+@dataclass(slots=True)
+class Value:
+    ''' An expression computed earlier, and the variable that holds it once something reuses it '''
+    node: AstNode
+    replace: Callable     # puts another node where node is
+    statements: list      # the block of the statement node is part of
+    reads: set[str]       # the variables it depends on
+    load: bool
+    assign: bool          # computed in a condition that does not always run, set where it is computed
+    name: Optional[str] = None
+
+class CommonSubexpressionEliminator:
+    '''
+    Value numbering over straight-line code: an expression computed again, with none of its
+    variables assigned in between, is taken from a variable set where it was first computed,
+    either the variable of the `let` or assignment whose value it is or a new one. Loads of list
+    elements and pointers are reused the same way until the next store through a subscript or a
+    pointer, or a call, which may write any memory. The blocks of an `if` and a `while` start
+    with what is known before them, minus what a loop changes, and labels start from nothing.
+    '''
+    def __init__(self):
+        self.reused = 0   # expressions taken from a variable
+        self.loaded = 0   # of those, loads from memory
+        self.count = 0    # new variables so far, for unique names
+
+    def program(self, program: dict):
+        statements = program['program']['statements']
+        self.changedByCalls = set()
+        for statement in DeadCodeEliminator.blocks(statements):
+            if statement.typ == 'func_declaration':
+                inner = ConstantFolder()
+                inner.collect(statement.body)
+                self.changedByCalls |= inner.assigned
+        self.block(statements, {})
+
+    def stats(self) -> str:
+        return f'common subexpressions: {self.reused} reused, {self.loaded} of them loads'
+
+    def block(self, statements: list, available: dict[str, Value]):
+        ''' Reuse values in statements, available are the ones computed before them '''
+        for statement in list(statements):
+            typ = statement.typ
+            if typ == 'func_declaration':
+                self.block(statement.body, {})
+            elif typ == 'let_statement':
+                if statement.args is None and statement.right is not None and pure(statement.right):
+                    value = self.rewrite(statement, 'right', available, statements)
+                    self.kill(available, {statement.left.text}, False)
+                    self.hold(statement.left.text, value, available)
+                else:
+                    self.kill(available, *self.effects(statement))
+            elif typ == 'expression':
+                expr = unwrap(statement)
+                if expr.typ == 'assignment_expression' and pure(expr.left) and pure(expr.right):
+                    name = targetName(expr.left)
+                    if name is None: # the address of a store, the element itself is written
+                        target = unwrap(expr.left)
+                        self.rewrite(target, 'value' if target.typ == 'subscript_expression' else 'child', available, statements)
+                    value = self.rewrite(expr, 'right', available, statements)
+                    self.kill(available, *self.effects(statement))
+                    if name is not None:
+                        self.hold(name, value, available)
+                elif pure(statement):
+                    self.rewrite(statement, 'child', available, statements)
+                else:
+                    self.kill(available, *self.effects(statement))
+            elif typ in ('print_statement', 'return_statement'):
+                field = 'child' if typ == 'print_statement' else 'value'
+                if getattr(statement, field) is not None and pure(getattr(statement, field)):
+                    self.rewrite(statement, field, available, statements)
+                else:
+                    self.kill(available, *self.effects(statement))
+            elif typ == 'if_statement':
+                if pure(statement.condition):
+                    self.rewrite(statement, 'condition', available, statements)
+                self.kill(available, *self.effects(statement.condition))
+                self.block(statement.body, dict(available))
+                known = dict(available) # and what the conditions of the alternatives before compute
+                for alternative in statement.alternative or []:
+                    if alternative.typ == 'elseif_statement':
+                        if pure(alternative.condition):
+                            self.rewrite(alternative, 'condition', known, statements, True)
+                        self.kill(known, *self.effects(alternative.condition))
+                    self.block(alternative.body, dict(known))
+                self.kill(available, *self.effects(statement))
+            elif typ == 'while_statement':
+                self.kill(available, *self.effects(statement))
+                known = dict(available) # the condition runs before every iteration, not after a break
+                if pure(statement.condition):
+                    self.rewrite(statement, 'condition', known, statements, True)
+                self.block(statement.body, known)
+            else:
+                available.clear()
+            if typ in ('label_statement', 'goto_statement') or typ in TERMINATORS or self.labels(statement):
+                available.clear() # the code after it is also reached from somewhere else, or not at all
+
+    @staticmethod
+    def labels(statement) -> bool:
+        ''' Whether a block inside statement has a label, which the code after it can be reached from '''
+        return any(inner.typ == 'label_statement' for field in ('body', 'alternative')
+                   for inner in DeadCodeEliminator.blocks(getattr(statement, field, None) or []))
+
+    def effects(self, node) -> tuple[set[str], bool]:
+        ''' The variables node may assign or define, and whether it may write memory '''
+        assigned, stores = set(), False
+        for inner in self.walk(node):
+            if inner.typ == 'assignment_expression':
+                name = targetName(inner.left)
+                if name is None:
+                    stores = True
+                else:
+                    assigned.add(name)
+            elif inner.typ == 'let_statement':
+                assigned.add(inner.left.text)
+            elif inner.typ == 'call_expression':
+                stores = True
+                if inner.text != 'syscall':
+                    assigned |= self.changedByCalls
+        return assigned, stores
+
+    @staticmethod
+    def walk(node):
+        ''' Every node in node, without going into the functions declared there '''
+        if isinstance(node, list):
+            for item in node:
+                yield from CommonSubexpressionEliminator.walk(item)
+        elif isinstance(node, AstNode) and node.typ != 'func_declaration':
+            yield node
+            for name in node.FIELDS:
+                if name != 'typ':
+                    yield from CommonSubexpressionEliminator.walk(getattr(node, name, None))
+
+    @staticmethod
+    def kill(available: dict[str, Value], assigned: set[str], stores: bool):
+        ''' Forget the values that depend on assigned variables, or on memory when it stores '''
+        for name, value in list(available.items()):
+            if value.reads & assigned or stores and value.load:
+                del available[name]
+
+    @staticmethod
+    def hold(name: str, value: Optional[Value], available: dict[str, Value]):
+        ''' The variable name was just set to value, it holds it while it is not assigned again '''
+        if value is not None and value.name is None and any(known is value for known in available.values()):
+            value.name = name
+            value.reads.add(name)
+
+    def rewrite(self, parent, field: str, available: dict[str, Value], statements: list, assign: bool = False) -> Optional[Value]:
+        '''
+        Replace the expressions below parent.field that are available by the variables holding
+        them, and make the ones computed there available. The statement of statements that
+        parent is part of computes them, before it unless `assign`. Returns the value
+        parent.field itself made available.
+        '''
+        node = getattr(parent, field)
+        expr = unwrap(node)
+        worth = (cost(expr) or 0) >= REUSE_COST
+        text = key(expr) if worth else None
+        if worth and text in available:
+            value = available[text]
+            self.reused += 1
+            self.loaded += value.load
+            setattr(parent, field, IdentNode(text=self.materialize(value)))
+            return None
+        # what it depends on, before the expressions inside are replaced by variables
+        reads, load = (names(expr, set()), loads(expr)) if worth else (None, False)
+        for name in ('child', 'left', 'right', 'value'):
+            if isinstance(getattr(expr, name, None), AstNode) and not (expr.typ == 'subscript_expression' and name == 'child'):
+                self.rewrite(expr, name, available, statements, assign)
+        if not worth:
+            return None
+        available[text] = Value(expr, lambda new: setattr(parent, field, new), statements, reads, load, assign)
+        return available[text]
+
+    def materialize(self, value: Value) -> str:
+        '''
+        The variable holding value, a new one set before the statement that computes it first,
+        or defined there and set where it is computed
+        '''
+        if value.name is None:
+            self.count += 1
+            value.name = f'__value_{self.count}__'
+            index = next(index for index, statement in enumerate(value.statements) if contains(statement, value.node))
+            if value.assign:
+                value.statements.insert(index, LetStatementNode(left=IdentNode(text=value.name), right=NumberNode(text='0')))
+                value.replace(AssignmentExpressionNode(left=IdentNode(text=value.name), right=value.node))
+            else:
+                value.statements.insert(index, LetStatementNode(left=IdentNode(text=value.name), right=value.node))
+                value.replace(IdentNode(text=value.name))
+            value.reads.add(value.name)
+        return value.name
@@ -1,30 +1,52 @@
 from ast import parse
+from array import array
+import os
 import sys
-from typing import Optional, Union
+from typing import ClassVar, Optional, Union
 from src.lex import *
+from src.cache import IncludeCache
 from dataclasses import dataclass
 from itertools import chain
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
 
 # TODO: add support for command line args
 # TODO: type system
 
 EOF = Token('\0', Symbols.EOF)
 
-def flatten(x):
-    if isinstance(x, Iterable):
-        return [a for i in x for a in flatten(i)]
-    else:
-        return [x]
+# Binding power and node type of every binary operator, loosest first
+BINARY_OPERATORS = {
+    Symbols.EQEQ: (1, 'comparison_op'), Symbols.NOTEQ: (1, 'comparison_op'),
+    Symbols.GT: (1, 'comparison_op'), Symbols.GTEQ: (1, 'comparison_op'),
+    Symbols.LT: (1, 'comparison_op'), Symbols.LTEQ: (1, 'comparison_op'),
+    Symbols.BOR: (2, 'bor_op'),
+    Symbols.BXOR: (3, 'xor_op'),
+    Symbols.BAND: (4, 'band_op'),
+    Symbols.GTGT: (5, 'shift_op'), Symbols.LTLT: (5, 'shift_op'),
+    Symbols.PLUS: (6, 'operator'), Symbols.MINUS: (6, 'operator'),
+    Symbols.ASTERISK: (7, 'operator'), Symbols.SLASH: (7, 'operator'), Symbols.MOD: (7, 'operator'),
+}
+
+# How many expansions of one macro may be open inside each other
+MACRO_DEPTH_LIMIT = 1000
 
 class Parser:
-    def __init__(self, tokens: list[Token]):
-        self.tokens = tokens
-        self.ip = 0  # instruction pointer
+    def __init__(self, tokens: TokenStore | Iterator[Token], cache: IncludeCache | None = None):
+        # A TokenStore is preprocessed as a whole before parsing, any other iterable of tokens
+        # is pulled from one token at a time while parsing (no `include` or `macro` then)
+        self.cache = cache
+        self.streaming = not isinstance(tokens, TokenStore)
+        if self.streaming:
+            self.store, self.tokens = None, None
+            self.stream = iter(tokens)
+        else:
+            self.store = tokens
+            self.tokens = array('i', range(len(tokens)))  # rows of the store, in program order
 
         self.symbols: set[str] = set()
         self.macros: dict[str, Macro] = dict()
-        self.includes: dict[str, int] = dict()
+        self.constants: dict[str, int] = dict()  # macros that are one literal, by its row
+        self.includes: set[str] = set()  # real paths of the files already expanded
         self.funcs: dict[str, StatementNode] = dict()
         self.labelsDeclared: set[str] = set()
         self.labelsGotoed: set[str] = set()
@@ -53,9 +75,7 @@ class Parser:
     # Advances the current token.
     def nextToken(self):
         self.curToken = self.peekToken
-        self.peekToken = self.tokens[self.ip] if self.ip != len(
-            self.tokens) else Token('\0', Symbols.EOF)
-        self.ip += 1
+        self.peekToken = next(self.stream, EOF)
 
     def abort(self, message):
         self.error(self.curToken, message)
@@ -67,141 +87,270 @@ class Parser:
         filename, line, col = token.pos
         eprint(f"{filename}:{line}:{col} Error: " + message)
 
-    def isComparisonOp(self):
-        return self.checkToken(Symbols.GT) or self.checkToken(Symbols.GTEQ) or self.checkToken(Symbols.LT) or self.checkToken(Symbols.LTEQ) or self.checkToken(Symbols.EQEQ) or self.checkToken(Symbols.NOTEQ)
-
-    def isShiftOp(self):
-        return self.checkToken(Symbols.GTGT) or self.checkToken(Symbols.LTLT)
-
     def dumpTokens(self):
         print('Dump tokens:')
-        for i, token in enumerate(self.tokens):
-            print(i, token)
+        for i, row in enumerate(self.tokens):
+            print(i, self.store.token(row))
 
-    def init(self):
-        self.ip = 0
+    def init(self, rows=None):
+        ''' Start reading tokens from the beginning of `rows`, self.tokens by default '''
+        if not self.streaming:
+            self.stream = map(self.store.token, self.tokens if rows is None else rows)
         self.curToken = EOF
         self.peekToken = EOF
         self.nextToken()
         self.nextToken()  # Call twice ot init curToken and peekToken
 
     def expandIncludes(self):
-        ip = 0
-        while ip < len(self.tokens) and self.tokens[ip].kind is not Symbols.EOF:
-            token = self.tokens[ip]
-            # print(f'current token = {token}')
-            if token.kind is Keywords.INCLUDE:
+        '''
+        Replace every `include "file"` by the rows of that file in a single pass that
+        appends to a new row array. The files being expanded form a stack of token
+        sources, so nested includes need no splicing. A file is expanded the first
+        time it is included and skipped after that (include once).
+        '''
+        store, out = self.store, array('i')
+        include, string = KIND_IDS[Keywords.INCLUDE], KIND_IDS[Symbols.STRING]
+        if self.tokens:
+            self.includes.add(os.path.realpath(store.names[store.files[self.tokens[0]]]))
+        sources = [(self.tokens, 0)]
+        while sources:
+            rows, ip = sources.pop()
+            start, count = ip, len(rows)
+            while ip < count:
+                if store.kinds[rows[ip]] != include:
+                    ip += 1
+                    continue
+                out.extend(rows[start:ip])
+                if ip + 1 == count or store.kinds[rows[ip + 1]] != string:
+                    token = store.token(rows[ip + 1] if ip + 1 < count else rows[ip])
+                    self.error(token, f'Expected a file name after `include`, found {repr(token.text)}')
+                    sys.exit(1)
+                filename = store.text(rows[ip + 1])
+                ip += 2
                 start = ip
-                next_tok = self.tokens[ip + 1]
-                filename = next_tok.text
-                # print(f'including {filename}')
-                if filename not in self.includes:
-                    self.includes[filename] = 1
-                else:
-                    self.includes[filename] += 1
-
-                assert self.includes[filename] < 100, "Include file expansion limit exceeded"
-                end = ip + 2
-                lexer = Lexer(filename)
-                tokens = lexer.lexfile()
-                self.tokens[start:end] = tokens[:-1] # exclude EOF
-                # print(ip, self.includes[filename])
+                path = os.path.realpath(filename)
+                if path in self.includes:
+                    continue
+                if not os.path.isfile(path):
+                    self.error(store.token(rows[ip - 1]), f'Cannot include {repr(filename)}, no such file')
+                    sys.exit(1)
+                self.includes.add(path)
+                included, macros, constants = self.loadInclude(filename)
+                for name in macros:
+                    self.constants.pop(name, None)
+                for name in constants:
+                    self.macros.pop(name, None)
+                self.macros.update(macros)
+                self.constants.update(constants)
+                # finish the included file before the rest of this one
+                sources.append((rows, ip))
+                rows, ip, start, count = included, 0, 0, len(included)
+            out.extend(rows[start:])
+        self.tokens = out
+
+    def loadInclude(self, filename):
+        '''
+        Lex an included file into the store and take its macro definitions out. Returns
+        the rows left to splice in (without EOF), its macros and its constants, from
+        self.cache if possible.
+        '''
+        store, lexer = self.store, Lexer(filename)
+        key = self.cache.key(lexer.source) if self.cache else None
+        entry = self.cache.load(key) if self.cache else None
+        if entry:
+            first = store.addRows(filename, lexer.source, entry['rows'])
+            rows = array('i', [first + row for row in entry['keep']])
+            macros = {name: Macro(name, args, first + start, first + end) for name, args, start, end in entry['macros']}
+            constants = {name: first + row for name, row in entry['constants']}
+            return rows, macros, constants
+
+        first = len(store)
+        lexer.lexfile(store)
+        macros, constants = dict(), dict()
+        rows = self.registerMacros(array('i', range(first, len(store))), macros, constants)
+        rows.pop() # exclude EOF
+        if self.cache:
+            # bodies of an included file are always a range of its rows
+            table = [(name, macro.args, macro.first - first, macro.last - first) for name, macro in macros.items()]
+            self.cache.save(key, store.rows(first, len(store)), array('i', [row - first for row in rows]), table,
+                            [(name, row - first) for name, row in constants.items()])
+        return rows, macros, constants
+
+    def registerMacros(self, rows, macros, constants):
+        '''
+        Take the macro definitions out of `rows` (which end with EOF). A definition only
+        records where its body is, the body rows are read the first time the macro is used.
+        A macro without arguments whose body is one number or string goes into `constants`
+        as the row of that literal, any other into `macros`. Returns the rows that are left,
+        EOF included.
+        '''
+        store, kinds = self.store, self.store.kinds
+        macro, ident, bang, end, eof = (KIND_IDS[kind] for kind in
+                                        [Keywords.MACRO, Symbols.IDENT, Symbols.BANG, Keywords.END, Symbols.EOF])
+        lparent, rparent, comma = (KIND_IDS[kind] for kind in [Symbols.LPARENT, Symbols.RPARENT, Symbols.COMMA])
+        literals = {KIND_IDS[Symbols.NUMBER], KIND_IDS[Symbols.STRING]}
+
+        def expect(ip, kind):
+            if kinds[rows[ip]] != KIND_IDS[kind]:
+                token = store.token(rows[ip])
+                self.error(token, f"Expected {kind.name}, got {repr(token.text)}")
+                sys.exit(1)
+
+        keep, ip = array('i'), 0
+        while True:
+            row = rows[ip]
+            if kinds[row] != macro:
+                keep.append(row)
+                if kinds[row] == eof:
+                    return keep
+                ip += 1
                 continue
             ip += 1
+            expect(ip, Symbols.IDENT)
+            name = store.text(rows[ip])
+            ip += 1
+            args = []
+            if kinds[rows[ip]] == lparent: # means this is a macro with args
+                ip += 1
+                while kinds[rows[ip]] != rparent:
+                    if args:
+                        expect(ip, Symbols.COMMA)
+                        ip += 1
+                    expect(ip, Symbols.IDENT)
+                    args.append(store.text(rows[ip]))
+                    ip += 1
+                ip += 1
+
+            start = ip
+            while kinds[rows[ip]] != end:
+                if kinds[rows[ip]] == bang: # `!end` is an `end` inside the body
+                    ip += 1
+                    expect(ip, Keywords.END)
+                if kinds[rows[ip]] == eof or kinds[rows[ip + 1]] == eof:
+                    self.error(store.token(rows[ip]), f'Macro definition unclosed, forgot an `end`?')
+                    sys.exit(1)
+                ip += 1
+            ip += 1 # the `end`
+
+            macros.pop(name, None)
+            constants.pop(name, None)
+            first, last = rows[start], rows[ip - 1]
+            if not args and ip - 1 - start == 1 and kinds[first] in literals:
+                constants[name] = first
+            elif last - first == ip - 1 - start:
+                macros[name] = Macro(name, args, first, last)
+            else: # the body has included rows in it, so it is not one range of the store
+                macros[name] = Macro(name, args, body=[row for row in rows[start:ip - 1] if kinds[row] != bang])
 
     def expandMacros(self):
-        # Register all macro definitions
-        keep = []
-        while not self.checkToken(Symbols.EOF):
-            if self.checkToken(Keywords.MACRO):
-                self.nextToken()
-                self.expect(Symbols.IDENT)
-                text = self.curToken.text
-                self.nextToken()
-                args, body = [], []
-                if self.checkToken(Symbols.LPARENT): # means this is a macro with args
-                    self.nextToken()
-                    consumed = False
-                    while not self.checkToken(Symbols.RPARENT):
-                        if not consumed:
-                            consumed = True
-                        else:
-                            self.match(Symbols.COMMA)
-                        self.expect(Symbols.IDENT)
-                        args.append(self.curToken.text)
-                        self.nextToken()
-                    self.nextToken()
-
-                while not self.checkToken(Keywords.END):
-                    body.append(self.curToken)
-                    if self.checkToken(Symbols.BANG):
-                        body.pop()
-                        self.nextToken()
-                        self.expect(Keywords.END)
-                        body.append(self.curToken)
-                    if self.peekToken.kind is Symbols.EOF:
-                        self.abort(f'Macro definition unclosed, forgot an `end`?')
-                    self.nextToken()
-                self.match(Keywords.END)
-                self.macros[text] = Macro(text, args, body, 0)
+        '''
+        Register the definitions left in the program itself (included files already did
+        theirs), then expand every macro use into a new row array in one pass. An expansion
+        is pushed on a work stack and read back from there, so macro uses it contains are
+        expanded too. The macro sits under its expansion on the stack and counts how many of
+        its expansions are open, which stops a macro that keeps expanding to itself.
+        '''
+        store, macros, constants = self.store, self.macros, self.constants
+        rows = self.registerMacros(self.tokens, macros, constants)
+        ident, eof = KIND_IDS[Symbols.IDENT], KIND_IDS[Symbols.EOF]
+        out, stack, ip = array('i'), [], 0
+
+        def take():
+            # next row to look at, from the innermost open expansion first
+            nonlocal ip
+            while stack:
+                item = stack.pop()
+                if type(item) is int:
+                    return item
+                item.depth -= 1  # all of this macro's expansion has been read
+            ip += 1
+            return rows[ip - 1]
+
+        while True:
+            row = take()
+            kind = store.kinds[row]
+            if kind == ident and (constants or macros):
+                text = store.text(row)
+                if text in constants:
+                    out.append(store.expand(constants[text], row))
+                    continue
+                macro = macros.get(text)
             else:
-                keep.append(self.curToken)
-                self.nextToken()
-        keep.append(self.curToken)
-        self.tokens = keep
-
-        # expansion
-        i = 0
-        while i < len(keep):
-            curr = keep[i]
-            if curr.text in self.macros:
-                macro = self.macros[curr.text]
-                # print(self.macros[curr.text])
-                if macro.args:
-                    start = i
-                    if self.tokens[i + 1].kind is not Symbols.LPARENT:
-                        self.error(self.tokens[i + 1], f'Macro {macro.name} expects arguments, found {self.tokens[i + 1]}')
-                        sys.exit(1)
-                    st = i + 2 # pos of first arg
-                    parsed_args = {}
-                    for t in range(len(macro.args)):
-                        series, delim = [], Symbols.COMMA if t != len(macro.args) - 1 else Symbols.RPARENT
-                        while self.tokens[st].kind is not delim:
-                            series.append(self.tokens[st])
-                            st += 1
-                        if t != len(macro.args) - 1: st += 1
-                        parsed_args[macro.args[t]] = series
-                    if self.tokens[st].kind is not Symbols.RPARENT:
-                        self.error(self.tokens[st], f'Expected right parenthese, found {self.tokens[st]}')
-                        sys.exit(1)
-                    end = st + 1
-                    expanded = [parsed_args[token.text] if token.text in parsed_args else token for token in macro.body]
-                    expanded = flatten(expanded)
-                    expanded = list(map(lambda token: Token(token.text, token.kind, curr.pos, token), expanded))
-                    keep[start:end] = expanded
-                    # for token in (keep):
-                    #     print(token)
-                    # raise NotImplementedError('Macro with args')
-                else:
-                    body = macro.body
-                    for j, token in enumerate(body):
-                        # new token instance with the pos updated
-                        token = Token(token.text, token.kind, curr.pos, token)
-                        body[j] = token
-                    keep[i:i + 1] = body
-                    macro.expandCount += 1
-                    assert self.macros[curr.text].expandCount < 1000, "Macros expansion exceeds 1000"
+                macro = None
+            if macro is None:
+                out.append(row)
+                if kind == eof:
+                    break
+                continue
+            if macro.depth >= MACRO_DEPTH_LIMIT:
+                self.error(store.token(row), f'Macro {macro.name} is nested more than {MACRO_DEPTH_LIMIT} times, does it expand to itself?')
+                sys.exit(1)
+            expansion = self.expandMacro(macro, row, take)
+            macro.depth += 1
+            stack.append(macro)
+            stack.extend(reversed(expansion))
+        self.tokens = out
+
+    def expandMacro(self, macro, site, take):
+        '''
+        New rows for one use of `macro` at row `site`, reported at the use site and pointing
+        back at the body or argument row they copy. `take` returns the rows after the use.
+        '''
+        store, args = self.store, dict()
+        if macro.args:
+            row = take()
+            if store.kind(row) is not Symbols.LPARENT:
+                token = store.token(row)
+                self.error(token, f'Macro {macro.name} expects arguments, found {token}')
+                sys.exit(1)
+            values, series, depth = [], [], 0
+            while True:
+                row = take()
+                kind = store.kind(row)
+                if kind is Symbols.EOF:
+                    self.error(store.token(site), f'Arguments of macro {macro.name} are never closed')
+                    sys.exit(1)
+                elif kind is Symbols.LPARENT:
+                    depth += 1
+                elif kind is Symbols.RPARENT:
+                    if depth == 0:
+                        values.append(series)
+                        break
+                    depth -= 1
+                elif kind is Symbols.COMMA and depth == 0:
+                    values.append(series)
+                    series = []
+                    continue
+                series.append(row)
+            if len(values) != len(macro.args):
+                self.error(store.token(row), f'Macro {macro.name} expects {len(macro.args)} arguments, found {len(values)}')
+                sys.exit(1)
+            args = dict(zip(macro.args, values))
+
+        if macro.body is None:
+            bang = KIND_IDS[Symbols.BANG]
+            macro.body = [row for row in range(macro.first, macro.last) if store.kinds[row] != bang]
+        ident, expand, expansion = KIND_IDS[Symbols.IDENT], store.expand, []
+        for row in macro.body:
+            value = args.get(store.text(row)) if args and store.kinds[row] == ident else None
+            if value is None:
+                expansion.append(expand(row, site))
             else:
-                i += 1
+                expansion.extend(expand(arg, site) for arg in value)
+        return expansion
+
+    def prepare(self):
+        ''' Run the preprocessing stages and leave curToken at the first token to parse '''
+        if not self.streaming:
+            self.expandIncludes()
+            self.expandMacros()
+        self.init()
+        # self.dumpTokens()
 
     # program ::= statements
     def program(self):
 
-        self.expandIncludes()
-        self.init()
-        self.expandMacros()
-        self.init()
-        # self.dumpTokens()
+        self.prepare()
         # Strip newlines at start
         while self.checkToken(Symbols.NEWLINE):
             self.nextToken()
@@ -228,16 +377,15 @@ class Parser:
         # Check first token to see which statement
 
         ret = None
-        assert len(Symbols) + len(Keywords) == 46, "Exhaustive handling of operation, notice that not all symbols need to be handled, only those who need a statement"
+        assert len(Symbols) + len(Keywords) == 48, "Exhaustive handling of operation, notice that not all symbols need to be handled, only those who need a statement"
         # PRINT expression
         if self.checkToken(Keywords.PRINT):
             self.nextToken()
-            ret = StatementNode('print_statement', child=self.expression())
+            ret = PrintStatementNode(child=self.expression())
         # IF expression THEN {statement} END
         elif self.checkToken(Keywords.IF):
             self.nextToken()
-            ret = StatementNode(
-                'if_statement', condition=self.expression(), body=list())
+            ret = IfStatementNode(condition=self.expression(), body=list())
             upper, last = ret, ret.body
 
             self.match(Keywords.THEN)
@@ -251,8 +399,7 @@ class Parser:
 
                     if upper.alternative == None:
                         upper.alternative = list()
-                    d = StatementNode('elseif_statement',
-                                      condition=self.comparison(), body=list())
+                    d = ElseifStatementNode(condition=self.comparison(), body=list())
                     upper.alternative.append(d)
                     last = d.body
 
@@ -263,7 +410,7 @@ class Parser:
                 elif self.checkToken(Keywords.ELSE):
                     if upper.alternative == None:
                         upper.alternative = list()
-                    d = StatementNode('else_statement', body=list())
+                    d = ElseStatementNode(body=list())
                     upper.alternative.append(d)
                     last = d.body
                     self.nextToken()
@@ -275,8 +422,7 @@ class Parser:
         # WHILE comparison DO nl {statement nl} end nl
         elif self.checkToken(Keywords.WHILE):
             self.nextToken()
-            ret = StatementNode('while_statement',
-                                condition=self.comparison(), body=list())
+            ret = WhileStatementNode(condition=self.comparison(), body=list())
 
             self.match(Keywords.DO)
             self.nl()
@@ -289,8 +435,7 @@ class Parser:
         elif self.checkToken(Keywords.GOTO):
             self.nextToken()
             self.labelsGotoed.add(self.curToken.text)
-            ret = StatementNode(
-                'goto_statement', destination=self.curToken.text)
+            ret = GotoStatementNode(destination=self.curToken.text)
             self.match(Symbols.IDENT)
         # let_statement ::= 'let' ident '=' expression
         #               |   'let' ident '[' expression ']' '=' list_expression
@@ -301,8 +446,7 @@ class Parser:
             if self.curToken.text not in self.symbols:
                 self.symbols.add(self.curToken.text)
 
-            ret = StatementNode('let_statement', left=ExpressionNode(
-                'ident', text=self.curToken.text))
+            ret = LetStatementNode(left=IdentNode(text=self.curToken.text))
             self.match(Symbols.IDENT)
             if self.checkToken(Symbols.LBRACKET):
                 self.nextToken()
@@ -319,16 +463,18 @@ class Parser:
                     self.abort(f"Label already exists: {self.curToken.text}")
                 self.labelsDeclared.add(self.curToken.text)
 
-                ret = StatementNode('label_statement', text=self.curToken.text)
+                ret = LabelStatementNode(text=self.curToken.text)
                 self.nextToken()
                 self.match(Symbols.COLON)
             else:
                 ret = self.expression()
-        # 'func' ident '(' args ')' statements 'end'
-        elif self.checkToken(Keywords.FUNC):
-            self.nextToken()
-            ret = StatementNode('func_declaration',
-                                text=self.curToken.text, args=[], body=[])
+        # ['inline' | 'noinline'] 'func' ident '(' args ')' statements 'end'
+        elif self.checkToken(Keywords.FUNC) or self.checkToken(Keywords.INLINE) or self.checkToken(Keywords.NOINLINE):
+            inline = None if self.checkToken(Keywords.FUNC) else self.checkToken(Keywords.INLINE)
+            if inline is not None:
+                self.nextToken()
+            self.match(Keywords.FUNC)
+            ret = FuncDeclarationNode(text=self.curToken.text, args=[], body=[], inline=inline)
             func_name = self.curToken.text
             self.match(Symbols.IDENT)
             self.match(Symbols.LPARENT)
@@ -338,8 +484,7 @@ class Parser:
                     consumed = True
                 else:
                     self.match(Symbols.COMMA)
-                ret.args.append(ExpressionNode(
-                    'ident', text=self.curToken.text))
+                ret.args.append(IdentNode(text=self.curToken.text))
                 stack.append(self.curToken.text)
                 self.match(Symbols.IDENT)
             self.match(Symbols.RPARENT)
@@ -354,17 +499,17 @@ class Parser:
         elif self.checkToken(Keywords.RETURN):
             if self.peekToken.kind is Symbols.NEWLINE:
                 self.nextToken()
-                ret = StatementNode('return_statement',
-                                    value=ExpressionNode('number', text='0'))
+                ret = ReturnStatementNode(value=NumberNode(text='0'))
             else:
                 self.nextToken()
-                ret = StatementNode('return_statement',
-                                    value=self.expression())
-        # 'include' string
+                ret = ReturnStatementNode(value=self.expression())
+        # 'include' string, only left in the stream when preprocessing is skipped
         elif self.checkToken(Keywords.INCLUDE):
-            raise Exception("include block is not reachable")
+            self.abort("`include` is not supported when streaming tokens")
+        elif self.checkToken(Keywords.MACRO):
+            self.abort("`macro` is not supported when streaming tokens")
         elif self.checkToken(Keywords.BREAK):
-            ret = StatementNode('break_statement')
+            ret = BreakStatementNode()
             self.nextToken()
         else:
             ret = self.expression()
@@ -377,7 +522,7 @@ class Parser:
     # expression ::= comparison
     def expression(self):
         # 0 or 1 parenthese
-        return ExpressionNode('expression', child=self.assignment_expression())
+        return PlainExpressionNode(child=self.assignment_expression())
 
     # assignment_expression ::= comparison '=' expression
     #                       |   comparison
@@ -385,93 +530,34 @@ class Parser:
         ret = self.comparison()
         if self.checkToken(Symbols.EQ):
             self.nextToken()
-            ret = ExpressionNode('assignment_expression',
-                                 left=ret, right=self.expression())
+            ret = AssignmentExpressionNode(left=ret, right=self.expression())
         return ret
 
-    # comparison ::= bor_expr (("==" | "!=" | ">" | ">=" | "<" | "<=") bor_expr)*
+    # comparison ::= unary (binary_op unary)*
+    # with the operators of BINARY_OPERATORS, each binding tighter than those before it
     def comparison(self):
-
-        ret = self.bor_expr()
-        while self.isComparisonOp():
-            ret = BinaryNode(
-                'comparison_op', self.curToken.text, left=ret, right=None)
-            self.nextToken()
-            ret.right = self.bor_expr()
-
-        return ret
-
-    # bor_expr  ::= xor_expr
-    #           |  bor_expr "|" xor_expr
-    def bor_expr(self):
-        ret = self.xor_expr()
-        while self.checkToken(Symbols.BOR):
-            ret = BinaryNode('bor_op', self.curToken.text,
-                             left=ret, right=None)
-            self.nextToken()
-            ret.right = self.xor_expr()
-        return ret
-
-    # xor_expr ::= and_expr
-    #           |  xor_expr "^" and_expr
-    def xor_expr(self):
-        ret = self.band_expr()
-        while self.checkToken(Symbols.BXOR):
-            ret = BinaryNode('xor_op', self.curToken.text,
-                             left=ret, right=None)
-            self.nextToken()
-            ret.right = self.band_expr()
-        return ret
-
-    # band_expr ::= shift_expr ("&" shift_expr)*
-    def band_expr(self):
-        ret = self.shift_expr()
-        while self.checkToken(Symbols.BAND):
-            ret = BinaryNode('band_op', self.curToken.text,
-                             left=ret, right=None)
-            self.nextToken()
-            ret.right = self.shift_expr()
-        return ret
-
-    # shift_expr ::= sum (("<<" | ">>") sum)*
-    def shift_expr(self):
-        ret = self.sum()
-        while self.isShiftOp():
-            ret = BinaryNode('shift_op', self.curToken.text,
-                             left=ret, right=None)
-            self.nextToken()
-            ret.right = self.sum()
-        return ret
-
-    # sum ::= term (op term)*
-    def sum(self):
-
-        ret = self.term()
-        # And then 0 or more +/- and term
-        while self.checkToken(Symbols.PLUS) or self.checkToken(Symbols.MINUS):
-            ret = BinaryNode('operator', self.curToken.text,
-                             left=ret, right=None)
-            self.nextToken()
-            ret.right = self.term()
-
-        return ret
-
-    # term ::= unary {( "/" | "*" | "%" ) unary}
-    def term(self):
-
+        return self.binary(1)
+
+    def binary(self, power):
+        '''
+        Precedence climbing: parse an operand, then every operator binding at least as tight
+        as `power` along with its right side, which only takes operators binding tighter.
+        This makes all binary operators left associative.
+        '''
         ret = self.unary()
-        while self.checkToken(Symbols.SLASH) or self.checkToken(Symbols.ASTERISK) or self.checkToken(Symbols.MOD):
-            ret = BinaryNode('operator', self.curToken.text,
-                             left=ret, right=None)
+        while True:
+            operator = BINARY_OPERATORS.get(self.curToken.kind)
+            if operator is None or operator[0] < power:
+                return ret
+            text = self.curToken.text
             self.nextToken()
-            ret.right = self.unary()
-        return ret
+            ret = BinaryNode(operator[1], text, left=ret, right=self.binary(operator[0] + 1))
 
     # unary ::= ["+" | "-"] primary
     def unary(self):
 
         if self.checkToken(Symbols.PLUS) or self.checkToken(Symbols.MINUS):
-            ret = ExpressionNode('unary_operator', text=self.curToken.text)
+            ret = UnaryOperatorNode(text=self.curToken.text)
             self.nextToken()
             ret.child = self.postfix_expression()
             return ret
@@ -492,12 +578,11 @@ class Parser:
         ret = self.pointer()
         if self.checkToken(Symbols.LBRACKET):
             self.nextToken()
-            ret = ExpressionNode('subscript_expression',
-                                 child=ret, value=self.expression())
+            ret = SubscriptExpressionNode(child=ret, value=self.expression())
             self.match(Symbols.RBRACKET)
         elif self.checkToken(Symbols.LPARENT):
             self.nextToken()
-            ret = ExpressionNode('call_expression', text=ret.text, args=[])
+            ret = CallExpressionNode(text=ret.text, args=[])
             args_list, consumed = ret.args, False
             while not self.checkToken(Symbols.RPARENT):
                 if not consumed:
@@ -519,7 +604,7 @@ class Parser:
     def pointer(self):
         if self.checkToken(Symbols.ASTERISK):
             self.nextToken()
-            ret = ExpressionNode('pointer', child=self.value())
+            ret = PointerNode(child=self.value())
         else:
             ret = self.value()
         return ret
@@ -532,25 +617,26 @@ class Parser:
             ret = self.expression()
             self.match(Symbols.RPARENT)
         elif self.checkToken(Symbols.NUMBER):
-            ret = ExpressionNode('number', text=self.curToken.text)
+            ret = NumberNode(text=self.curToken.text)
             self.nextToken()
         elif self.checkToken(Symbols.STRING):
-            ret = ExpressionNode('string', text=self.curToken.text)
+            ret = StringNode(text=self.curToken.text)
             self.nextToken()
         elif self.checkToken(Symbols.IDENT):
             # Ensure var exists
             if self.curToken.text in self.symbols or \
                     self.curToken.text in self.funcSymStack[-1] or \
                     self.curToken.text in self.funcs or \
-                    self.curToken.text in self.macros:
-                ret = ExpressionNode('ident', text=self.curToken.text)
+                    self.curToken.text in self.macros or \
+                    self.curToken.text in self.constants:
+                ret = IdentNode(text=self.curToken.text)
                 self.nextToken()
             else:
                 self.abort(f"Undefined word: {
                            self.curToken.text}")
         elif isinstance(self.curToken.kind, Builtins):
             # TODO: this doesn't make sense?
-            ret = ExpressionNode('ident', text=self.curToken.text)
+            ret = IdentNode(text=self.curToken.text)
             self.nextToken()
         else:
             ret = self.list_expression()
@@ -560,7 +646,7 @@ class Parser:
     # list ::= '[' [expression (',' expression)*] ']'
     def list_expression(self):
         if self.checkToken(Symbols.LBRACKET):
-            ret = ExpressionNode('list_expression', items=[])
+            ret = ListExpressionNode(items=[])
             self.nextToken()
             consumed = False
             while not self.checkToken(Symbols.RBRACKET):
@@ -583,46 +669,196 @@ class Parser:
             self.nextToken()
 
 
-@dataclass
-class ExpressionNode:
-    typ: str
-    text: Optional[str] = None
-    items: Optional[list] = None
-    args: Optional[list] = None
-    child: Optional[Union['ExpressionNode', 'BinaryNode']] = None
-    value: Optional[Union['ExpressionNode', 'BinaryNode']] = None
-    left: Optional['ExpressionNode'] = None
-    right: Optional['ExpressionNode'] = None
+class AstNode:
+    '''
+    Base of the nodes. Every kind of node is its own slotted dataclass holding only the
+    fields that kind uses, with the kind name as the class attribute `typ` (BinaryNode
+    keeps it as a field, it is the same class for all binary operators).
+    '''
+    __slots__ = ()
+    FIELDS: tuple[str, ...] = ()
 
+    def asdict(self) -> dict:
+        ''' The node as a dict with the fields of every node of its base, unused ones None, for parse.json '''
+        return {field: getattr(self, field, None) for field in self.FIELDS}
 
-@dataclass
-class StatementNode:
-    typ: str
-    text: Optional[str] = None
-    args: Optional[list] = None
-    child: Optional[Union['ExpressionNode', 'BinaryNode']] = None
-    # for if, else, while, func statement
-    condition: Optional[ExpressionNode] = None
-    body: Optional[list] = None
-    alternative: Optional[list] = None
-    destination: Optional[str] = None
-    # let statement
-    left: Optional[ExpressionNode] = None
-    right: Optional[ExpressionNode] = None
-    # return statement
-    value: Optional[ExpressionNode] = None
 
+class ExpressionNode(AstNode):
+    __slots__ = ()
+    FIELDS = ('typ', 'text', 'items', 'args', 'child', 'value', 'left', 'right')
 
-@dataclass
-class BinaryNode:
+
+class StatementNode(AstNode):
+    __slots__ = ()
+    FIELDS = ('typ', 'text', 'args', 'child', 'condition', 'body', 'alternative', 'destination', 'left', 'right', 'value', 'inline')
+
+
+@dataclass(slots=True)
+class BinaryNode(AstNode):
+    FIELDS = ('typ', 'text', 'left', 'right')
     typ: str
     text: str
     left: ExpressionNode
     right: ExpressionNode
 
+
+Expression = Union[ExpressionNode, BinaryNode]
+
+
+# what Parser.expression() returns, around the tree of the expression
+@dataclass(slots=True)
+class PlainExpressionNode(ExpressionNode):
+    typ: ClassVar[str] = 'expression'
+    child: Expression
+
+
+@dataclass(slots=True)
+class NumberNode(ExpressionNode):
+    typ: ClassVar[str] = 'number'
+    text: str
+
+
+@dataclass(slots=True)
+class StringNode(ExpressionNode):
+    typ: ClassVar[str] = 'string'
+    text: str
+
+
+@dataclass(slots=True)
+class IdentNode(ExpressionNode):
+    typ: ClassVar[str] = 'ident'
+    text: str
+
+
+@dataclass(slots=True)
+class UnaryOperatorNode(ExpressionNode):
+    typ: ClassVar[str] = 'unary_operator'
+    text: Optional[str] = None
+    child: Optional[Expression] = None
+
+
+# `*child`
+@dataclass(slots=True)
+class PointerNode(ExpressionNode):
+    typ: ClassVar[str] = 'pointer'
+    child: Optional[Expression] = None
+
+
+# `child[value]`
+@dataclass(slots=True)
+class SubscriptExpressionNode(ExpressionNode):
+    typ: ClassVar[str] = 'subscript_expression'
+    child: Expression
+    value: Expression
+
+
+@dataclass(slots=True)
+class CallExpressionNode(ExpressionNode):
+    typ: ClassVar[str] = 'call_expression'
+    text: str
+    args: list[Expression]
+
+
+@dataclass(slots=True)
+class ListExpressionNode(ExpressionNode):
+    typ: ClassVar[str] = 'list_expression'
+    items: list
+
+
+@dataclass(slots=True)
+class AssignmentExpressionNode(ExpressionNode):
+    typ: ClassVar[str] = 'assignment_expression'
+    left: Expression
+    right: Expression
+
+
+# a binary operator in the postfix form of Emitter.getExprValue()
+@dataclass(slots=True)
+class OperatorNode(ExpressionNode):
+    typ: ClassVar[str] = 'operator'
+    text: str
+
+
+@dataclass(slots=True)
+class PrintStatementNode(StatementNode):
+    typ: ClassVar[str] = 'print_statement'
+    child: Expression
+
+
+@dataclass(slots=True)
+class IfStatementNode(StatementNode):
+    typ: ClassVar[str] = 'if_statement'
+    condition: Expression
+    body: list
+    alternative: Optional[list] = None  # elseif_statement and else_statement
+
+
+@dataclass(slots=True)
+class ElseifStatementNode(StatementNode):
+    typ: ClassVar[str] = 'elseif_statement'
+    condition: Expression
+    body: list
+
+
+@dataclass(slots=True)
+class ElseStatementNode(StatementNode):
+    typ: ClassVar[str] = 'else_statement'
+    body: list
+
+
+@dataclass(slots=True)
+class WhileStatementNode(StatementNode):
+    typ: ClassVar[str] = 'while_statement'
+    condition: Expression
+    body: list
+
+
+@dataclass(slots=True)
+class GotoStatementNode(StatementNode):
+    typ: ClassVar[str] = 'goto_statement'
+    destination: str
+
+
+@dataclass(slots=True)
+class LabelStatementNode(StatementNode):
+    typ: ClassVar[str] = 'label_statement'
+    text: str
+
+
+# `let left = right`, or `let left[args[0]] = right`
+@dataclass(slots=True)
+class LetStatementNode(StatementNode):
+    typ: ClassVar[str] = 'let_statement'
+    left: IdentNode
+    right: Optional[Expression] = None
+    args: Optional[list] = None
+
+
+@dataclass(slots=True)
+class FuncDeclarationNode(StatementNode):
+    typ: ClassVar[str] = 'func_declaration'
+    text: str
+    args: list[IdentNode]
+    body: list
+    inline: Optional[bool] = None  # `inline func` True, `noinline func` False, up to the inliner otherwise
+
+
+@dataclass(slots=True)
+class ReturnStatementNode(StatementNode):
+    typ: ClassVar[str] = 'return_statement'
+    value: Expression
+
+
+@dataclass(slots=True)
+class BreakStatementNode(StatementNode):
+    typ: ClassVar[str] = 'break_statement'
+
+
 @dataclass
 class Macro:
     name: str
     args: list[str]
-    body: list[Token]
-    expandCount: int
+    first: int = -1  # TokenStore rows of the definition body, `last` excluded
+    last: int = -1
+    body: Optional[list[int]] = None  # the rows to expand, read from first..last on the first use
+    depth: int = 0   # expansions currently open, see Parser.expandMacros
@@ -0,0 +1,381 @@
+# Peephole optimizer: rewrites short sequences of the emitted instructions into cheaper ones.
+# The assembly is parsed into a list of Instructions (labels and comments stay as text), every
+# rule is tried at every instruction until none of them applies any more.
+# Rules rely on how the emitter uses registers: the caller-saved ones (SCRATCH) only carry values
+# within one statement, so they are dead at every jump and local label. Only rax may still be
+# needed at the end of a function, as its return value.
+from src.x86 import REGISTERS, parseNumber, splitOperands, stripComment
+from dataclasses import dataclass
+from typing import Optional
+import re
+
+SCRATCH = {REGISTERS[name][0] for name in ('rax', 'rcx', 'rdx', 'rsi', 'rdi', 'r8', 'r9', 'r10', 'r11')}
+RAX = REGISTERS['rax'][0]
+ARGUMENTS = {REGISTERS[name][0] for name in ('rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9')}
+SYSCALL_ARGUMENTS = {REGISTERS[name][0] for name in ('rax', 'rdi', 'rsi', 'rdx', 'r10', 'r8', 'r9')}
+SYSCALL_CLOBBERS = {REGISTERS[name][0] for name in ('rax', 'rcx', 'r11')}
+
+ARITHMETIC = {'add', 'sub', 'and', 'or', 'xor', 'adc', 'sbb'}
+SHIFTS = {'shl', 'shr', 'sal', 'sar', 'rol', 'ror'}
+# operand kinds an instruction may be rewritten to: r register, m memory, i immediate that fits
+# in 32 bits, I any other immediate (a larger number or the address of a symbol)
+FORMS = {'mov': {'rr', 'rm', 'mr', 'ri', 'rI', 'mi'}, 'test': {'rr', 'mr', 'ri', 'mi'},
+         'imul': {'rr', 'rm', 'rri', 'rmi'}, 'push': {'r', 'm', 'i'}, 'idiv': {'r', 'm'},
+         'neg': {'r', 'm'}, 'lea': {'rm'}, 'cmp': {'rr', 'rm', 'mr', 'ri', 'mi'}}
+FORMS.update({mnemonic: FORMS['cmp'] for mnemonic in ARITHMETIC})
+
+
+@dataclass(slots=True)
+class Instruction:
+    mnemonic: str
+    operands: list[str]
+
+    def text(self) -> str:
+        return f'\t{self.mnemonic} {", ".join(self.operands)}\n' if self.operands else f'\t{self.mnemonic}\n'
+
+
+def register(operand: str) -> Optional[tuple[int, int]]:
+    ''' (number, size in bytes) of a register operand, None for anything else '''
+    return REGISTERS.get(operand.lower())
+
+def addressRegisters(operand: str) -> set[int]:
+    ''' Numbers of the registers a memory operand computes its address with '''
+    if '[' not in operand:
+        return set()
+    return {REGISTERS[word.lower()][0] for word in re.findall(r'\w+', operand[operand.index('['):]) if word.lower() in REGISTERS}
+
+def kind(operand: str) -> str:
+    if '[' in operand:
+        return 'm'
+    reg = register(operand)
+    if reg is not None:
+        return 'r' if reg[1] == 8 else 'b'  # b: a smaller register, never rewritten
+    value = parseNumber(operand)
+    return 'i' if value is not None and -2**31 <= value < 2**31 else 'I'
+
+def sized(operand: str) -> str:
+    ''' A memory operand with its size, for instructions without a register operand to tell it '''
+    if kind(operand) == 'm' and not operand.upper().startswith(('QWORD', 'DWORD', 'WORD', 'BYTE')):
+        return f'QWORD {operand}'
+    return operand
+
+def valid(instruction: Instruction) -> bool:
+    ''' Whether the instruction exists with these kinds of operands '''
+    return ''.join(kind(operand) for operand in instruction.operands) in FORMS.get(instruction.mnemonic, ())
+
+def effects(instruction: Instruction) -> Optional[tuple[set[int], set[int]]]:
+    '''
+    Registers the instruction reads and the ones it overwrites completely (without reading them),
+    None when it is not known
+    '''
+    mnemonic, operands = instruction.mnemonic, instruction.operands
+    reads, writes = set(), set()
+    for operand in operands:
+        reads |= addressRegisters(operand)
+    registers = [register(operand) for operand in operands]
+    def read(*positions):
+        for position in positions:
+            if registers[position]:
+                reads.add(registers[position][0])
+    if mnemonic in ('mov', 'lea', 'movzx', 'movsx', 'movsxd', 'pop') or mnemonic == 'imul' and len(operands) == 3:
+        read(*range(1, len(operands)))
+        if registers[0] and (registers[0][1] >= 4 or mnemonic != 'mov'):
+            writes.add(registers[0][0])
+        elif registers[0]:
+            reads.add(registers[0][0])  # writing a byte or word keeps the rest
+    elif mnemonic in ARITHMETIC or mnemonic in SHIFTS or mnemonic in ('cmp', 'test', 'imul', 'xchg', 'push', 'neg', 'not', 'inc', 'dec') \
+            or mnemonic.startswith('set') or mnemonic.startswith('cmov'):
+        if mnemonic == 'imul' and len(operands) == 1:
+            reads.add(RAX)
+            writes.add(REGISTERS['rdx'][0])
+        read(*range(len(operands)))
+    elif mnemonic in ('idiv', 'div'):
+        read(0)
+        reads |= {RAX, REGISTERS['rdx'][0]}
+    elif mnemonic == 'cqo':
+        reads.add(RAX)
+        writes.add(REGISTERS['rdx'][0])
+    elif mnemonic in ('leave', 'nop'):
+        pass
+    else:
+        return None
+    return reads, writes
+
+
+class Peephole:
+    '''
+    Runs rewrite rules over the instructions to a fixed point. `rules` picks the rules by name
+    (all of RULES by default) and `hits` counts how often each one applied.
+    '''
+    RULES = ['push-pop', 'self-move', 'store-load', 'forward', 'read-modify-write', 'retarget', 'dead-move', 'jump-next']
+
+    def __init__(self, rules: Optional[list[str]] = None):
+        self.rules = list(self.RULES if rules is None else rules)
+        for rule in self.rules:
+            assert rule in self.RULES, f'Unknown peephole rule {rule}'
+        self.hits = {rule: 0 for rule in self.rules}
+        self.code: list = []
+        self.returns = False
+
+    def stats(self) -> str:
+        return 'peephole: ' + ', '.join(f'{rule} {hits}' for rule, hits in self.hits.items())
+
+    def optimize(self, lines: list[str], returns=False) -> list[str]:
+        '''
+        Optimize the lines of one section of code. With `returns`, the code belongs to functions,
+        which return their value in rax.
+        '''
+        self.code, self.returns = [self.parse(line) for line in lines], returns
+        methods = [getattr(self, rule.replace('-', '_')) for rule in self.rules]
+        changed = True
+        while changed:
+            changed = False
+            for rule, method in zip(self.rules, methods):
+                i = 0
+                while i < len(self.code):
+                    if isinstance(self.code[i], Instruction) and method(i):
+                        self.hits[rule] += 1
+                        changed = True
+                    else:
+                        i += 1
+        return [item.text() if isinstance(item, Instruction) else item for item in self.code]
+
+    @staticmethod
+    def parse(line: str):
+        text = stripComment(line).strip()
+        if not text or text.endswith(':'):
+            return line
+        mnemonic, _, rest = text.partition(' ')
+        if mnemonic in ('section', 'global', 'extern'):
+            return line
+        return Instruction(mnemonic, splitOperands(rest))
+
+    def next(self, i: int) -> Optional[int]:
+        ''' Index of the instruction after i, skipping comments, None at a label '''
+        for j in range(i + 1, len(self.code)):
+            item = self.code[j]
+            if isinstance(item, Instruction):
+                return j
+            if not item.strip().startswith(';') and item.strip():
+                return None
+        return None
+
+    def deadAtJump(self, number: int) -> bool:
+        return number in SCRATCH and not (self.returns and number == RAX)
+
+    def dead(self, number: int, i: int) -> bool:
+        ''' Whether the value of register `number` after instruction i is never read '''
+        for item in self.code[i + 1:]:
+            if not isinstance(item, Instruction):
+                text = item.strip()
+                if not text or text.startswith(';'):
+                    continue
+                # a local label is the start of a statement, anything else ends what we know
+                return text.startswith('.') and text.endswith(':') and self.deadAtJump(number)
+            mnemonic = item.mnemonic
+            if mnemonic == 'jmp':
+                return self.deadAtJump(number)
+            if mnemonic.startswith('j'):
+                if not self.deadAtJump(number):
+                    return False
+                continue
+            if mnemonic == 'call':
+                return number in SCRATCH and number not in ARGUMENTS
+            if mnemonic == 'syscall':
+                if number in SYSCALL_ARGUMENTS:
+                    return False
+                if number in SYSCALL_CLOBBERS:
+                    return True
+                continue
+            if mnemonic == 'ret':
+                return number in SCRATCH and number != RAX
+            known = effects(item)
+            if known is None:
+                return False
+            reads, writes = known
+            if number in reads:
+                return False
+            if number in writes:
+                return True
+        return False
+
+    def push_pop(self, i: int) -> bool:
+        ''' push X; pop Y -> mov Y, X '''
+        push, j = self.code[i], self.next(i)
+        if push.mnemonic != 'push' or j is None or self.code[j].mnemonic != 'pop':
+            return False
+        move = Instruction('mov', [self.code[j].operands[0], push.operands[0]])
+        if not valid(move):
+            return False
+        self.code[j] = move
+        del self.code[i]
+        return True
+
+    def self_move(self, i: int) -> bool:
+        ''' mov X, X -> nothing '''
+        move = self.code[i]
+        if move.mnemonic != 'mov' or move.operands[0] != move.operands[1]:
+            return False
+        del self.code[i]
+        return True
+
+    def store_load(self, i: int) -> bool:
+        ''' mov M, R; mov R2, M -> mov M, R; mov R2, R '''
+        store, j = self.code[i], self.next(i)
+        if store.mnemonic != 'mov' or kind(store.operands[0]) != 'm' or kind(store.operands[1]) != 'r' or j is None:
+            return False
+        load = self.code[j]
+        if load.mnemonic != 'mov' or load.operands[1] != store.operands[0] or kind(load.operands[0]) != 'r':
+            return False
+        load.operands[1] = store.operands[1]
+        return True
+
+    def forward(self, i: int) -> bool:
+        '''
+        mov T, S; op ..T.. -> op ..S.. when T is a scratch register that is dead after op or
+        overwritten by it, and op exists with S in place of T
+        '''
+        move, j = self.code[i], self.next(i)
+        if move.mnemonic != 'mov' or kind(move.operands[0]) != 'r' or j is None:
+            return False
+        target, source = move.operands
+        number = register(target)[0]
+        if number not in SCRATCH or number in addressRegisters(source):
+            return False
+        user = self.code[j]
+        known = effects(user)
+        if known is None or number not in known[0]:
+            return False
+        # the destination of mov, lea and imul with three operands is only written
+        written = user.mnemonic in ('mov', 'lea') or user.mnemonic == 'imul' and len(user.operands) == 3
+        operands = []
+        for position, operand in enumerate(user.operands):
+            if position == 0 and written and operand.lower() == target:
+                pass
+            elif operand.lower() == target:
+                operand = sized(source)
+            elif number in addressRegisters(operand):
+                if kind(source) != 'r':
+                    return False
+                operand = re.sub(rf'\b{target}\b', source, operand)
+            elif register(operand) and register(operand)[0] == number:
+                return False  # a part of T, like cl
+            operands.append(operand)
+        rewritten = Instruction(user.mnemonic, operands)
+        # the operand T is replaced in must be read only, unless the instruction overwrites it
+        overwrites = number in known[1]
+        if user.mnemonic not in ('mov', 'lea', 'push', 'cmp', 'test', 'idiv') and user.mnemonic != 'imul' \
+                and user.mnemonic not in ARITHMETIC:
+            return False
+        if user.mnemonic in ARITHMETIC or user.mnemonic == 'imul' and len(operands) == 2:
+            if user.operands[0].lower() == target:
+                return False
+        if user.mnemonic == 'idiv' and number in (RAX, REGISTERS['rdx'][0]):
+            return False
+        if not valid(rewritten) or not overwrites and not self.dead(number, j):
+            return False
+        self.code[j] = rewritten
+        del self.code[i]
+        return True
+
+    def read_modify_write(self, i: int) -> bool:
+        ''' mov T, V; op T, S; mov V, T -> op V, S when T is dead afterwards '''
+        load, j = self.code[i], self.next(i)
+        if load.mnemonic != 'mov' or kind(load.operands[0]) != 'r' or j is None:
+            return False
+        target, variable = load.operands
+        number = register(target)[0]
+        k = self.next(j)
+        if number not in SCRATCH or k is None or kind(variable) not in 'rm':
+            return False
+        op, store = self.code[j], self.code[k]
+        if store.mnemonic != 'mov' or store.operands != [variable, target] or not op.operands or op.operands[0] != target:
+            return False
+        rest = op.operands[1:]
+        if any(number in addressRegisters(operand) or register(operand) and register(operand)[0] == number for operand in rest):
+            return False
+        if op.mnemonic in SHIFTS and len(rest) == 1 and (rest[0] == 'cl' or kind(rest[0]) == 'i'):
+            rewritten = Instruction(op.mnemonic, [variable] + rest)
+        elif op.mnemonic in ('neg', 'not', 'inc', 'dec') and not rest:
+            rewritten = Instruction(op.mnemonic, [variable])
+        elif op.mnemonic in ARITHMETIC or op.mnemonic == 'imul' and len(rest) == 1:
+            rewritten = Instruction(op.mnemonic, [variable] + rest)
+            if not valid(rewritten):
+                return False
+        else:
+            return False
+        if not self.dead(number, k):
+            return False
+        self.code[k] = rewritten
+        del self.code[j]
+        del self.code[i]
+        return True
+
+    def retarget(self, i: int) -> bool:
+        '''
+        mov T, X; op T, S; ...; mov D, T -> mov D, X; op D, S; ... when T is dead afterwards,
+        which computes the value right where it is stored
+        '''
+        load = self.code[i]
+        if load.mnemonic != 'mov' or kind(load.operands[0]) != 'r':
+            return False
+        target = load.operands[0]
+        number = register(target)[0]
+        if number not in SCRATCH:
+            return False
+        ops, j = [], self.next(i)
+        while j is not None:
+            user = self.code[j]
+            if user.mnemonic == 'mov' and user.operands[1] == target and kind(user.operands[0]) == 'r':
+                break
+            if not user.operands or user.operands[0] != target or not (user.mnemonic in ARITHMETIC or user.mnemonic in SHIFTS \
+                    or user.mnemonic in ('neg', 'not', 'inc', 'dec') or user.mnemonic == 'imul' and len(user.operands) == 2):
+                return False
+            ops.append(j)
+            j = self.next(j)
+        if j is None or not ops:
+            return False
+        destination = self.code[j].operands[0]
+        other = register(destination)[0]
+        for k in ops:
+            for operand in self.code[k].operands[1:]:
+                if number in addressRegisters(operand) | addressRegisters(destination) or other in addressRegisters(operand):
+                    return False
+                if register(operand) and register(operand)[0] in (number, other):
+                    return False
+        if other == REGISTERS['rcx'][0] and any(self.code[k].mnemonic in SHIFTS for k in ops):
+            return False  # the count is in cl
+        if other == number or not self.dead(number, j):
+            return False
+        load.operands[0] = destination
+        for k in ops:
+            self.code[k].operands[0] = destination
+        del self.code[j]
+        return True
+
+    def dead_move(self, i: int) -> bool:
+        ''' mov/lea/movzx T, X -> nothing when T is a scratch register that is never read again '''
+        move = self.code[i]
+        if move.mnemonic not in ('mov', 'lea', 'movzx') or kind(move.operands[0]) != 'r':
+            return False
+        number = register(move.operands[0])[0]
+        if number not in SCRATCH or not self.dead(number, i):
+            return False
+        del self.code[i]
+        return True
+
+    def jump_next(self, i: int) -> bool:
+        ''' jmp L where L is one of the labels right after it -> nothing '''
+        jump = self.code[i]
+        if jump.mnemonic != 'jmp':
+            return False
+        for item in self.code[i + 1:]:
+            if isinstance(item, Instruction):
+                return False
+            text = item.strip()
+            if text == f'{jump.operands[0]}:':
+                del self.code[i]
+                return True
+            if text and not text.startswith(';') and not (text.startswith('.') and text.endswith(':')):
+                return False
+        return False
@@ -0,0 +1,135 @@
+# Register allocation for scalar variables. A liveness analysis over the statements of one scope
+# (the top-level code or a function body) gives every variable a live interval, and a linear scan
+# hands out the callee-saved registers. Those survive `call`, a function saves the ones it uses.
+from src.parse import AstNode
+from dataclasses import dataclass
+
+CALLEE_SAVED = ['rbx', 'r12', 'r13', 'r14', 'r15']
+LOOP_WEIGHT = 8  # a use inside a loop counts as much as this many uses outside of it
+
+@dataclass(slots=True)
+class Interval:
+    name: str
+    start: int
+    end: int
+    weight: int = 0
+
+class Liveness:
+    '''
+    Numbers the variable occurrences of a scope in program order. A variable is live from its
+    first to its last occurrence, and over every whole loop it occurs in, because the next
+    iteration may read what this one wrote. A goto may jump back to any label, so with labels
+    the whole scope counts as one loop.
+    '''
+    def __init__(self):
+        self.position = 0
+        self.depth = 0
+        self.occurrences: dict[str, list[int]] = {}
+        self.weights: dict[str, int] = {}
+        self.loops: list[tuple[int, int]] = []
+        self.labels = False
+        self.defined: set[str] = set()
+        self.pinned: set[str] = set()  # variables that must stay in memory
+        self.nested: set[str] = set()  # names functions declared in this scope use but do not define
+
+    def visit(self, node):
+        if isinstance(node, list):
+            for item in node:
+                self.visit(item)
+            return
+        if not isinstance(node, AstNode):
+            return
+        typ = node.typ
+        if typ == 'ident':
+            self.occur(node.text)
+            return
+        if typ == 'func_declaration':
+            inner = Liveness()
+            inner.visit(node.body)
+            local = inner.defined | {arg.text for arg in node.args}
+            self.nested |= (inner.occurrences.keys() | inner.nested) - local
+            return
+        if typ == 'label_statement':
+            self.labels = True
+        elif typ == 'let_statement':
+            self.defined.add(node.left.text)
+            if node.args: # list, its elements are addressed relative to the variable
+                self.pinned.add(node.left.text)
+        elif typ == 'subscript_expression':
+            self.pinned.add(node.child.text)
+        elif typ == 'while_statement':
+            start = self.position
+            self.depth += 1
+            self.visit(node.condition)
+            self.visit(node.body)
+            self.depth -= 1
+            self.loops.append((start, self.position))
+            return
+        for field in node.FIELDS:
+            self.visit(getattr(node, field, None))
+
+    def occur(self, name: str):
+        if name == '__mem__':
+            return
+        self.occurrences.setdefault(name, []).append(self.position)
+        self.weights[name] = self.weights.get(name, 0) + LOOP_WEIGHT ** self.depth
+        self.position += 1
+
+    def intervals(self, candidates) -> list[Interval]:
+        intervals = []
+        for name in candidates:
+            positions = self.occurrences.get(name)
+            if not positions:
+                continue
+            start, end = positions[0], positions[-1]
+            loops = self.loops + [(0, self.position)] if self.labels else self.loops
+            for loopStart, loopEnd in loops:
+                if any(loopStart <= position < loopEnd for position in positions):
+                    start, end = min(start, loopStart), max(end, loopEnd)
+            intervals.append(Interval(name, start, end, self.weights[name]))
+        return intervals
+
+def linearScan(intervals: list[Interval], registers=CALLEE_SAVED) -> dict[str, str]:
+    '''
+    Assign registers to intervals in order of their start. When none is free, the interval
+    with the least weight among the live ones stays in memory for its whole life.
+    '''
+    assignment: dict[str, str] = {}
+    active: list[Interval] = []
+    free = list(registers)
+    for interval in sorted(intervals, key=lambda interval: interval.start):
+        for old in [old for old in active if old.end < interval.start]:
+            active.remove(old)
+            free.append(assignment[old.name])
+        if free:
+            free.sort(key=registers.index)
+            assignment[interval.name] = free.pop(0)
+            active.append(interval)
+            continue
+        victim = min(active, key=lambda old: old.weight)
+        if victim.weight < interval.weight:
+            assignment[interval.name] = assignment.pop(victim.name)
+            active.remove(victim)
+            active.append(interval)
+    return assignment
+
+def sharedVariables(statements: list) -> set[str]:
+    '''
+    Variables the top-level code defines that functions use too. They need static storage:
+    a function has its own frame and can not reach them relative to rbp.
+    '''
+    liveness = Liveness()
+    liveness.visit(statements)
+    return liveness.defined & liveness.nested
+
+def allocateRegisters(statements: list, params: list[str] = [], exclude=()) -> dict[str, str]:
+    '''
+    Registers for the scalar variables defined by `statements` or passed as `params`, not for
+    the names in `exclude`, which have their storage elsewhere
+    '''
+    liveness = Liveness()
+    for param in params:
+        liveness.occur(param)
+    liveness.visit(statements)
+    candidates = (liveness.defined | set(params)) - liveness.pinned - liveness.nested - set(exclude)
+    return linearScan(liveness.intervals(sorted(candidates)))
@@ -0,0 +1,109 @@
+# Strength reduction: multiplication, division and modulo by a constant as cheaper instruction
+# sequences than imul and idiv. Every function returns the instructions (without the leading tab)
+# that turn the value in `target` into the result, or None when the general instruction is
+# better. They compute exactly what imul and idiv do with 64 bit two's complement values: `/`
+# truncates toward zero and the remainder of `%` has the sign of the dividend.
+# rdx and r11 are used as scratch registers, like they are by idiv and spilling in the emitter.
+from typing import Optional
+
+SCRATCH = 'rdx'
+SPILL = 'r11'
+LEA_FACTORS = (9, 5, 3)  # x * factor is one lea [x+x*(factor-1)]
+
+def powerOfTwo(value: int) -> Optional[int]:
+    ''' k if value is 2**k, None otherwise '''
+    return value.bit_length() - 1 if value > 0 and value & (value - 1) == 0 else None
+
+def multiply(target: str, value: int) -> Optional[list[str]]:
+    ''' target * value as shifts, lea and neg '''
+    if not -2**63 <= value < 2**63:
+        return None
+    if value == 0:
+        return [f'mov {target}, 0']
+    if value == 1:
+        return []
+    if value == -1:
+        return [f'neg {target}']
+    magnitude = abs(value)
+    for factor in LEA_FACTORS + (1,):
+        shift = powerOfTwo(magnitude // factor) if magnitude % factor == 0 else None
+        if shift is None:
+            continue
+        code = [f'lea {target}, [{target}+{target}*{factor - 1}]'] if factor != 1 else []
+        if shift:
+            code.append(f'shl {target}, {shift}')
+        if value < 0:
+            code.append(f'neg {target}')
+        return code
+    return None
+
+def magic(divisor: int) -> tuple[int, int]:
+    '''
+    (multiplier, shift) such that n / divisor is the high half of n * multiplier shifted right
+    by `shift`, plus one when n is negative, for every signed 64 bit n (Hacker's Delight 10-1).
+    The multiplier is unsigned, it may not fit a signed 64 bit integer. divisor >= 2.
+    '''
+    two63 = 1 << 63
+    absolute = two63 - 1 - two63 % divisor  # largest n with n % divisor == divisor - 1
+    p = 63
+    q1, r1 = divmod(two63, absolute)
+    q2, r2 = divmod(two63, divisor)
+    while True:
+        p += 1
+        q1, r1 = 2 * q1, 2 * r1
+        if r1 >= absolute:
+            q1, r1 = q1 + 1, r1 - absolute
+        q2, r2 = 2 * q2, 2 * r2
+        if r2 >= divisor:
+            q2, r2 = q2 + 1, r2 - divisor
+        delta = divisor - r2
+        if q1 > delta or q1 == delta and r1 != 0:
+            break
+    return q2 + 1, p - 64
+
+def divide(operator: str, target: str, divisor: int, raxFree: bool) -> Optional[list[str]]:
+    '''
+    target / divisor or target % divisor. Divisors other than powers of two multiply by their
+    reciprocal, which needs rax: unless `raxFree`, it is saved on the stack around the code.
+    '''
+    if divisor in (0, -1) or not -2**63 < divisor < 2**63:
+        return None # idiv traps on these, or the divisor is not a 64 bit value
+    if divisor == 1:
+        return [f'mov {target}, 0'] if operator == '%' else []
+    magnitude = abs(divisor)
+    shift = powerOfTwo(magnitude)
+    if shift is not None:
+        if operator == '%' and shift > 31:
+            return None # the mask does not fit an immediate
+        # negative dividends are rounded toward zero by adding magnitude - 1 first
+        code = [f'mov {SCRATCH}, {target}', f'sar {SCRATCH}, 63'] if shift > 1 else [f'mov {SCRATCH}, {target}']
+        code += [f'shr {SCRATCH}, {64 - shift}', f'add {target}, {SCRATCH}']
+        if operator == '/':
+            code.append(f'sar {target}, {shift}')
+            if divisor < 0:
+                code.append(f'neg {target}')
+        else:
+            code += [f'and {target}, {magnitude - 1}', f'sub {target}, {SCRATCH}']
+        return code
+    multiplier, shift = magic(magnitude)
+    if multiplier >= 2**63:
+        multiplier -= 2**64 # as a signed immediate, imul multiplies by 2**64 less
+    code = [f'mov {SPILL}, {target}', f'mov rax, {multiplier}', f'imul {SPILL}']
+    if multiplier < 0:
+        code.append(f'add {SCRATCH}, {SPILL}')
+    if shift:
+        code.append(f'sar {SCRATCH}, {shift}')
+    code += [f'mov rax, {SPILL}', 'shr rax, 63', f'add {SCRATCH}, rax']  # quotient in rdx
+    if operator == '/':
+        if divisor < 0:
+            code.append(f'neg {SCRATCH}')
+        code.append(f'mov {target}, {SCRATCH}')
+    else:
+        if magnitude < 2**31:
+            code.append(f'imul {SCRATCH}, {SCRATCH}, {magnitude}')
+        else:
+            code += [f'mov rax, {magnitude}', f'imul {SCRATCH}, rax']
+        code += [f'sub {SPILL}, {SCRATCH}', f'mov {target}, {SPILL}']
+    if not raxFree and target != 'rax':
+        code = ['push rax'] + code + ['pop rax']
+    return code
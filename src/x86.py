@@ -0,0 +1,577 @@
+# Native backend: encodes the assembly the emitter produces into x86-64 machine code and
+# writes a static ELF64 executable, so a build needs neither nasm nor ld.
+# It understands the NASM syntax the emitter writes: sections .text/.data/.bss, `global`,
+# labels (local `.labels` belong to the last label without a dot), db/dw/dd/dq, resb/resw/
+# resd/resq, `equ $-label`, and the integer instructions listed in Assembler.encode().
+import os
+import re
+import struct
+from dataclasses import dataclass
+from typing import Optional, Union
+
+BASE_ADDRESS = 0x400000
+PAGE = 0x1000
+
+REGISTERS: dict[str, tuple[int, int]] = {}  # name -> (number, size in bytes)
+for number, names in enumerate([('rax', 'eax', 'ax', 'al'), ('rcx', 'ecx', 'cx', 'cl'), ('rdx', 'edx', 'dx', 'dl'),
+                                ('rbx', 'ebx', 'bx', 'bl'), ('rsp', 'esp', 'sp', 'spl'), ('rbp', 'ebp', 'bp', 'bpl'),
+                                ('rsi', 'esi', 'si', 'sil'), ('rdi', 'edi', 'di', 'dil')]):
+    for name, size in zip(names, (8, 4, 2, 1)):
+        REGISTERS[name] = (number, size)
+for number in range(8, 16):
+    for suffix, size in [('', 8), ('d', 4), ('w', 2), ('b', 1)]:
+        REGISTERS[f'r{number}{suffix}'] = (number, size)
+
+SIZES = {'QWORD': 8, 'DWORD': 4, 'WORD': 2, 'BYTE': 1}
+SCALES = {1: 0, 2: 1, 4: 2, 8: 3}
+CONDITIONS = {'o': 0, 'no': 1, 'b': 2, 'c': 2, 'nae': 2, 'ae': 3, 'nb': 3, 'nc': 3, 'e': 4, 'z': 4, 'ne': 5, 'nz': 5,
+              'be': 6, 'na': 6, 'a': 7, 'nbe': 7, 's': 8, 'ns': 9, 'p': 10, 'pe': 10, 'np': 11, 'po': 11,
+              'l': 12, 'nge': 12, 'ge': 13, 'nl': 13, 'le': 14, 'ng': 14, 'g': 15, 'nle': 15}
+ARITHMETIC = {'add': 0, 'or': 1, 'adc': 2, 'sbb': 3, 'and': 4, 'sub': 5, 'xor': 6, 'cmp': 7}
+SHIFTS = {'rol': 0, 'ror': 1, 'shl': 4, 'sal': 4, 'shr': 5, 'sar': 7}
+UNARY = {'not': 2, 'neg': 3, 'mul': 4, 'div': 6, 'idiv': 7}
+# instructions without operands
+PLAIN = {'ret': b'\xc3', 'leave': b'\xc9', 'syscall': b'\x0f\x05', 'nop': b'\x90', 'cdq': b'\x99',
+         'cqo': b'\x48\x99', 'cdqe': b'\x48\x98', 'cwde': b'\x98', 'hlt': b'\xf4', 'ud2': b'\x0f\x0b'}
+DATA = {'db': 1, 'dw': 2, 'dd': 4, 'dq': 8}
+RESERVE = {'resb': 1, 'resw': 2, 'resd': 4, 'resq': 8}
+
+
+@dataclass(slots=True)
+class Register:
+    number: int
+    size: int
+
+
+@dataclass(slots=True)
+class Immediate:
+    value: int
+    symbol: Optional[str] = None  # the value is the address of symbol plus value
+
+
+@dataclass(slots=True)
+class Memory:
+    size: Optional[int]
+    base: Optional[int] = None
+    index: Optional[int] = None
+    scale: int = 1
+    disp: int = 0
+    symbol: Optional[str] = None  # added to disp
+    rip: bool = False             # `[rel symbol]`
+
+
+Operand = Union[Register, Immediate, Memory]
+
+
+@dataclass(slots=True)
+class Instruction:
+    mnemonic: str
+    operands: list[Operand]
+
+
+def parseNumber(text: str) -> Optional[int]:
+    text = text.strip()
+    sign = -1 if text.startswith('-') else 1
+    digits = text.lstrip('+-').strip()
+    if re.fullmatch(r'0[xX][0-9a-fA-F]+', digits):
+        return sign * int(digits, 16)
+    if re.fullmatch(r'[0-9]+', digits):
+        return sign * int(digits)
+    if re.fullmatch(r"'.'", digits):
+        return sign * ord(digits[1])
+    return None
+
+
+def splitOperands(text: str) -> list[str]:
+    ''' Split on the commas outside of quotes '''
+    parts, current, quote = [], '', None
+    for char in text:
+        if quote:
+            quote = None if char == quote else quote
+        elif char in '"\'`':
+            quote = char
+        elif char == ',':
+            parts.append(current.strip())
+            current = ''
+            continue
+        current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def stripComment(line: str) -> str:
+    quote = None
+    for i, char in enumerate(line):
+        if quote:
+            quote = None if char == quote else quote
+        elif char in '"\'`':
+            quote = char
+        elif char == ';':
+            return line[:i]
+    return line
+
+
+class Assembler:
+    '''
+    Assembles lines of NASM syntax into the bytes of .text and .data and the size of .bss.
+    Symbols are resolved when the executable is linked, by the fixups recorded while encoding.
+    '''
+    def __init__(self):
+        self.text = bytearray()
+        self.data = bytearray()
+        self.bss = 0
+        self.section = '.text'
+        self.symbols: dict[str, tuple[str, int]] = dict()  # label -> (section, offset)
+        self.constants: dict[str, int] = dict()            # `equ` values
+        self.fixups: list[tuple[str, int, str, str, int]] = []  # (section, offset, symbol, kind, addend)
+        self.globals: set[str] = set()
+        self.scope = ''  # last label without a dot, the owner of local labels
+
+    def assemble(self, lines):
+        ''' Assemble an iterable of chunks of source, each holding one or more lines '''
+        for chunk in lines:
+            for line in chunk.split('\n'):
+                self.line(line)
+        return self
+
+    def line(self, line: str):
+        line = stripComment(line).strip()
+        if not line:
+            return
+        words = line.split(None, 1)
+        if words[0] == 'section':
+            self.section = words[1].strip()
+            assert self.section in ('.text', '.data', '.bss'), f'Unknown section {self.section}'
+            return
+        if words[0] == 'global':
+            self.globals.update(name.strip() for name in words[1].split(','))
+            return
+        label = re.match(r'([A-Za-z_.$?@][\w.$?@#~]*)\s*:', line)
+        if label and not line.startswith('['):
+            name, line = label.group(1), line[label.end():].strip()
+            if line.split(None, 1)[:1] == ['equ']:
+                self.constants[self.scoped(name)] = self.expression(line.split(None, 1)[1])
+                return
+            if not name.startswith('.'):
+                self.scope = name
+            name = self.scoped(name)
+            assert name not in self.symbols, f'Label {name} is defined twice'
+            self.symbols[name] = (self.section, self.offset())
+            if not line:
+                return
+        mnemonic, _, rest = line.partition(' ')
+        mnemonic = mnemonic.lower()
+        if mnemonic in DATA:
+            return self.define(DATA[mnemonic], splitOperands(rest))
+        if mnemonic in RESERVE:
+            return self.reserve(RESERVE[mnemonic] * self.expression(rest))
+        if mnemonic == 'align':
+            return self.reserve(-self.offset() % self.expression(rest), fill=b'\x90')
+        assert self.section == '.text', f'Instruction {line!r} outside of .text'
+        self.encode(Instruction(mnemonic, [self.operand(text) for text in splitOperands(rest)]))
+
+    def scoped(self, name: str) -> str:
+        return self.scope + name if name.startswith('.') else name
+
+    def offset(self) -> int:
+        return {'.text': len(self.text), '.data': len(self.data), '.bss': self.bss}[self.section]
+
+    def expression(self, text: str) -> int:
+        ''' A number, an `equ` constant, or `$-label` (distance from label in this section) '''
+        text = text.strip()
+        value = parseNumber(text)
+        if value is not None:
+            return value
+        if text in self.constants:
+            return self.constants[text]
+        match = re.fullmatch(r'\$\s*-\s*([\w.$?@]+)', text)
+        if match:
+            section, offset = self.symbols[self.scoped(match.group(1))]
+            assert section == self.section, f'{text}: label in another section'
+            return self.offset() - offset
+        raise NotImplementedError(f'Expression {text!r} is not supported by the native backend')
+
+    def define(self, size: int, values: list[str]):
+        out = self.text if self.section == '.text' else self.data
+        assert self.section != '.bss', 'Data in .bss'
+        for value in values:
+            if value[0] in '"\'`':
+                assert size == 1, 'Strings are only supported in db'
+                out += value[1:-1].encode()
+                continue
+            number = parseNumber(value)
+            if number is None and value in self.constants:
+                number = self.constants[value]
+            if number is None:
+                assert size == 8, f'Address of {value} needs a dq'
+                self.fixups.append((self.section, len(out), self.scoped(value), 'abs64', 0))
+                number = 0
+            out += (number & (1 << 8 * size) - 1).to_bytes(size, 'little')
+
+    def reserve(self, size: int, fill=b'\x00'):
+        if self.section == '.bss':
+            self.bss += size
+        else:
+            (self.text if self.section == '.text' else self.data).extend(fill * size)
+
+    def operand(self, text: str) -> Operand:
+        text = text.strip()
+        size = None
+        words = text.split(None, 1)
+        if words[0].upper() in SIZES and len(words) == 2:
+            size, text = SIZES[words[0].upper()], words[1].strip()
+        if text.lower() in REGISTERS:
+            return Register(*REGISTERS[text.lower()])
+        if text.startswith('['):
+            assert text.endswith(']'), f'Unclosed memory operand {text}'
+            return self.memory(size, text[1:-1])
+        value = parseNumber(text)
+        if value is not None:
+            return Immediate(value)
+        if text in self.constants:
+            return Immediate(self.constants[text])
+        match = re.fullmatch(r'([A-Za-z_.$?@][\w.$?@#~]*)\s*(?:([+-])\s*(\w+))?', text)
+        if match:
+            offset = int(match.group(3), 0) * (-1 if match.group(2) == '-' else 1) if match.group(3) else 0
+            return Immediate(offset, self.scoped(match.group(1)))
+        raise NotImplementedError(f'Operand {text!r} is not supported by the native backend')
+
+    def memory(self, size: Optional[int], text: str) -> Memory:
+        memory = Memory(size)
+        text = text.strip()
+        if text.startswith('rel '):
+            memory.rip, text = True, text[4:]
+        for sign, term in re.findall(r'([+-]?)\s*([^+-]+)', text):
+            term = term.strip()
+            if '*' in term:
+                register, scale = [part.strip() for part in term.split('*')]
+                if register.isdigit():
+                    register, scale = scale, register
+                assert sign != '-' and memory.index is None, f'Bad index in [{text}]'
+                memory.index, memory.scale = REGISTERS[register.lower()][0], int(scale)
+            elif term.lower() in REGISTERS:
+                assert sign != '-', f'Negative register in [{text}]'
+                if memory.base is None:
+                    memory.base = REGISTERS[term.lower()][0]
+                else:
+                    assert memory.index is None, f'Too many registers in [{text}]'
+                    memory.index = REGISTERS[term.lower()][0]
+            elif parseNumber(term) is not None or term in self.constants:
+                value = parseNumber(term) if parseNumber(term) is not None else self.constants[term]
+                memory.disp += -value if sign == '-' else value
+            else:
+                assert sign != '-' and memory.symbol is None, f'Bad symbol in [{text}]'
+                memory.symbol = self.scoped(term)
+        assert not memory.rip or (memory.symbol and memory.base is None and memory.index is None), f'Bad [{text}]'
+        assert memory.index != 4, 'rsp can not be an index register'
+        return memory
+
+    def emit(self, opcode: bytes, reg: Union[int, Register], rm: Union[Register, Memory], size: int,
+             imm: bytes = b'', immFixup: Optional[tuple[str, int]] = None, wide=True):
+        '''
+        Append one instruction: prefixes, opcode, ModRM (SIB, displacement) for `reg` (a
+        register or an opcode extension) and `rm`, then imm. `wide` is false for instructions
+        whose operand size is 64 bits without REX.W (push, pop, call, jmp).
+        '''
+        out, fixups = bytearray(), []
+        regNumber = reg.number if isinstance(reg, Register) else reg
+        if size == 2:
+            out.append(0x66)
+        rex = 0x48 if size == 8 and wide else 0
+        if regNumber >= 8:
+            rex |= 0x44
+        if isinstance(rm, Register):
+            if rm.number >= 8:
+                rex |= 0x41
+        else:
+            if rm.index is not None and rm.index >= 8:
+                rex |= 0x42
+            if rm.base is not None and rm.base >= 8:
+                rex |= 0x41
+        # spl, bpl, sil and dil only exist with a REX prefix
+        for register in (reg, rm):
+            if isinstance(register, Register) and register.size == 1 and 4 <= register.number < 8:
+                rex |= 0x40
+        if rex:
+            out.append(rex)
+        out += opcode
+        self.modrm(out, fixups, regNumber, rm)
+        if immFixup:
+            fixups.append((len(out), immFixup[0], 'abs32', immFixup[1]))
+        out += imm
+        for position, symbol, kind, addend in fixups:
+            if kind == 'rel32':
+                addend -= len(out) - position  # relative to the end of the instruction
+            self.fixups.append(('.text', len(self.text) + position, symbol, kind, addend))
+        self.text += out
+
+    def emitRegister(self, opcode: int, register: Register, size: int, imm: bytes = b'',
+                     immFixup: Optional[tuple[str, int]] = None, wide=True):
+        ''' Append an instruction that adds the register number to its opcode, like push or mov reg, imm '''
+        out = bytearray(b'\x66' if size == 2 else b'')
+        rex = (0x48 if size == 8 and wide else 0) | (0x41 if register.number >= 8 else 0)
+        if size == 1 and 4 <= register.number < 8:
+            rex |= 0x40
+        if rex:
+            out.append(rex)
+        out.append(opcode + (register.number & 7))
+        if immFixup:
+            self.fixups.append(('.text', len(self.text) + len(out), immFixup[0], 'abs32', immFixup[1]))
+        self.text += out + imm
+
+    @staticmethod
+    def modrm(out: bytearray, fixups: list, reg: int, rm: Union[Register, Memory]):
+        reg = (reg & 7) << 3
+        if isinstance(rm, Register):
+            out.append(0xc0 | reg | rm.number & 7)
+            return
+        if rm.rip:
+            out.append(reg | 5)
+            fixups.append((len(out), rm.symbol, 'rel32', rm.disp))
+            out += bytes(4)
+            return
+        if rm.base is None:  # [disp32 + index*scale], no base
+            index = 4 if rm.index is None else rm.index & 7
+            out.append(reg | 4)
+            out.append(SCALES[rm.scale] << 6 | index << 3 | 5)
+            if rm.symbol:
+                fixups.append((len(out), rm.symbol, 'abs32', rm.disp))
+            out += struct.pack('<i', 0 if rm.symbol else rm.disp)
+            return
+        if rm.symbol:
+            mod = 2
+        elif rm.disp == 0 and rm.base & 7 != 5:  # rbp and r13 always need a displacement
+            mod = 0
+        elif -128 <= rm.disp < 128:
+            mod = 1
+        else:
+            mod = 2
+        if rm.index is None and rm.base & 7 != 4:  # rsp and r12 always need a SIB byte
+            out.append(mod << 6 | reg | rm.base & 7)
+        else:
+            index = 4 if rm.index is None else rm.index & 7
+            out.append(mod << 6 | reg | 4)
+            out.append(SCALES[rm.scale] << 6 | index << 3 | rm.base & 7)
+        if mod == 1:
+            out += struct.pack('<b', rm.disp)
+        elif mod == 2:
+            if rm.symbol:
+                fixups.append((len(out), rm.symbol, 'abs32', rm.disp))
+            out += struct.pack('<i', 0 if rm.symbol else rm.disp)
+
+    def encode(self, instruction: Instruction):
+        mnemonic, operands = instruction.mnemonic, instruction.operands
+        kinds = tuple(type(operand) for operand in operands)
+        first = operands[0] if operands else None
+
+        if mnemonic in PLAIN and not operands:
+            self.text += PLAIN[mnemonic]
+        elif mnemonic in ARITHMETIC and len(operands) == 2:
+            code = ARITHMETIC[mnemonic]
+            dst, src = operands
+            if isinstance(src, Immediate):
+                size = operandSize(dst)
+                if size == 1:
+                    self.emit(b'\x80', code, dst, size, immediate(src, 1))
+                elif src.symbol is None and -128 <= src.value < 128:
+                    self.emit(b'\x83', code, dst, size, immediate(src, 1))
+                else:
+                    self.emit(b'\x81', code, dst, size, *immediateField(src, min(size, 4)))
+            elif isinstance(src, Register):
+                size = sameSize(dst, src)
+                self.emit(bytes([code * 8 + (size != 1)]), src, dst, size)
+            else:
+                size = sameSize(dst, src)
+                self.emit(bytes([code * 8 + 2 + (size != 1)]), dst, src, size)
+        elif mnemonic in SHIFTS and len(operands) == 2:
+            code, (dst, count) = SHIFTS[mnemonic], operands
+            size = operandSize(dst)
+            byte = size == 1
+            if isinstance(count, Register):
+                assert count.number == 1 and count.size == 1, f'{mnemonic} shifts by an immediate or cl'
+                self.emit(b'\xd2' if byte else b'\xd3', code, dst, size)
+            elif count.value == 1:
+                self.emit(b'\xd0' if byte else b'\xd1', code, dst, size)
+            else:
+                self.emit(b'\xc0' if byte else b'\xc1', code, dst, size, immediate(count, 1))
+        elif mnemonic in UNARY and len(operands) == 1 or mnemonic == 'imul' and len(operands) == 1:
+            size = operandSize(first)
+            self.emit(b'\xf6' if size == 1 else b'\xf7', UNARY.get(mnemonic, 5), first, size)
+        elif mnemonic in ('inc', 'dec') and len(operands) == 1:
+            size = operandSize(first)
+            self.emit(b'\xfe' if size == 1 else b'\xff', mnemonic == 'dec', first, size)
+        elif mnemonic == 'imul':
+            dst, src = operands[0], operands[1]
+            size = sameSize(dst, src)
+            if len(operands) == 2:
+                self.emit(b'\x0f\xaf', dst, src, size)
+            elif -128 <= operands[2].value < 128:
+                self.emit(b'\x6b', dst, src, size, immediate(operands[2], 1))
+            else:
+                self.emit(b'\x69', dst, src, size, immediate(operands[2], min(size, 4)))
+        elif mnemonic == 'mov':
+            self.move(*operands)
+        elif mnemonic in ('movzx', 'movsx', 'movsxd'):
+            dst, src = operands
+            source = operandSize(src)
+            if source == 4:
+                assert mnemonic != 'movzx', 'movzx from a dword, use mov'
+                self.emit(b'\x63', dst, src, dst.size)
+            else:
+                opcode = {('movzx', 1): b'\x0f\xb6', ('movzx', 2): b'\x0f\xb7',
+                          ('movsx', 1): b'\x0f\xbe', ('movsx', 2): b'\x0f\xbf'}[mnemonic, source]
+                self.emit(opcode, dst, src, dst.size)
+        elif mnemonic == 'lea':
+            self.emit(b'\x8d', operands[0], operands[1], operands[0].size)
+        elif mnemonic == 'test':
+            dst, src = operands
+            if isinstance(src, Immediate):
+                size = operandSize(dst)
+                self.emit(b'\xf6' if size == 1 else b'\xf7', 0, dst, size, immediate(src, min(size, 4)))
+            else:
+                size = sameSize(dst, src)
+                self.emit(b'\x84' if size == 1 else b'\x85', src, dst, size)
+        elif mnemonic == 'xchg':
+            dst, src = operands if isinstance(operands[0], Memory) else operands[::-1]
+            size = sameSize(dst, src)
+            self.emit(b'\x86' if size == 1 else b'\x87', src, dst, size)
+        elif mnemonic == 'push':
+            if isinstance(first, Register):
+                self.emitRegister(0x50, first, 8, wide=False)
+            elif isinstance(first, Memory):
+                self.emit(b'\xff', 6, first, 8, wide=False)
+            elif first.symbol is None and -128 <= first.value < 128:
+                self.text += b'\x6a' + immediate(first, 1)
+            else:
+                imm, fixup = immediateField(first, 4)
+                if fixup:
+                    self.fixups.append(('.text', len(self.text) + 1, fixup[0], 'abs32', fixup[1]))
+                self.text += b'\x68' + imm
+        elif mnemonic == 'pop':
+            if isinstance(first, Register):
+                self.emitRegister(0x58, first, 8, wide=False)
+            else:
+                self.emit(b'\x8f', 0, first, 8, wide=False)
+        elif mnemonic in ('jmp', 'call') or mnemonic[0] == 'j' and mnemonic[1:] in CONDITIONS:
+            if isinstance(first, Immediate):
+                assert first.symbol, f'{mnemonic} to an absolute address'
+                if mnemonic == 'jmp':
+                    opcode = b'\xe9'
+                elif mnemonic == 'call':
+                    opcode = b'\xe8'
+                else:
+                    opcode = bytes([0x0f, 0x80 + CONDITIONS[mnemonic[1:]]])
+                self.text += opcode
+                self.fixups.append(('.text', len(self.text), first.symbol, 'rel32', first.value - 4))
+                self.text += bytes(4)
+            else:
+                assert mnemonic in ('jmp', 'call'), f'{mnemonic} needs a label'
+                self.emit(b'\xff', 4 if mnemonic == 'jmp' else 2, first, 8, wide=False)
+        elif mnemonic.startswith('cmov') and mnemonic[4:] in CONDITIONS:
+            dst, src = operands
+            self.emit(bytes([0x0f, 0x40 + CONDITIONS[mnemonic[4:]]]), dst, src, sameSize(dst, src))
+        elif mnemonic.startswith('set') and mnemonic[3:] in CONDITIONS:
+            assert operandSize(first) == 1, f'{mnemonic} sets a byte'
+            self.emit(bytes([0x0f, 0x90 + CONDITIONS[mnemonic[3:]]]), 0, first, 1)
+        else:
+            raise NotImplementedError(f'Instruction {mnemonic} {kinds} is not supported by the native backend')
+
+    def move(self, dst: Operand, src: Operand):
+        if isinstance(src, Immediate):
+            size = operandSize(dst)
+            if isinstance(dst, Memory):
+                self.emit(b'\xc6' if size == 1 else b'\xc7', 0, dst, size, *immediateField(src, min(size, 4)))
+            elif size == 8 and src.symbol is None and 0 <= src.value < 1 << 32:
+                # a 32 bit move clears the upper half, the same value in fewer bytes
+                self.emitRegister(0xb8, dst, 4, immediate(src, 4))
+            elif size == 8 and (src.symbol or -1 << 31 <= src.value < 0):
+                self.emit(b'\xc7', 0, dst, 8, *immediateField(src, 4))
+            elif size == 8:
+                self.emitRegister(0xb8, dst, 8, immediate(src, 8))
+            else:
+                self.emitRegister(0xb0 if size == 1 else 0xb8, dst, size, *immediateField(src, size))
+        elif isinstance(src, Register):
+            size = sameSize(dst, src)
+            self.emit(b'\x88' if size == 1 else b'\x89', src, dst, size)
+        else:
+            size = sameSize(dst, src)
+            self.emit(b'\x8a' if size == 1 else b'\x8b', dst, src, size)
+
+    def link(self, entry='_start') -> bytes:
+        ''' Lay out the sections, resolve the fixups and return the bytes of the executable '''
+        headers = 64 + 56 * 3
+        textAddress = BASE_ADDRESS + headers
+        dataOffset = align(headers + len(self.text), 16)
+        # a segment's address and file offset must be equal modulo the page size
+        dataAddress = align(BASE_ADDRESS + dataOffset, PAGE) + dataOffset % PAGE
+        bssAddress = align(dataAddress + len(self.data), 16)
+        bases = {'.text': textAddress, '.data': dataAddress, '.bss': bssAddress}
+
+        def address(symbol):
+            if symbol in self.constants:
+                return self.constants[symbol]
+            if symbol not in self.symbols:
+                raise NotImplementedError(f'Undefined symbol {symbol!r} in the native backend')
+            section, offset = self.symbols[symbol]
+            return bases[section] + offset
+
+        for section, offset, symbol, kind, addend in self.fixups:
+            out = self.text if section == '.text' else self.data
+            value = address(symbol) + addend
+            if kind == 'rel32':
+                value -= bases[section] + offset
+            if kind == 'abs64':
+                out[offset:offset + 8] = struct.pack('<Q', value)
+            else:
+                assert -1 << 31 <= value < 1 << 31, f'{symbol} is out of reach of a 32 bit {kind}'
+                out[offset:offset + 4] = struct.pack('<i', value)
+
+        header = struct.pack('<4sBBBBB7sHHIQQQIHHHHHH', b'\x7fELF', 2, 1, 1, 0, 0, bytes(7),
+                             2, 0x3e, 1, address(entry), 64, 0, 0, 64, 56, 3, 64, 0, 0)
+        PT_LOAD, PT_GNU_STACK = 1, 0x6474e551
+        text = struct.pack('<IIQQQQQQ', PT_LOAD, 5, 0, BASE_ADDRESS, BASE_ADDRESS,
+                           headers + len(self.text), headers + len(self.text), PAGE)
+        data = struct.pack('<IIQQQQQQ', PT_LOAD, 6, dataOffset, dataAddress, dataAddress,
+                           len(self.data), bssAddress - dataAddress + self.bss, PAGE)
+        stack = struct.pack('<IIQQQQQQ', PT_GNU_STACK, 6, 0, 0, 0, 0, 0, 16)
+        padding = bytes(dataOffset - headers - len(self.text))
+        return header + text + data + stack + self.text + padding + self.data
+
+
+def operandSize(operand: Operand) -> int:
+    assert operand.size, f'Operation size not specified for {operand}'
+    return operand.size
+
+
+def sameSize(a: Operand, b: Operand) -> int:
+    sizes = {operand.size for operand in (a, b) if operand.size}
+    assert len(sizes) == 1, f'Operand sizes do not match: {a}, {b}'
+    return sizes.pop()
+
+
+def immediate(operand: Immediate, size: int) -> bytes:
+    assert operand.symbol is None, f'{operand.symbol} in a {size} byte immediate'
+    value = operand.value
+    assert -1 << 8 * size - 1 <= value < 1 << 8 * size, f'Immediate {value} does not fit in {size} bytes'
+    return (value & (1 << 8 * size) - 1).to_bytes(size, 'little')
+
+
+def immediateField(operand: Immediate, size: int) -> tuple[bytes, Optional[tuple[str, int]]]:
+    ''' The bytes of an immediate and the (symbol, addend) to fix it up with, for Assembler.emit '''
+    if operand.symbol:
+        assert size == 4, f'Address of {operand.symbol} in a {size} byte immediate'
+        return bytes(4), (operand.symbol, operand.value)
+    return immediate(operand, size), None
+
+
+def align(value: int, alignment: int) -> int:
+    return value + -value % alignment
+
+
+def writeExecutable(path: str, lines):
+    ''' Assemble the lines of an Emitter and write them to path as a static executable '''
+    executable = Assembler().assemble(lines).link()
+    with open(path, 'wb') as file:
+        file.write(executable)
+    os.chmod(path, 0o755)
@@ -1,6 +1,43 @@
 import os
 import subprocess
 import sys
+import tempfile
+
+from src.cache import IncludeCache
+
+# Every program is also built with the native backend, which must behave the same as nasm.
+# Programs that do not exit by themselves (examples/gol.pasic) only have to keep running
+# for this many seconds with both.
+DIFFERENTIAL_TIMEOUT = 5
+
+def build_and_run(pasic_path, executable, backend, timeout=None):
+    '''
+    Compile with the given backend and run the executable. Returns the finished process, the
+    string "timeout" if it was still running after `timeout` seconds, or an error message.
+    '''
+    compile_process = subprocess.run(
+        ["python3", "pasic.py", pasic_path, f"--backend={backend}"],
+        capture_output=True,
+        text=True
+    )
+    if compile_process.returncode != 0:
+        return f"Compilation failed ({backend}):\n\n {compile_process.stderr.strip()}\n"
+
+    executable_path = f"./{executable}"
+    if not os.path.isfile(executable_path):
+        return f"Executable '{executable}' not found after compilation ({backend})."
+
+    try:
+        return subprocess.run(
+            [executable_path],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        return "timeout"
+    finally:
+        subprocess.run(["rm", "-f", f"{executable}", f"{executable}.asm", f"{executable}.o"])
 
 def run_tests(dirname):
     # Get all .pasic files in the directory
@@ -13,63 +50,84 @@ def run_tests(dirname):
         pasic_path = os.path.join(dirname, pasic_file)
         ans_file = pasic_file.replace(".pasic", ".ans")
         ans_path = os.path.join(dirname, ans_file)
+        # Determine the name of the generated executable
+        executable = pasic_file.removesuffix(".pasic")
+        has_answer = os.path.isfile(ans_path)
 
-        if not os.path.isfile(ans_path):
-            print(f"Answer file missing for '{pasic_file}', skipping test.")
-            continue
+        if not has_answer:
+            print(f"Answer file missing for '{pasic_file}', only comparing the backends.")
 
         try:
+            matches_answer = True
+            timeout = None if has_answer else DIFFERENTIAL_TIMEOUT
             # Run "python pasic.py [filename]"
-            compile_process = subprocess.run(
-                ["python3", "pasic.py", pasic_path],
-                capture_output=True,
-                text=True
-            )
-
-            if compile_process.returncode != 0:
-                print(f"Compilation failed for '{pasic_file}':\n\n {compile_process.stderr.strip()}\n")
+            run_process = build_and_run(pasic_path, executable, "nasm", timeout)
+            if isinstance(run_process, str) and run_process != "timeout":
+                print(f"{run_process} ('{pasic_file}')")
                 failed_tests.append(pasic_file)
                 continue
 
-            # Determine the name of the generated executable
-            executable = pasic_file.removesuffix(".pasic")
-            executable_path = f"./{executable}"
+            if has_answer:
+                if run_process.returncode != 0:
+                    print(f"Execution failed for '{executable}':\n\n {run_process.stderr.strip()}\n")
+                    failed_tests.append(pasic_file)
+                    continue
 
-            if not os.path.isfile(executable_path):
-                print(f"Executable '{executable}' not found after compilation, skipping test.")
-                failed_tests.append(pasic_file)
-                continue
-
-            # Run the generated executable and capture its output
-            run_process = subprocess.run(
-                [executable_path],
-                capture_output=True,
-                text=True
-            )
+                # Compare the output with the answer file
+                output = run_process.stdout.strip()
+                with open(ans_path, "r") as ans_file:
+                    expected_output = ans_file.read().strip()
 
-            if run_process.returncode != 0:
-                print(f"Execution failed for '{executable}':\n\n {run_process.stderr.strip()}\n")
-                failed_tests.append(pasic_file)
-                continue
+                if output != expected_output:
+                    print(f"Test failed for '{pasic_file}':\n\n Output does not match answer file.\n")
+                    failed_tests.append(pasic_file)
+                    matches_answer = False
 
-            # Compare the output with the answer file
-            output = run_process.stdout.strip()
-            with open(ans_path, "r") as ans_file:
-                expected_output = ans_file.read().strip()
-
-            if output != expected_output:
-                print(f"Test failed for '{pasic_file}':\n\n Output does not match answer file.\n")
-                failed_tests.append(pasic_file)
+            native_process = build_and_run(pasic_path, executable, "native", timeout)
+            if run_process == "timeout" or native_process == "timeout":
+                same = run_process == native_process
             else:
+                same = not isinstance(native_process, str) and \
+                    (run_process.stdout, run_process.returncode) == (native_process.stdout, native_process.returncode)
+            if not same:
+                detail = native_process if isinstance(native_process, str) else "Output or exit code differs from nasm."
+                print(f"Backends differ for '{pasic_file}':\n\n {detail}\n")
+                if matches_answer:
+                    failed_tests.append(pasic_file)
+            elif matches_answer and run_process == "timeout":
+                print(f"Test passed for '{pasic_file}' (both backends still running after {timeout}s).")
+            elif matches_answer:
                 print(f"Test passed for '{pasic_file}'.")
-
-            delete_files = subprocess.run(["rm", f"{executable}", f"{executable}.asm", f"{executable}.o"])
-            if delete_files.returncode != 0:
-                print(f"Failed to delete output files, but doesn't matter.")
         except Exception as e:
             print(f"An error occurred while testing '{pasic_file}': {e}")
             failed_tests.append(pasic_file)
 
+    return failed_tests
+
+def test_cache_eviction():
+    '''
+    Eviction removes the entries of other compiler versions from the cache directory, and
+    nothing else: PASIC_CACHE_DIR may point at a directory shared with other files
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        cache = IncludeCache(directory)
+        stale = os.path.join(directory, f"{'0' * 16}-{'0' * 64}")
+        foreign = os.path.join(directory, "notes.txt")
+        for path in (stale, foreign):
+            with open(path, "w") as file:
+                file.write("")
+        cache.evict()
+        if os.path.exists(stale) or not os.path.exists(foreign):
+            print("Test failed for the include cache:\n\n Eviction removed other files or kept stale entries.\n")
+            return ["cache eviction"]
+    print("Test passed for the include cache eviction.")
+    return []
+
+if __name__ == "__main__":
+    failed_tests = test_cache_eviction()
+    for dirname in sys.argv[1:]:
+        failed_tests += run_tests(dirname)
+
     # Summary
     if failed_tests:
         print("\nTests completed with failures:")
@@ -77,7 +135,3 @@ def run_tests(dirname):
             print(f" - {test}")
     else:
         print("\nAll tests passed successfully.")
-
-if __name__ == "__main__":
-    dirname = sys.argv[1]
-    run_tests(dirname)